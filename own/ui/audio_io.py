@@ -0,0 +1,109 @@
+"""Single-pass audio decoding through ffmpeg, and WAV encoding for streaming.
+
+The input is decoded once, straight to mono float32 PCM at the sample rate
+of the model, and read from ffmpeg's stdout as it is produced.
+"""
+
+import subprocess
+from collections.abc import Iterator
+
+import numpy as np
+import torch
+
+
+def ffmpeg_decode_cmd(path, sample_rate: int) -> list[str]:
+    return [
+        "ffmpeg",
+        "-v",
+        "error",
+        "-nostdin",
+        "-i",
+        str(path),
+        "-f",
+        "f32le",
+        "-ac",
+        "1",
+        "-ar",
+        str(sample_rate),
+        "pipe:1",
+    ]
+
+
+def stream_pcm(path, sample_rate: int, chunk_samples: int) -> Iterator[torch.Tensor]:
+    """Yields `[1, chunk_samples]` float32 chunks (the last one may be shorter).
+
+    Only one chunk is held in memory at a time, closing the generator stops ffmpeg.
+    """
+    proc = subprocess.Popen(
+        ffmpeg_decode_cmd(path, sample_rate),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    chunk_bytes = 4 * chunk_samples
+    try:
+        while True:
+            data = proc.stdout.read(chunk_bytes)
+            if not data:
+                break
+            # A read can stop in the middle of a sample, complete it.
+            while len(data) % 4 != 0:
+                more = proc.stdout.read(4 - len(data) % 4)
+                if not more:
+                    data = data[: len(data) - len(data) % 4]
+                    break
+                data += more
+            if data:
+                yield torch.from_numpy(np.frombuffer(data, dtype=np.float32).copy())[
+                    None
+                ]
+        proc.wait()
+        if proc.returncode != 0:
+            stderr = proc.stderr.read().decode(errors="replace")
+            raise RuntimeError(f"ffmpeg failed to decode {path}: {stderr}")
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+        proc.stdout.close()
+        proc.stderr.close()
+
+
+def decode_pcm(path, sample_rate: int) -> torch.Tensor:
+    """Decodes the whole file to a `[1, T]` float32 tensor."""
+    result = subprocess.run(ffmpeg_decode_cmd(path, sample_rate), capture_output=True)
+    if result.returncode != 0:
+        stderr = result.stderr.decode(errors="replace")
+        raise RuntimeError(f"ffmpeg failed to decode {path}: {stderr}")
+    return torch.from_numpy(np.frombuffer(result.stdout, dtype=np.float32).copy())[None]
+
+
+def streaming_wav_header(sample_rate: int, num_channels: int = 1) -> bytes:
+    """Header of a 16-bit PCM WAV whose length is not known yet.
+
+    The RIFF and data sizes are set to their maximum, which browsers accept
+    and play as the data arrives.
+    """
+    bytes_per_sample = 2
+    block_align = num_channels * bytes_per_sample
+    return b"".join(
+        [
+            b"RIFF",
+            (0xFFFFFFFF).to_bytes(4, "little"),
+            b"WAVE",
+            b"fmt ",
+            (16).to_bytes(4, "little"),
+            (1).to_bytes(2, "little"),  # PCM
+            num_channels.to_bytes(2, "little"),
+            sample_rate.to_bytes(4, "little"),
+            (sample_rate * block_align).to_bytes(4, "little"),
+            block_align.to_bytes(2, "little"),
+            (8 * bytes_per_sample).to_bytes(2, "little"),
+            b"data",
+            (0xFFFFFFFF).to_bytes(4, "little"),
+        ]
+    )
+
+
+def pcm16_bytes(pcm: np.ndarray) -> bytes:
+    """Float PCM in [-1, 1] to little-endian 16-bit samples."""
+    return (np.clip(pcm, -1, 1) * 32767).astype("<i2").tobytes()
@@ -0,0 +1,253 @@
+"""Cross-session dynamic batching for the resident STT models.
+
+Like the `BatchedAsr` module of the Rust server, each model runs a single
+batched streaming session with `batch_size` slots. Transcriptions are assigned
+to free slots as they arrive (the slot state is reset with a `reset_mask`, or
+restored from a snapshot taken after the silence prefix),
+every step encodes one frame for all the busy slots, and the text tokens of
+each slot are routed back to the job that owns it. Slots that are free, or
+whose job has no audio ready yet, sit out the step through the `exec_mask`.
+"""
+
+import logging
+import queue
+import threading
+import time
+from collections.abc import Callable, Iterator
+
+import torch
+
+# `scripts/` is on the path, see `stt_worker`.
+from dsm import profiling
+
+logger = logging.getLogger(__name__)
+
+
+class SttJob:
+    """One transcription occupying a slot of the batched session.
+
+    Frames (`[1, 1, frame_size]` float tensors at the model sample rate) are
+    pushed by the caller with `put_frame`, text tokens come back through
+    `iter_tokens` in the order they were produced.
+
+    Args:
+        max_buffered_frames: bound on the frames waiting to be consumed by the
+            scheduler, 0 for no bound (e.g. when the whole audio is in memory).
+    """
+
+    def __init__(self, max_buffered_frames: int = 0):
+        self._frames: queue.Queue = queue.Queue(maxsize=max_buffered_frames)
+        self._tokens: queue.Queue = queue.Queue()
+        self.cancelled = threading.Event()
+        self.steps = 0
+        self.error: BaseException | None = None
+
+    def put_frame(self, frame: torch.Tensor) -> bool:
+        """Blocks while the buffer is full, returns False if the job was cancelled."""
+        while not self.cancelled.is_set():
+            try:
+                self._frames.put(frame, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def end_of_audio(self) -> None:
+        self.put_frame(None)
+
+    def cancel(self) -> None:
+        self.cancelled.set()
+
+    def iter_tokens(
+        self, should_stop: Callable[[], bool] | None = None
+    ) -> Iterator[list[int]]:
+        """Yields lists of text tokens until the job is done.
+
+        If `should_stop` returns True, the job is cancelled and its slot freed.
+        """
+        while True:
+            try:
+                tokens = self._tokens.get(timeout=0.1)
+            except queue.Empty:
+                if should_stop is not None and should_stop():
+                    self.cancel()
+                    return
+                continue
+            if tokens is None:
+                if self.error is not None:
+                    raise self.error
+                return
+            yield tokens
+
+
+class BatchedSttScheduler:
+    """Runs `mimi` and `lm_gen` over a fixed number of slots shared by all jobs.
+
+    `lm_gen` should be built with `support_out_of_sync=True`, so that a slot
+    (re)starting does not hold back the outputs of the others.
+
+    Args:
+        batch_size: number of slots, i.e. of concurrent transcriptions.
+        flush_every: text tokens are moved to the CPU and routed every that
+            many steps, to avoid a device sync per step.
+        prefix: if set, a new job starts from this `dsm.StreamingSnapshot`
+            (taken with a batch size of 1) and its frames should leave out the
+            prefix, e.g. `Transcriber.silence_snapshot()`.
+    """
+
+    def __init__(
+        self, mimi, lm_gen, batch_size: int = 8, flush_every: int = 25, prefix=None
+    ):
+        self.mimi = mimi
+        self.lm_gen = lm_gen
+        self.prefix = prefix
+        self._prefix_tokens: list[int] = []
+        if prefix is not None:
+            ungenerated = lm_gen.lm_model.ungenerated_token_id
+            tokens = prefix.tokens.view(-1).tolist()
+            self._prefix_tokens = [token for token in tokens if token != ungenerated]
+        self.batch_size = batch_size
+        self.flush_every = flush_every
+        self.device = next(iter(mimi.parameters())).device
+        self._waiting: queue.Queue[SttJob] = queue.Queue()
+        self._slots: list[SttJob | None] = [None] * batch_size
+        self._thread: threading.Thread | None = None
+        self._start_lock = threading.Lock()
+        self.steps = 0
+
+    def submit(self, job: SttJob) -> SttJob:
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="stt-scheduler", daemon=True
+                )
+                self._thread.start()
+        self._waiting.put(job)
+        return job
+
+    def status(self) -> dict:
+        return {
+            "batch_size": self.batch_size,
+            "active_slots": sum(job is not None for job in self._slots),
+            "waiting": self._waiting.qsize(),
+            "steps": self.steps,
+        }
+
+    def _admit(self) -> torch.Tensor:
+        """Moves waiting jobs into free slots, returns the mask of new slots.
+
+        When all the slots are free, this blocks until a job arrives.
+        """
+        reset_mask = torch.zeros(self.batch_size, dtype=torch.bool)
+        block = all(job is None for job in self._slots)
+        for index in range(self.batch_size):
+            if self._slots[index] is not None:
+                continue
+            while True:
+                try:
+                    job = self._waiting.get(block=block)
+                except queue.Empty:
+                    return reset_mask
+                if not job.cancelled.is_set():
+                    break
+                job._tokens.put(None)
+            block = False
+            self._slots[index] = job
+            reset_mask[index] = True
+        return reset_mask
+
+    def _flush(self, buffered: list) -> None:
+        if not buffered:
+            return
+        ungenerated = self.lm_gen.lm_model.ungenerated_token_id
+        with profiling.span("to_host"):
+            all_tokens = (
+                torch.stack([tokens for tokens, _, _ in buffered]).cpu().tolist()
+            )
+        routed: dict[int, tuple[SttJob, list[int]]] = {}
+        for step_tokens, (_, exec_mask, slots) in zip(all_tokens, buffered):
+            for index, job in enumerate(slots):
+                if job is None or not exec_mask[index]:
+                    continue
+                token = step_tokens[index]
+                if token == ungenerated:
+                    # First steps after a reset, before the LM delay is filled.
+                    continue
+                routed.setdefault(id(job), (job, []))[1].append(token)
+        for job, tokens in routed.values():
+            job._tokens.put(tokens)
+        buffered.clear()
+
+    def _release(self, index: int, buffered: list, error=None) -> None:
+        job = self._slots[index]
+        assert job is not None
+        self._flush(buffered)
+        job.error = error
+        job._tokens.put(None)
+        self._slots[index] = None
+
+    @torch.no_grad()
+    def _run(self) -> None:
+        mimi, lm_gen = self.mimi, self.lm_gen
+        batch_size, frame_size = self.batch_size, mimi.frame_size
+        buffered = []
+        with mimi.streaming(batch_size), lm_gen.streaming(batch_size):
+            while True:
+                reset_mask = self._admit()
+                if reset_mask.any() and self.prefix is not None:
+                    slots = reset_mask.nonzero()[:, 0].tolist()
+                    with profiling.span("restore"):
+                        self.prefix.restore(mimi, lm_gen, slots)
+                    for index in slots:
+                        job = self._slots[index]
+                        job.steps += self.prefix.frames
+                        if self._prefix_tokens:
+                            job._tokens.put(list(self._prefix_tokens))
+                elif reset_mask.any():
+                    # The masks are combined with the streaming state, on the model device.
+                    mimi.reset_streaming(reset_mask.to(self.device))
+                    lm_gen.reset_streaming(reset_mask.to(self.device))
+
+                batch = torch.zeros((batch_size, 1, frame_size), dtype=torch.float32)
+                exec_mask = torch.zeros(batch_size, dtype=torch.bool)
+                for index, job in enumerate(self._slots):
+                    if job is None:
+                        continue
+                    if job.cancelled.is_set():
+                        self._release(index, buffered)
+                        continue
+                    try:
+                        frame = job._frames.get_nowait()
+                    except queue.Empty:
+                        # The audio of this job is not ready yet, it sits out this step.
+                        continue
+                    if frame is None:
+                        self._release(index, buffered)
+                        continue
+                    batch[index] = frame.view(1, frame_size)
+                    exec_mask[index] = True
+                    job.steps += 1
+
+                if not exec_mask.any():
+                    time.sleep(0.005)
+                    continue
+
+                try:
+                    mimi.set_exec_mask(exec_mask.to(self.device))
+                    lm_gen.set_exec_mask(exec_mask.to(self.device))
+                    with profiling.span("to_device"):
+                        batch = batch.to(self.device)
+                    with profiling.span("mimi.encode"):
+                        audio_tokens = mimi.encode(batch)
+                    with profiling.span("lm_gen.step"):
+                        text_tokens = lm_gen.step(audio_tokens)
+                except Exception as e:
+                    logger.exception("Batched STT step failed")
+                    for index, job in enumerate(self._slots):
+                        if job is not None:
+                            self._release(index, buffered, error=e)
+                    continue
+                self.steps += 1
+                buffered.append((text_tokens[:, 0, 0], exec_mask, list(self._slots)))
+                if len(buffered) >= self.flush_every:
+                    self._flush(buffered)
@@ -0,0 +1,87 @@
+"""Bounded executor for the inference jobs of the UI server.
+
+Every transcription runs on a fixed pool of workers, with a bounded number of
+jobs waiting for a worker. Past that, new jobs are refused with `JobsBusy`,
+which the server turns into a `429 Too Many Requests` with a `Retry-After`
+estimated from the recent job durations, so that a burst of uploads queues up
+or is pushed back instead of oversubscribing the machine.
+"""
+
+import math
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class JobsBusy(Exception):
+    def __init__(self, retry_after: int):
+        super().__init__(f"Too many jobs in progress, retry in {retry_after} seconds")
+        self.retry_after = retry_after
+
+
+class JobLimiter:
+    """
+    Args:
+        max_concurrent: number of jobs running at the same time.
+        max_queued: number of jobs waiting for a worker, beyond which
+            submissions are rejected.
+    """
+
+    def __init__(self, max_concurrent: int = 2, max_queued: int = 8):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_concurrent, thread_name_prefix="job"
+        )
+        self._lock = threading.Lock()
+        self.running = 0
+        self.queued = 0
+        self.completed = 0
+        self.rejected = 0
+        # Moving average of the job durations, used for Retry-After.
+        self._average_seconds = 10.0
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        """Schedules `fn(*args, **kwargs)`, raises `JobsBusy` when the queue is full."""
+        with self._lock:
+            if self.running + self.queued >= self.max_concurrent + self.max_queued:
+                self.rejected += 1
+                raise JobsBusy(self._retry_after())
+            self.queued += 1
+        return self._executor.submit(self._run, fn, args, kwargs)
+
+    def run(self, fn: Callable, *args, **kwargs):
+        """Same as `submit` but waits for the result, for request handlers."""
+        return self.submit(fn, *args, **kwargs).result()
+
+    def _run(self, fn: Callable, args, kwargs):
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+        start = time.time()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            elapsed = time.time() - start
+            with self._lock:
+                self.running -= 1
+                self.completed += 1
+                self._average_seconds = 0.8 * self._average_seconds + 0.2 * elapsed
+
+    def _retry_after(self) -> int:
+        # Time for the jobs ahead to drain, one wave of workers at a time.
+        waves = (self.queued + 1) / self.max_concurrent
+        return max(1, math.ceil(waves * self._average_seconds))
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "max_concurrent": self.max_concurrent,
+                "max_queued": self.max_queued,
+                "running": self.running,
+                "queued": self.queued,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "average_job_seconds": round(self._average_seconds, 2),
+            }
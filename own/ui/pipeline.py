@@ -0,0 +1,144 @@
+"""Producer/consumer helper to overlap audio decoding with inference."""
+
+import queue
+import threading
+import time
+from collections.abc import Callable, Iterable, Iterator
+
+_DONE = object()
+
+
+class _Error:
+    def __init__(self, exc: BaseException):
+        self.exc = exc
+
+
+class Prefetcher:
+    """Pulls items from `source` in a background thread into a bounded queue.
+
+    While the consumer works on item k, the producer is already preparing the
+    next ones, at most `maxsize` ahead so that memory stays bounded. Time spent
+    in each stage is recorded to compare with running both stages in sequence.
+
+    Args:
+        source: iterable run in the producer thread.
+        maxsize: maximum number of items prepared ahead of the consumer.
+        on_item: called from the producer thread for each produced item.
+    """
+
+    def __init__(
+        self,
+        source: Iterable,
+        maxsize: int = 4,
+        on_item: Callable[[object], None] | None = None,
+        name: str = "prefetcher",
+    ):
+        self._source = source
+        self._queue: queue.Queue = queue.Queue(maxsize=maxsize)
+        self._on_item = on_item
+        self._stop = threading.Event()
+        self.produced = 0
+        self.producer_seconds = 0.0
+        self.consumer_wait_seconds = 0.0
+        self._thread = threading.Thread(target=self._produce, name=name, daemon=True)
+        self._thread.start()
+
+    def _put(self, item) -> bool:
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self) -> None:
+        try:
+            iterator = iter(self._source)
+            while not self._stop.is_set():
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                self.producer_seconds += time.perf_counter() - start
+                self.produced += 1
+                if self._on_item is not None:
+                    self._on_item(item)
+                if not self._put(item):
+                    return
+        except BaseException as exc:
+            self._put(_Error(exc))
+            return
+        self._put(_DONE)
+
+    def __iter__(self) -> Iterator:
+        while True:
+            start = time.perf_counter()
+            while True:
+                try:
+                    item = self._queue.get(timeout=0.1)
+                    break
+                except queue.Empty:
+                    if self._stop.is_set():
+                        return
+            self.consumer_wait_seconds += time.perf_counter() - start
+            if item is _DONE:
+                return
+            if isinstance(item, _Error):
+                raise item.exc
+            yield item
+
+    def qsize(self) -> int:
+        return self._queue.qsize()
+
+    def close(self) -> None:
+        """Stops the producer, e.g. when the consumer was cancelled."""
+        self._stop.set()
+        self._thread.join()
+        close = getattr(self._source, "close", None)
+        if close is not None:
+            close()
+
+
+class InlineSource:
+    """Same interface as `Prefetcher` but pulls items in the consumer thread.
+
+    This is the sequential baseline: the consumer waits for each item to be
+    prepared before working on it.
+    """
+
+    def __init__(
+        self,
+        source: Iterable,
+        on_item: Callable[[object], None] | None = None,
+    ):
+        self._source = source
+        self._on_item = on_item
+        self.produced = 0
+        self.producer_seconds = 0.0
+        self.consumer_wait_seconds = 0.0
+
+    def __iter__(self) -> Iterator:
+        iterator = iter(self._source)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            elapsed = time.perf_counter() - start
+            self.producer_seconds += elapsed
+            self.consumer_wait_seconds += elapsed
+            self.produced += 1
+            if self._on_item is not None:
+                self._on_item(item)
+            yield item
+
+    def qsize(self) -> int:
+        return 0
+
+    def close(self) -> None:
+        close = getattr(self._source, "close", None)
+        if close is not None:
+            close()
@@ -80,7 +80,8 @@ async function runTTS() {
     audioEl.style.display = 'none';
     
     try {
-        const response = await fetch('/api/tts', {
+        // The audio URL streams the WAV while it is generated (or serves it from the cache)
+        const response = await fetch('/api/tts-stream', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
@@ -91,15 +92,16 @@ async function runTTS() {
         const data = await response.json();
         
         if (response.ok && data.success) {
-            // Display the audio player
+            // Display the audio player and start playback as soon as data arrives
             audioEl.src = data.audio_url;
             audioEl.style.display = 'block';
+            audioEl.play().catch(() => {});
             
             // Show the command that was executed
-            const command = `# Generated audio: ${data.audio_url}\n# Command executed:\nuv run scripts/tts_pytorch.py [input] [output]`;
+            const command = `# Generated audio: ${data.audio_url}${data.cached ? ' (cached)' : ''}\n# Command executed:\nuv run scripts/tts_pytorch.py [input] [output]`;
             commandEl.textContent = command;
             
-            showMessage('Audio generated successfully! Click play to listen.', 'success');
+            showMessage(data.cached ? 'Audio served from the cache.' : 'Streaming audio as it is generated...', 'success');
         } else {
             commandEl.textContent = `Error: ${data.error}`;
             commandEl.className = 'error';
@@ -331,7 +333,7 @@ let timerInterval;
 let recordedBlob;
 let uploadedFile;
 let currentSessionId = null;
-let progressInterval = null;
+let progressSource = null;
 
 // Switch between file and recording audio sources
 function switchAudioSource(source) {
@@ -475,82 +477,108 @@ function startProgressTracking(sessionId) {
     const progressContainer = document.getElementById('progress-container');
     const progressFill = document.getElementById('progress-fill');
     const progressText = document.getElementById('progress-text');
+    const outputEl = document.getElementById('stt-output');
     
     progressContainer.style.display = 'block';
     progressFill.style.width = '0%';
     progressText.textContent = 'Starting transcription...';
     
-    progressInterval = setInterval(async () => {
-        try {
-            const response = await fetch(`/api/progress/${sessionId}`);
-            const data = await response.json();
-            
-            if (response.ok) {
-                progressFill.style.width = `${data.progress}%`;
-                
-                if (data.status === 'creating_segments') {
-                    progressText.textContent = `Creating segments... ${Math.round(data.progress)}%`;
-                } else if (data.status === 'transcribing') {
-                    // Calculate estimated time remaining
-                    let timeText = '';
-                    if (data.start_time && data.estimated_duration_minutes) {
-                        const elapsed = (Date.now() / 1000) - data.start_time;
-                        const totalEstimated = data.estimated_duration_minutes * 60;
-                        const remaining = Math.max(0, totalEstimated - elapsed);
-                        const remainingMinutes = Math.round(remaining / 60);
-                        timeText = remainingMinutes > 0 ? ` (~${remainingMinutes}min left)` : '';
-                    }
-                    
-                    progressText.textContent = `Transcribing segment ${data.current_segment}/${data.total_segments}... ${Math.round(data.progress)}%${timeText}`;
-                    
-                    // Update live transcription
-                    if (data.transcriptions && data.transcriptions.length > 0) {
-                        document.getElementById('stt-output').textContent = data.transcriptions.join('\n\n');
-                    }
-                } else if (data.status === 'completed') {
-                    progressText.textContent = 'Transcription completed!';
-                    progressContainer.style.display = 'none';
-                    clearInterval(progressInterval);
-                    currentSessionId = null;
-                    
-                    // Show final transcription and actions
-                    const finalTranscription = data.final_transcription || data.transcriptions.join('\n\n');
-                    document.getElementById('stt-output').textContent = finalTranscription;
-                    document.querySelector('.transcript-actions').style.display = 'flex';
-                    
-                    // Update command with final stats
-                    if (data.segments_processed) {
-                        const successRate = data.success_rate || 0;
-                        const successfulSegs = data.successful_segments || 0;
-                        document.getElementById('stt-command').textContent += `\n# Processing completed: ${successfulSegs}/${data.segments_processed} segments successful (${successRate.toFixed(1)}%)`;
-                    }
-                    
-                    const successRate = data.success_rate || 0;
-                    if (successRate >= 80) {
-                        showMessage('Long file transcribed successfully!', 'success');
-                    } else if (successRate >= 50) {
-                        showMessage(`Transcription completed with ${successRate.toFixed(1)}% success rate. Some segments failed.`, 'success');
-                    } else {
-                        showMessage(`Transcription completed but many segments failed (${successRate.toFixed(1)}% success). Check the results.`, 'error');
-                    }
-                } else if (data.status === 'error') {
-                    progressText.textContent = 'Error occurred during transcription';
-                    progressContainer.style.display = 'none';
-                    clearInterval(progressInterval);
-                    currentSessionId = null;
-                    showMessage(`Error: ${data.error}`, 'error');
-                }
+    // The server pushes only what changed: new words, progress and completion
+    const paragraphs = [];
+    const source = new EventSource(`/api/events/${sessionId}`);
+    progressSource = source;
+    
+    const stopTracking = () => {
+        source.close();
+        progressSource = null;
+        progressContainer.style.display = 'none';
+        currentSessionId = null;
+    };
+    
+    source.addEventListener('progress', (event) => {
+        const data = JSON.parse(event.data);
+        progressFill.style.width = `${data.progress}%`;
+        
+        if (data.status === 'transcribing') {
+            // Calculate estimated time remaining
+            let timeText = '';
+            if (data.start_time && data.estimated_duration_minutes) {
+                const elapsed = (Date.now() / 1000) - data.start_time;
+                const totalEstimated = data.estimated_duration_minutes * 60;
+                const remaining = Math.max(0, totalEstimated - elapsed);
+                const remainingMinutes = Math.round(remaining / 60);
+                timeText = remainingMinutes > 0 ? ` (~${remainingMinutes}min left)` : '';
             }
-        } catch (error) {
-            console.error('Progress tracking error:', error);
+            
+            // Decoding runs ahead of transcription, show both stages
+            const decodeText = data.decode_progress !== undefined && data.decode_progress !== null ? ` (decoded ${Math.round(data.decode_progress)}%)` : '';
+            progressText.textContent = `Transcribing segment ${data.current_segment}/${data.total_segments}... ${Math.round(data.progress)}%${decodeText}${timeText}`;
         }
-    }, 1000); // Update every second
+    });
+    
+    source.addEventListener('words', (event) => {
+        const data = JSON.parse(event.data);
+        paragraphs[data.paragraph] = paragraphs[data.paragraph]
+            ? `${paragraphs[data.paragraph]} ${data.text}`
+            : `${data.label} ${data.text}`;
+        outputEl.textContent = paragraphs.filter(p => p).join('\n\n');
+    });
+    
+    source.addEventListener('completed', (event) => {
+        const data = JSON.parse(event.data);
+        progressText.textContent = 'Transcription completed!';
+        stopTracking();
+        
+        // Show final transcription and actions
+        outputEl.textContent = paragraphs.filter(p => p).join('\n\n');
+        document.querySelector('.transcript-actions').style.display = 'flex';
+        
+        // Update command with final stats
+        const successRate = data.success_rate || 0;
+        if (data.segments_processed) {
+            const successfulSegs = data.successful_segments || 0;
+            document.getElementById('stt-command').textContent += `\n# Processing completed: ${successfulSegs}/${data.segments_processed} segments successful (${successRate.toFixed(1)}%)`;
+        }
+        if (data.stats) {
+            document.getElementById('stt-command').textContent += `\n# Decode: ${data.stats.decode_seconds.toFixed(1)}s, transcription: ${data.stats.transcribe_seconds.toFixed(1)}s, wall: ${data.stats.wall_seconds.toFixed(1)}s (RTF ${data.stats.rtf.toFixed(2)}, ${data.stats.pipelined ? 'pipelined' : 'sequential'})`;
+        }
+        
+        if (successRate >= 80) {
+            showMessage('Long file transcribed successfully!', 'success');
+        } else if (successRate >= 50) {
+            showMessage(`Transcription completed with ${successRate.toFixed(1)}% success rate. Some segments failed.`, 'success');
+        } else {
+            showMessage(`Transcription completed but many segments failed (${successRate.toFixed(1)}% success). Check the results.`, 'error');
+        }
+    });
+    
+    // Named 'error' events come from the server, plain ones from the connection
+    source.addEventListener('error', (event) => {
+        if (event.data) {
+            const data = JSON.parse(event.data);
+            progressText.textContent = 'Error occurred during transcription';
+            stopTracking();
+            showMessage(`Error: ${data.error}`, 'error');
+        } else if (source.readyState === EventSource.CLOSED) {
+            stopTracking();
+            showMessage('Lost connection to the server', 'error');
+        } else {
+            console.error('Progress stream interrupted, reconnecting...');
+        }
+    });
+    
+    source.addEventListener('cancelled', () => {
+        stopTracking();
+    });
 }
 
 function cancelTranscription() {
     if (currentSessionId) {
         fetch(`/api/cancel/${currentSessionId}`, { method: 'POST' });
-        clearInterval(progressInterval);
+        if (progressSource) {
+            progressSource.close();
+            progressSource = null;
+        }
         document.getElementById('progress-container').style.display = 'none';
         showMessage('Transcription cancelled', 'error');
         currentSessionId = null;
@@ -42,9 +42,10 @@ def segment_audio_file(input_path, segment_duration=300):  # 5 minutes segments
         start_time = i * segment_duration
         segment_path = output_dir / f"{base_name}_segment_{i:03d}.wav"
         
+        # `-ss` before `-i` seeks in the input instead of decoding from the start
         segment_cmd = [
-            "ffmpeg", "-i", str(input_path),
-            "-ss", str(start_time),
+            "ffmpeg", "-ss", str(start_time),
+            "-i", str(input_path),
             "-t", str(segment_duration),
             "-acodec", "pcm_s16le",
             "-ar", "16000",
@@ -3,20 +3,43 @@
 # dependencies = [
 #     "flask",
 #     "flask-cors",
+#     "julius",
+#     "moshi",
+#     "numpy",
+#     "sphn",
+#     "torch",
+#     "tqdm",
+#     "waitress",
 # ]
 # ///
 
+import argparse
+import atexit
 import os
 import json
 import subprocess
-import tempfile
 import uuid
+from concurrent.futures import CancelledError
 from pathlib import Path
-from flask import Flask, request, jsonify, send_file, send_from_directory, Response
+from flask import Flask, request, jsonify, send_file, send_from_directory, Response, stream_with_context
 from flask_cors import CORS
 import time
 import logging
 
+import numpy as np
+
+
+from audio_io import decode_pcm, pcm16_bytes, stream_pcm, streaming_wav_header
+from jobs import JobLimiter, JobsBusy
+from pipeline import InlineSource, Prefetcher
+from session_events import SessionEvents
+from stt_worker import SttWorker
+from transcription_cache import TranscriptionCache
+from tts_cache import TtsCache
+from tts_engine import DEFAULT_VOICE, TtsEngine
+# On the path once stt_worker is imported
+from dsm import profiling
+
 # Configure detailed logging
 logging.basicConfig(
     level=logging.DEBUG,
@@ -31,21 +54,98 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__, static_folder='.')
 CORS(app)
 
-# Directory to store generated audio files
+# Directory to store generated audio files, it doubles as the TTS cache:
+# identical requests are served from there and old files are evicted in the background
 AUDIO_OUTPUT_DIR = Path("generated_audio")
-AUDIO_OUTPUT_DIR.mkdir(exist_ok=True)
+tts_cache = TtsCache(
+    AUDIO_OUTPUT_DIR,
+    max_bytes=int(os.environ.get('DSM_TTS_CACHE_MB', 1024)) * 1024 * 1024,
+    ttl_seconds=float(os.environ.get('DSM_TTS_CACHE_TTL', 24 * 3600)) or None,
+)
 
 # Global storage for active transcription sessions
 active_sessions = {}
 
+# Incremental events of each session, streamed by /api/events/<session_id>
+session_events = {}
+
+# TTS requests waiting for the client to open /api/tts-stream/<stream_id>
+pending_tts_streams = {}
+
+DEFAULT_STT_MODEL = 'kyutai/stt-2.6b-en'
+
+# Long uploads: decoding runs ahead of transcription through a bounded queue.
+# Set DSM_PIPELINE=0 to decode and transcribe sequentially, e.g. to compare throughput.
+PIPELINE_LONG_AUDIO = os.environ.get('DSM_PIPELINE', '1') != '0'
+PIPELINE_CHUNK_SECONDS = 10
+PIPELINE_QUEUE_SIZE = 4
+
+# STT models stay loaded in this process between requests
+# and concurrent transcriptions share the slots of one batched streaming session
+stt_worker = SttWorker(
+    device=os.environ.get('DSM_DEVICE'),
+    batch_size=int(os.environ['DSM_STT_BATCH_SIZE']) if 'DSM_STT_BATCH_SIZE' in os.environ else None,
+    # Identical audio (same decoded samples, model and parameters) is only transcribed once
+    cache=TranscriptionCache(
+        os.environ.get('DSM_STT_CACHE_DIR', 'stt_cache'),
+        max_disk_bytes=int(os.environ.get('DSM_STT_CACHE_MB', 512)) * 1024 * 1024,
+        max_memory_bytes=int(os.environ.get('DSM_STT_CACHE_MEMORY_MB', 32)) * 1024 * 1024,
+    ),
+)
+tts_engine = TtsEngine(device=os.environ.get('DSM_DEVICE'))
+
+# Transcriptions run on a bounded pool: at most DSM_MAX_JOBS at once and DSM_MAX_QUEUED
+# waiting, further requests get a 429 with Retry-After instead of oversubscribing the machine.
+# A job holds its pool worker for the whole transcription, so by default there is one per slot
+# of the batched STT session, plus a margin for the jobs still decoding their upload
+jobs = JobLimiter(
+    max_concurrent=int(os.environ.get('DSM_MAX_JOBS', stt_worker.batch_size + 2)),
+    max_queued=int(os.environ.get('DSM_MAX_QUEUED', 8)),
+)
+
+@app.errorhandler(JobsBusy)
+def jobs_busy(e):
+    response = jsonify({'error': str(e), 'jobs': jobs.status()})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+def _decode_and_transcribe(upload_path, model):
+    # Decode once, straight to PCM at the model sample rate
+    sample_rate = stt_worker.get(model).mimi.sample_rate
+    audio = decode_pcm(upload_path, sample_rate)
+    return stt_worker.transcribe(model, audio, sample_rate)
+
+def _prune_session_events(max_age=600):
+    """Forget the events of sessions that ended more than `max_age` seconds ago."""
+    now = time.time()
+    for session_id, events in list(session_events.items()):
+        if events.closed_at is not None and now - events.closed_at > max_age:
+            session_events.pop(session_id, None)
+
+def _publish_progress(session_id, session):
+    events = session_events.get(session_id)
+    if events is not None:
+        events.publish('progress', {
+            key: session.get(key)
+            for key in ('status', 'progress', 'decode_progress', 'current_segment', 'total_segments', 'estimated_duration_minutes', 'start_time')
+        })
+
 def process_long_audio_file(upload_path, model, duration, session_id):
-    """Process long audio files by segmenting them into smaller chunks with progress updates."""
+    """Transcribe a long audio file in a single streaming pass with progress updates.
+
+    ffmpeg decodes the file once, straight to PCM at the model sample rate, and the
+    chunks are fed into one continuous streaming STT session, so memory stays
+    constant and nothing is re-decoded or written back to disk.
+    """
     logger.info(f"=== STARTING LONG AUDIO PROCESSING ===")
     logger.info(f"Session ID: {session_id}")
     logger.info(f"Upload path: {upload_path}")
     logger.info(f"Model: {model}")
     logger.info(f"Duration: {duration} seconds ({duration/60:.1f} minutes)")
     
+    pcm_chunks = None
+    events = session_events.setdefault(session_id, SessionEvents())
     try:
         # Verify file exists
         if not upload_path.exists():
@@ -53,6 +153,7 @@ def process_long_audio_file(upload_path, model, duration, session_id):
             if session_id in active_sessions:
                 active_sessions[session_id]['status'] = 'error'
                 active_sessions[session_id]['error'] = f'Upload file not found: {upload_path}'
+            events.publish('error', {'error': f'Upload file not found: {upload_path}'})
             return
         
         # Log file details
@@ -60,9 +161,8 @@ def process_long_audio_file(upload_path, model, duration, session_id):
         logger.info(f"File size: {file_size} bytes ({file_size/1024/1024:.1f} MB)")
         logger.info(f"File exists and is accessible: {upload_path}")
             
-        segment_duration = 300  # 5 minutes per segment
+        segment_duration = 300  # The transcript is split in 5 minutes paragraphs
         num_segments = int(duration / segment_duration) + 1
-        segments = []
         transcriptions = []
         
         # Calculate estimated processing time (roughly 1:3 ratio - 1 min audio = 3 min processing)
@@ -70,208 +170,91 @@ def process_long_audio_file(upload_path, model, duration, session_id):
         
         # Initialize session
         active_sessions[session_id] = {
-            'status': 'creating_segments',
+            'status': 'transcribing',
             'progress': 0,
-            'current_segment': 0,
+            'current_segment': 1,
             'total_segments': num_segments,
-            'transcriptions': [],
+            'transcriptions': transcriptions,
+            'decode_progress': 0,
             'estimated_duration_minutes': estimated_minutes,
             'start_time': time.time()
         }
         
-        logger.info(f"Creating {num_segments} segments of {segment_duration} seconds each...")
-        
-        # Create segments
-        for i in range(num_segments):
-            if session_id not in active_sessions:  # Check if cancelled
-                logger.warning(f"Session {session_id} was cancelled during segmentation")
-                break
-                
-            start_time = i * segment_duration
-            segment_id = str(uuid.uuid4())
-            segment_path = AUDIO_OUTPUT_DIR / f"segment_{segment_id}.wav"
-            
-            logger.debug(f"Creating segment {i+1}/{num_segments}: {start_time}s-{start_time+segment_duration}s -> {segment_path}")
-            
-            segment_cmd = [
-                "ffmpeg", "-i", str(upload_path),
-                "-ss", str(start_time),
-                "-t", str(segment_duration),
-                "-acodec", "pcm_s16le",
-                "-ar", "16000",
-                str(segment_path)
-            ]
+        stt_model = stt_worker.get(model)
+        sample_rate = stt_model.mimi.sample_rate
+        current_paragraph = {'index': None, 'words': []}
+        
+        def _on_words(words, audio_seconds):
+            new_text = {}
+            for word in words:
+                index = min(int(word.timestamp[0] // segment_duration), num_segments - 1)
+                if index != current_paragraph['index']:
+                    current_paragraph['index'] = index
+                    current_paragraph['words'] = []
+                    transcriptions.append('')
+                current_paragraph['words'].append(str(word))
+                start_minutes = (index * segment_duration) // 60
+                start_seconds = (index * segment_duration) % 60
+                label = f"[{start_minutes:02d}:{start_seconds:02d}]"
+                transcriptions[-1] = f"{label} " + " ".join(current_paragraph['words'])
+                new_text.setdefault(len(transcriptions) - 1, (label, []))[1].append(str(word))
             
-            logger.debug(f"Running ffmpeg command: {' '.join(segment_cmd)}")
-            result = subprocess.run(segment_cmd, capture_output=True, text=True)
+            # Only the new words are pushed to the clients
+            for paragraph, (label, paragraph_words) in new_text.items():
+                events.publish('words', {'paragraph': paragraph, 'label': label, 'text': " ".join(paragraph_words)})
             
-            if result.returncode == 0 and segment_path.exists():
-                segments.append(segment_path)
-                segment_size = segment_path.stat().st_size
-                logger.info(f"✅ Created segment {i+1}/{num_segments}: {segment_size} bytes")
-            else:
-                logger.error(f"❌ Failed to create segment {i+1}/{num_segments}")
-                logger.error(f"FFmpeg return code: {result.returncode}")
-                logger.error(f"FFmpeg stderr: {result.stderr}")
-                logger.error(f"FFmpeg stdout: {result.stdout}")
-            
-            # Update progress
-            if session_id in active_sessions:
-                active_sessions[session_id]['progress'] = (i + 1) / num_segments * 30  # 30% for segmentation
-        
-        # Update status to transcribing
-        if session_id in active_sessions:
-            active_sessions[session_id]['status'] = 'transcribing'
-        
-        logger.info(f"Starting transcription of {len(segments)} segments...")
+            session = active_sessions.get(session_id)
+            if session is not None:
+                session['current_segment'] = (current_paragraph['index'] or 0) + 1
+                session['progress'] = min(99.0, audio_seconds / duration * 100)
+                _publish_progress(session_id, session)
+        
+        decoded = {'samples': 0}
+        
+        def _on_decoded(chunk):
+            decoded['samples'] += chunk.shape[-1]
+            session = active_sessions.get(session_id)
+            if session is not None:
+                session['decode_progress'] = min(100.0, decoded['samples'] / sample_rate / duration * 100)
+                _publish_progress(session_id, session)
+        
+        logger.info(f"Streaming {upload_path} through {model} at {sample_rate} Hz (pipelined: {PIPELINE_LONG_AUDIO})...")
+        start_time_transcription = time.time()
+        pcm_chunks = stream_pcm(upload_path, sample_rate, chunk_samples=PIPELINE_CHUNK_SECONDS * sample_rate)
+        if PIPELINE_LONG_AUDIO:
+            # ffmpeg decodes chunk k+1 while the model transcribes chunk k
+            pcm_chunks = Prefetcher(pcm_chunks, maxsize=PIPELINE_QUEUE_SIZE, on_item=_on_decoded, name=f"decode-{session_id}")
+        else:
+            pcm_chunks = InlineSource(pcm_chunks, on_item=_on_decoded)
+        completed = stt_model.stream_words(
+            pcm_chunks,
+            _on_words,
+            should_stop=lambda: session_id not in active_sessions,
+        )
+        elapsed = time.time() - start_time_transcription
         
-        # Transcribe each segment
-        for i, segment_path in enumerate(segments):
-            if session_id not in active_sessions:  # Check if cancelled
-                logger.warning(f"Session {session_id} was cancelled during transcription")
-                break
-                
-            logger.info(f"=== TRANSCRIBING SEGMENT {i+1}/{len(segments)} ===")
-            logger.info(f"Segment path: {segment_path}")
-            
-            # Verify segment file exists and has content
-            if not segment_path.exists():
-                logger.error(f"Segment file does not exist: {segment_path}")
-                continue
-                
-            segment_size = segment_path.stat().st_size
-            logger.info(f"Segment file size: {segment_size} bytes")
-            
-            if segment_size == 0:
-                logger.error(f"Segment file is empty: {segment_path}")
-                continue
-            
-            active_sessions[session_id]['current_segment'] = i + 1
-            
-            # Try transcription with timeout and retry logic
-            max_retries = 2
-            segment_success = False
-            start_minutes = (i * segment_duration) // 60
-            start_seconds = (i * segment_duration) % 60
-            
-            for retry in range(max_retries):
-                try:
-                    # Calculate the time offset for this segment (in seconds)
-                    segment_offset_seconds = i * segment_duration
-                    
-                    cmd = [
-                        "uv", "run",
-                        "../../scripts/stt_from_file_pytorch.py",
-                        "--hf-repo", model,
-                        "--offset-seconds", str(segment_offset_seconds),
-                        str(segment_path)
-                    ]
-                    
-                    logger.info(f"🔄 Attempt {retry + 1}/{max_retries} for segment {i+1}")
-                    logger.debug(f"STT command: {' '.join(cmd)}")
-                    logger.debug(f"Working directory: {os.path.dirname(__file__)}")
-                    
-                    # Check if script exists
-                    script_path = Path("../../scripts/stt_from_file_pytorch.py")
-                    logger.debug(f"Script exists: {script_path.exists()}")
-                    
-                    # Add timeout to prevent hanging
-                    start_time_transcription = time.time()
-                    result = subprocess.run(
-                        cmd, 
-                        capture_output=True, 
-                        text=True, 
-                        cwd=os.path.dirname(__file__),
-                        timeout=300  # 5 minutes timeout per segment
-                    )
-                    end_time_transcription = time.time()
-                    
-                    logger.info(f"STT command completed in {end_time_transcription - start_time_transcription:.1f} seconds")
-                    logger.info(f"Return code: {result.returncode}")
-                    
-                    if result.returncode == 0:
-                        segment_text = result.stdout.strip()
-                        logger.info(f"✅ Segment {i+1} transcribed successfully: {len(segment_text)} characters")
-                        logger.debug(f"Transcription preview: {segment_text[:100]}...")
-                        
-                        transcription_part = f"[{start_minutes:02d}:{start_seconds:02d}] {segment_text}"
-                        transcriptions.append(transcription_part)
-                        
-                        # Add to live transcriptions
-                        if session_id in active_sessions:
-                            active_sessions[session_id]['transcriptions'].append(transcription_part)
-                        
-                        segment_success = True
-                        
-                        # Update progress immediately after successful segment
-                        if session_id in active_sessions:
-                            segments_completed = i + 1
-                            progress = 30 + (segments_completed / len(segments) * 70)
-                            active_sessions[session_id]['progress'] = progress
-                            logger.info(f"✅ Updated progress to {progress:.1f}% after segment {segments_completed}")
-                        
-                        break  # Success, exit retry loop
-                        
-                    else:
-                        logger.error(f"❌ Segment {i+1} failed on attempt {retry + 1}")
-                        logger.error(f"Return code: {result.returncode}")
-                        logger.error(f"STDERR ({len(result.stderr)} chars): {result.stderr}")
-                        logger.error(f"STDOUT ({len(result.stdout)} chars): {result.stdout}")
-                        
-                        if retry == max_retries - 1:  # Last retry failed
-                            error_part = f"[{start_minutes:02d}:{start_seconds:02d}] SEGMENT {i+1} FAILED AFTER {max_retries} ATTEMPTS"
-                            transcriptions.append(error_part)
-                            if session_id in active_sessions:
-                                active_sessions[session_id]['transcriptions'].append(error_part)
-                                # Update progress even for failed segments
-                                segments_processed = i + 1
-                                progress = 30 + (segments_processed / len(segments) * 70)
-                                active_sessions[session_id]['progress'] = progress
-                
-                except subprocess.TimeoutExpired:
-                    logger.error(f"⏱️ Segment {i+1} TIMED OUT on attempt {retry + 1} (>5min)")
-                    if retry == max_retries - 1:  # Last retry timed out
-                        timeout_part = f"[{start_minutes:02d}:{start_seconds:02d}] SEGMENT {i+1} TIMED OUT (>5min)"
-                        transcriptions.append(timeout_part)
-                        if session_id in active_sessions:
-                            active_sessions[session_id]['transcriptions'].append(timeout_part)
-                            # Update progress even for timed out segments
-                            segments_processed = i + 1
-                            progress = 30 + (segments_processed / len(segments) * 70)
-                            active_sessions[session_id]['progress'] = progress
-                
-                except Exception as e:
-                    logger.error(f"💥 Unexpected error for segment {i+1} on attempt {retry + 1}: {e}")
-                    logger.exception("Full exception details:")
-                    if retry == max_retries - 1:  # Last retry had error
-                        error_part = f"[{start_minutes:02d}:{start_seconds:02d}] SEGMENT {i+1} ERROR: {str(e)[:100]}"
-                        transcriptions.append(error_part)
-                        if session_id in active_sessions:
-                            active_sessions[session_id]['transcriptions'].append(error_part)
-                            # Update progress even for error segments
-                            segments_processed = i + 1
-                            progress = 30 + (segments_processed / len(segments) * 70)
-                            active_sessions[session_id]['progress'] = progress
-            
-            # Progress is now updated immediately after each successful segment
-            
-            # Clean up segment file
-            try:
-                segment_path.unlink()
-            except:
-                pass
+        if not completed:
+            logger.warning(f"Session {session_id} was cancelled during transcription")
+            events.publish('cancelled', {})
+            return
         
-        # Calculate success statistics
-        successful_segments = sum(1 for t in transcriptions if not ('FAILED' in t or 'TIMED OUT' in t or 'ERROR' in t))
-        total_segments = len(transcriptions)
-        success_rate = (successful_segments / total_segments * 100) if total_segments > 0 else 0
+        # Time per stage, to compare the pipelined and sequential paths
+        stats = {
+            'pipelined': PIPELINE_LONG_AUDIO,
+            'audio_seconds': duration,
+            'wall_seconds': elapsed,
+            'decode_seconds': pcm_chunks.producer_seconds,
+            'transcribe_seconds': elapsed - pcm_chunks.consumer_wait_seconds,
+            'rtf': duration / max(elapsed, 1e-6),
+        }
+        logger.info(f"✅ Transcribed {duration/60:.1f} minutes in {elapsed:.1f} seconds: {stats}")
         
         # Mark as completed
         if session_id in active_sessions:
             active_sessions[session_id]['status'] = 'completed'
             active_sessions[session_id]['progress'] = 100
-            active_sessions[session_id]['success_rate'] = success_rate
-            active_sessions[session_id]['successful_segments'] = successful_segments
+            active_sessions[session_id]['success_rate'] = 100.0
+            active_sessions[session_id]['successful_segments'] = len(transcriptions)
         
         # Combine all transcriptions
         full_transcription = "\n\n".join(transcriptions)
@@ -279,20 +262,32 @@ def process_long_audio_file(upload_path, model, duration, session_id):
         # Don't return jsonify from thread - just update session
         if session_id in active_sessions:
             active_sessions[session_id]['final_transcription'] = full_transcription
-            active_sessions[session_id]['segments_processed'] = len(segments)
+            active_sessions[session_id]['segments_processed'] = len(transcriptions)
             active_sessions[session_id]['total_duration_minutes'] = duration/60
+            active_sessions[session_id]['stats'] = stats
+        
+        events.publish('completed', {
+            'success_rate': 100.0,
+            'successful_segments': len(transcriptions),
+            'segments_processed': len(transcriptions),
+            'total_duration_minutes': duration/60,
+            'stats': stats,
+        })
         
+    except Exception as e:
+        logger.exception(f"Error in process_long_audio_file: {e}")
+        if session_id in active_sessions:
+            active_sessions[session_id]['status'] = 'error'
+            active_sessions[session_id]['error'] = str(e)
+        events.publish('error', {'error': str(e)})
+    finally:
+        if pcm_chunks is not None:
+            pcm_chunks.close()
         # Clean up the permanent processing file
         try:
             upload_path.unlink()
         except:
             pass
-        
-    except Exception as e:
-        print(f"Error in process_long_audio_file: {e}")
-        if session_id in active_sessions:
-            active_sessions[session_id]['status'] = 'error'
-            active_sessions[session_id]['error'] = str(e)
 
 # Serve the main UI
 @app.route('/')
@@ -314,50 +309,119 @@ def text_to_speech():
         if not text:
             return jsonify({'error': 'No text provided'}), 400
         
-        # Generate unique filename
-        audio_id = str(uuid.uuid4())
-        output_filename = f"tts_{audio_id}.wav"
-        output_path = AUDIO_OUTPUT_DIR / output_filename
+        voice = data.get('voice') or DEFAULT_VOICE
+        seed = data.get('seed')
+        seed = int(seed) if seed is not None else None
+        audio_id = tts_cache.make_key(
+            text, voice, temp=tts_engine.temp, n_q=tts_engine.n_q, seed=seed
+        )
         
-        # Create temporary input file
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.txt', delete=False) as tmp_file:
-            tmp_file.write(text)
-            tmp_file_path = tmp_file.name
+        # Concurrent requests are batched together by the engine,
+        # identical ones are generated once and then served from the cache
+        start = time.time()
+        output_path, cached = tts_cache.get_or_generate(
+            audio_id,
+            lambda: (
+                tts_engine.synthesize(text, voice=voice, seed=seed).result(),
+                tts_engine.sample_rate,
+            ),
+        )
+        logger.info(f"TTS request served in {time.time() - start:.1f} seconds (cached: {cached})")
         
-        try:
-            # Run TTS command
-            cmd = [
-                "uv", "run", 
-                "../../scripts/tts_pytorch.py", 
-                tmp_file_path, 
-                str(output_path)
-            ]
-            
-            print(f"Running command: {' '.join(cmd)}")
-            result = subprocess.run(cmd, capture_output=True, text=True, cwd=os.path.dirname(__file__))
-            
-            if result.returncode != 0:
-                error_msg = result.stderr if result.stderr else result.stdout
-                return jsonify({'error': f'TTS failed: {error_msg}'}), 500
-            
-            # Check if file was created
-            if not output_path.exists():
-                return jsonify({'error': 'Audio file was not generated'}), 500
-            
-            return jsonify({
-                'success': True,
-                'audio_url': f'/audio/{output_filename}',
-                'audio_id': audio_id
-            })
-            
-        finally:
-            # Clean up temp file
-            if os.path.exists(tmp_file_path):
-                os.unlink(tmp_file_path)
+        return jsonify({
+            'success': True,
+            'audio_url': f'/audio/{output_path.name}',
+            'audio_id': audio_id,
+            'cached': cached
+        })
                 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Streaming TTS: the POST registers the request, the returned URL streams the WAV
+# while it is generated, so that an <audio> element can start playing right away
+@app.route('/api/tts-stream', methods=['POST'])
+def text_to_speech_stream():
+    data = request.json
+    text = data.get('text', '').strip()
+    if not text:
+        return jsonify({'error': 'No text provided'}), 400
+    
+    voice = data.get('voice') or DEFAULT_VOICE
+    seed = data.get('seed')
+    seed = int(seed) if seed is not None else None
+    audio_id = tts_cache.make_key(
+        text, voice, temp=tts_engine.temp, n_q=tts_engine.n_q, seed=seed
+    )
+    
+    # Already generated, no need to stream
+    cached_path = tts_cache.lookup(audio_id)
+    if cached_path is not None:
+        return jsonify({'success': True, 'audio_url': f'/audio/{cached_path.name}', 'audio_id': audio_id, 'cached': True})
+    
+    now = time.time()
+    for stream_id, pending in list(pending_tts_streams.items()):
+        if now - pending['created'] > 60:
+            pending_tts_streams.pop(stream_id, None)
+    stream_id = str(uuid.uuid4())
+    pending_tts_streams[stream_id] = {
+        'text': text, 'voice': voice, 'seed': seed, 'audio_id': audio_id, 'created': now
+    }
+    return jsonify({'success': True, 'audio_url': f'/api/tts-stream/{stream_id}', 'audio_id': audio_id, 'cached': False})
+
+@app.route('/api/tts-stream/<stream_id>')
+def stream_tts_audio(stream_id):
+    pending = pending_tts_streams.pop(stream_id, None)
+    if pending is None:
+        return jsonify({'error': 'Stream not found'}), 404
+    
+    def generate():
+        audio_id = pending['audio_id']
+        # Identical requests share one generation, batched or streamed: if another
+        # one is in progress, wait for it and send its file
+        while True:
+            future = tts_cache.claim(audio_id)
+            if future is None:
+                break
+            try:
+                path = future.result()
+            except CancelledError:
+                # Its client went away, generate it here instead
+                continue
+            with open(path, 'rb') as f:
+                yield from iter(lambda: f.read(64 * 1024), b'')
+            return
+
+        start = time.time()
+        chunks = []
+        stored = False
+        try:
+            for chunk in tts_engine.synthesize_stream(pending['text'], voice=pending['voice'], seed=pending['seed']):
+                if not chunks:
+                    logger.info(f"TTS time to first audio: {time.time() - start:.2f} seconds")
+                    yield streaming_wav_header(tts_engine.sample_rate)
+                chunks.append(chunk)
+                yield pcm16_bytes(chunk)
+            logger.info(f"TTS stream of {len(chunks)} frames served in {time.time() - start:.1f} seconds")
+            # Later identical requests are served from the cache
+            if chunks:
+                tts_cache.store(audio_id, np.concatenate(chunks), tts_engine.sample_rate)
+                stored = True
+        except Exception as e:
+            tts_cache.abandon(audio_id, e)
+            raise
+        finally:
+            # Closing the generator (client disconnect) also stops the generation,
+            # requests waiting for this audio then generate it themselves
+            if not stored:
+                tts_cache.abandon(audio_id)
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='audio/wav',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
 # STT endpoint for uploaded audio files
 @app.route('/api/stt-upload', methods=['POST'])
 def speech_to_text_upload():
@@ -366,7 +430,7 @@ def speech_to_text_upload():
             return jsonify({'error': 'No audio file provided'}), 400
         
         audio_file = request.files['audio']
-        model = request.form.get('model', 'kyutai/stt-2.6b-en')
+        model = request.form.get('model', DEFAULT_STT_MODEL)
         
         # Save uploaded file temporarily
         upload_id = str(uuid.uuid4())
@@ -376,7 +440,6 @@ def speech_to_text_upload():
         
         audio_file.save(str(upload_path))
         
-        wav_path = None  # Initialize to avoid UnboundLocalError
         try:
             # Check audio duration first
             duration_cmd = [
@@ -393,23 +456,27 @@ def speech_to_text_upload():
                     duration = float(duration_result.stdout.strip())
                     print(f"Audio duration: {duration:.2f} seconds")
                     
-                    # Always use segmentation for files longer than 5 minutes to avoid memory issues
+                    # Files longer than 5 minutes are streamed in the background with progress updates
                     if duration > 300:
                         session_id = str(uuid.uuid4())
-                        print(f"File detected ({duration/60:.1f} minutes), processing in segments...")
+                        print(f"File detected ({duration/60:.1f} minutes), streaming it in the background...")
                         
                         # Copy the uploaded file to a permanent location for background processing
                         permanent_path = AUDIO_OUTPUT_DIR / f"processing_{session_id}_{upload_filename}"
                         import shutil
                         shutil.copy2(upload_path, permanent_path)
                         
-                        # Start background processing
-                        import threading
-                        thread = threading.Thread(
-                            target=process_long_audio_file,
-                            args=(permanent_path, model, duration, session_id)
-                        )
-                        thread.start()
+                        # Created now so that clients can subscribe before the job starts
+                        _prune_session_events()
+                        session_events[session_id] = SessionEvents()
+                        
+                        # Start background processing, it waits for a free worker if all are busy
+                        try:
+                            jobs.submit(process_long_audio_file, permanent_path, model, duration, session_id)
+                        except JobsBusy:
+                            session_events.pop(session_id, None)
+                            permanent_path.unlink()
+                            raise
                         
                         return jsonify({
                             'success': True,
@@ -423,40 +490,13 @@ def speech_to_text_upload():
                 except ValueError:
                     print("Could not determine audio duration, proceeding anyway")
             
-            # Convert to wav using ffmpeg with duration limit
-            wav_filename = f"upload_{upload_id}.wav"
-            wav_path = AUDIO_OUTPUT_DIR / wav_filename
-            
-            convert_cmd = [
-                "ffmpeg", "-i", str(upload_path), 
-                "-acodec", "pcm_s16le", 
-                "-ar", "16000",
-                str(wav_path)
-            ]
-            
-            convert_result = subprocess.run(convert_cmd, capture_output=True, text=True)
-            
-            if convert_result.returncode != 0:
-                return jsonify({'error': f'Audio conversion failed: {convert_result.stderr}'}), 500
-            
-            # Run STT command
-            cmd = [
-                "uv", "run",
-                "../../scripts/stt_from_file_pytorch.py",
-                "--hf-repo", model,
-                str(wav_path)
-            ]
-            
-            print(f"Running command: {' '.join(cmd)}")
-            result = subprocess.run(cmd, capture_output=True, text=True, cwd=os.path.dirname(__file__))
-            
-            if result.returncode != 0:
-                error_msg = result.stderr if result.stderr else result.stdout
-                return jsonify({'error': f'STT failed: {error_msg}'}), 500
-            
-            # Parse the output to extract transcription
-            output_lines = result.stdout.strip().split('\n')
-            transcription = '\n'.join(output_lines)
+            try:
+                transcription = jobs.run(_decode_and_transcribe, upload_path, model).strip()
+            except JobsBusy:
+                raise
+            except Exception as e:
+                logger.exception("STT failed")
+                return jsonify({'error': f'STT failed: {e}'}), 500
             
             return jsonify({
                 'success': True,
@@ -467,9 +507,9 @@ def speech_to_text_upload():
             # Clean up temporary files
             if upload_path.exists():
                 upload_path.unlink()
-            if wav_path and wav_path.exists():
-                wav_path.unlink()
                 
+    except JobsBusy:
+        raise
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -479,38 +519,29 @@ def speech_to_text():
     try:
         data = request.json
         audio_file = data.get('audio_file', '')
-        model = data.get('model', 'kyutai/stt-2.6b-en')
+        model = data.get('model', DEFAULT_STT_MODEL)
         
         if not audio_file:
             return jsonify({'error': 'No audio file specified'}), 400
         
         # Construct full path to audio file
-        audio_path = f"../../{audio_file}"
+        audio_path = Path(os.path.dirname(os.path.abspath(__file__))) / "../.." / audio_file
         
-        # Run STT command
-        cmd = [
-            "uv", "run",
-            "../../scripts/stt_from_file_pytorch.py",
-            "--hf-repo", model,
-            audio_path
-        ]
-        
-        print(f"Running command: {' '.join(cmd)}")
-        result = subprocess.run(cmd, capture_output=True, text=True, cwd=os.path.dirname(__file__))
-        
-        if result.returncode != 0:
-            error_msg = result.stderr if result.stderr else result.stdout
-            return jsonify({'error': f'STT failed: {error_msg}'}), 500
-        
-        # Parse the output to extract transcription
-        output_lines = result.stdout.strip().split('\n')
-        transcription = '\n'.join(output_lines)
+        try:
+            transcription = jobs.run(stt_worker.transcribe_file, model, audio_path).strip()
+        except JobsBusy:
+            raise
+        except Exception as e:
+            logger.exception("STT failed")
+            return jsonify({'error': f'STT failed: {e}'}), 500
         
         return jsonify({
             'success': True,
             'transcription': transcription
         })
         
+    except JobsBusy:
+        raise
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -545,10 +576,7 @@ def get_test_file(filename):
 @app.route('/api/cleanup', methods=['POST'])
 def cleanup_audio():
     try:
-        files_deleted = 0
-        for audio_file in AUDIO_OUTPUT_DIR.glob("*.wav"):
-            audio_file.unlink()
-            files_deleted += 1
+        files_deleted = tts_cache.clear()
         
         return jsonify({
             'success': True,
@@ -566,16 +594,110 @@ def get_progress(session_id):
     session = active_sessions[session_id]
     return jsonify(session)
 
+# Readiness of the resident STT models
+@app.route('/api/ready')
+def readiness():
+    status = stt_worker.status()
+    status['tts'] = tts_engine.status()
+    status['jobs'] = jobs.status()
+    return jsonify(status), (200 if status['ready'] else 503)
+
+# Queue depth of the transcription jobs
+@app.route('/api/jobs')
+def jobs_status():
+    return jsonify(jobs.status())
+
+# Time per inference stage (DSM_PROFILE=1 or --profile)
+@app.route('/api/profile')
+def profile_summary():
+    return jsonify({'enabled': profiling.PROFILER.enabled, 'spans': profiling.summary()})
+
+# Hit/miss counters of the TTS cache
+@app.route('/api/tts-cache')
+def tts_cache_stats():
+    return jsonify(tts_cache.stats())
+
+# Hit/miss counters of the transcription cache
+@app.route('/api/stt-cache')
+def stt_cache_stats():
+    return jsonify(stt_worker.cache.stats())
+
+# Push progress and partial transcripts (Server-Sent Events)
+@app.route('/api/events/<session_id>')
+def stream_events(session_id):
+    events = session_events.get(session_id)
+    if events is None:
+        return jsonify({'error': 'Session not found'}), 404
+    
+    # A reconnecting EventSource sends the id of the last event it received,
+    # anything unreadable replays the whole session
+    try:
+        since = int(request.headers.get('Last-Event-ID', request.args.get('since', 0)))
+    except ValueError:
+        since = 0
+    return Response(
+        stream_with_context(events.stream(since=since)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
 # Cancel transcription
 @app.route('/api/cancel/<session_id>', methods=['POST'])
 def cancel_transcription(session_id):
     if session_id in active_sessions:
         del active_sessions[session_id]
+        if session_id in session_events:
+            session_events.pop(session_id).publish('cancelled', {})
         return jsonify({'success': True, 'message': 'Transcription cancelled'})
     return jsonify({'error': 'Session not found'}), 404
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="DSM UI Server")
+    parser.add_argument(
+        "--preload",
+        nargs="*",
+        default=[DEFAULT_STT_MODEL],
+        help="STT models to load at startup, others are loaded on first use.",
+    )
+    parser.add_argument(
+        "--waitress",
+        action="store_true",
+        help="Serve with waitress instead of the Flask development server.",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=32,
+        help="Request threads of waitress, each open event or audio stream holds one.",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Time the inference stages, see /api/profile.",
+    )
+    parser.add_argument(
+        "--trace",
+        help="Write a Chrome trace of the inference stages to this file on exit.",
+    )
+    args = parser.parse_args()
+    if args.profile or args.trace:
+        profiling.enable()
+    if args.trace:
+        atexit.register(profiling.export_chrome_trace, args.trace)
+
     print("Starting DSM UI Server...")
     print(f"Audio files will be saved to: {AUDIO_OUTPUT_DIR.absolute()}")
+    print(f"STT models run on: {stt_worker.device}")
     print("Access the UI at: http://localhost:8888")
-    app.run(host='0.0.0.0', port=8888, debug=True)
\ No newline at end of file
+    stt_worker.preload(args.preload)
+    tts_engine.start()
+    print(f"Transcription jobs: {jobs.max_concurrent} concurrent, {jobs.max_queued} queued")
+    if args.waitress:
+        # Handlers block (on the job pool, on SSE and audio streams), so they
+        # need a thread each for the pool limits and the 429s to apply.
+        import waitress
+
+        waitress.serve(app, host='0.0.0.0', port=8888, threads=args.threads)
+    else:
+        # The reloader would start a second process and load every model twice.
+        app.run(host='0.0.0.0', port=8888, debug=True, use_reloader=False)
\ No newline at end of file
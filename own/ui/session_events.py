@@ -0,0 +1,51 @@
+"""Incremental events of long transcription sessions, pushed to clients over SSE.
+
+Each session keeps an append-only log of small events (new words, progress,
+completion). A client receives every event once, and can resume after a
+reconnection from the id of the last event it got (`Last-Event-ID`).
+"""
+
+import json
+import threading
+import time
+from collections.abc import Iterator
+
+TERMINAL_EVENTS = ("completed", "error", "cancelled")
+
+
+class SessionEvents:
+    def __init__(self):
+        self._events: list[tuple[str, dict]] = []
+        self._condition = threading.Condition()
+        self.closed = False
+        self.closed_at: float | None = None
+
+    def publish(self, event: str, data: dict) -> None:
+        with self._condition:
+            if self.closed:
+                return
+            self._events.append((event, data))
+            if event in TERMINAL_EVENTS:
+                self.closed = True
+                self.closed_at = time.time()
+            self._condition.notify_all()
+
+    def stream(self, since: int = 0, keepalive: float = 15.0) -> Iterator[str]:
+        """Yields the events after `since` formatted for `text/event-stream`,
+        until the session is over."""
+        position = since
+        while True:
+            with self._condition:
+                if position >= len(self._events) and not self.closed:
+                    self._condition.wait(timeout=keepalive)
+                events = self._events[position:]
+                closed = self.closed
+            if not events and not closed:
+                # Comment line, keeps proxies from closing an idle connection.
+                yield ": keepalive\n\n"
+                continue
+            for event, data in events:
+                position += 1
+                yield f"id: {position}\nevent: {event}\ndata: {json.dumps(data)}\n\n"
+            if closed and position >= len(self._events):
+                return
@@ -0,0 +1,276 @@
+"""In-process STT worker for the UI server.
+
+Each `--hf-repo` is loaded once (Mimi, tokenizer and LM, through the `dsm`
+library of `scripts/`) and kept resident, so that a transcription request only
+pays for inference instead of a fresh `uv run stt_from_file_pytorch.py`
+process and a full checkpoint load.
+"""
+
+import logging
+import math
+import sys
+import threading
+import time
+from collections.abc import Callable, Iterable
+from pathlib import Path
+
+import moshi.models
+import sphn
+import torch
+
+SCRIPTS_DIR = Path(__file__).resolve().parents[2] / "scripts"
+if str(SCRIPTS_DIR) not in sys.path:
+    sys.path.insert(0, str(SCRIPTS_DIR))
+
+from batch_scheduler import BatchedSttScheduler, SttJob  # noqa: E402
+from dsm import (  # noqa: E402
+    IncrementalWords,
+    TimestampedText,
+    Transcriber,
+    profiling,
+    resample,
+)
+from transcription_cache import TranscriptionCache  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+
+def default_device() -> str:
+    return "cuda" if torch.cuda.is_available() else "cpu"
+
+
+class LoadedSttModel(Transcriber):
+    """A `dsm.Transcriber` whose transcriptions all share the slots of a
+    single batched streaming session, see `BatchedSttScheduler`.
+    """
+
+    def __init__(self, hf_repo: str, device: str, batch_size: int = 1):
+        self.hf_repo = hf_repo
+        info = moshi.models.loaders.CheckpointInfo.from_hf_repo(hf_repo)
+        super().__init__(info, device=device, support_out_of_sync=True)
+        # Taken before the scheduler starts its session, the models can only be in one.
+        prefix = self.silence_snapshot() if self.cache_prefix else None
+        self.n_job_prefix = 0 if prefix is not None else None
+        self.scheduler = BatchedSttScheduler(
+            self.mimi, self.lm_gen, batch_size=batch_size, prefix=prefix
+        )
+
+    @torch.no_grad()
+    def transcribe_tokens(self, audio: torch.Tensor, sample_rate: int) -> torch.Tensor:
+        with profiling.span("resample"):
+            audio = audio.float().cpu().mean(dim=0, keepdim=True)
+            audio = resample(audio, sample_rate, self.mimi.sample_rate)
+
+        # The whole audio is in memory, so the job is fully queued before it starts.
+        job = SttJob()
+        for frame in self.frames([audio], device="cpu", n_prefix=self.n_job_prefix):
+            job.put_frame(frame)
+        job.end_of_audio()
+        self.scheduler.submit(job)
+        tokens = [token for chunk in job.iter_tokens() for token in chunk]
+        return torch.tensor(tokens, dtype=torch.long)
+
+    def transcribe_file(self, path, offset_seconds: float = 0.0) -> str:
+        audio, sample_rate = sphn.read(str(path))
+        return self.transcribe(torch.from_numpy(audio), sample_rate, offset_seconds)
+
+    @torch.no_grad()
+    def stream_words(
+        self,
+        pcm_chunks: Iterable[torch.Tensor],
+        on_words: Callable[[list[TimestampedText], float], None],
+        should_stop: Callable[[], bool] | None = None,
+        max_buffered_seconds: float = 10.0,
+    ) -> bool:
+        """Runs one continuous streaming transcription over `[1, T]` PCM chunks.
+
+        The chunks must already be at `mimi.sample_rate` and can have any length,
+        at most `max_buffered_seconds` of audio is queued ahead of the model.
+        `on_words(words, audio_seconds)` is called as words get finalized, with
+        the amount of audio transcribed so far.
+        Returns False if `should_stop` interrupted the transcription.
+        """
+        mimi = self.mimi
+        job = SttJob(
+            max_buffered_frames=math.ceil(max_buffered_seconds * mimi.frame_rate)
+        )
+        consumed = [0]
+        feed_errors = []
+
+        def _feed():
+            try:
+                frames = self.frames(
+                    pcm_chunks,
+                    device="cpu",
+                    consumed=consumed,
+                    n_prefix=self.n_job_prefix,
+                )
+                for frame in frames:
+                    if not job.put_frame(frame):
+                        return
+                job.end_of_audio()
+            except Exception as e:
+                feed_errors.append(e)
+                job.cancel()
+
+        feeder = threading.Thread(target=_feed, name="stt-feeder", daemon=True)
+        feeder.start()
+        self.scheduler.submit(job)
+
+        def _audio_seconds():
+            steps = max(0, job.steps - self.n_prefix_chunks)
+            return min(consumed[0], steps * mimi.frame_size) / mimi.sample_rate
+
+        words = IncrementalWords(
+            self.tokenizer,
+            mimi.frame_rate,
+            padding_token_id=self.padding_token_id,
+            offset_seconds=self.timestamp_offset,
+        )
+        try:
+            for tokens in job.iter_tokens(should_stop=should_stop):
+                with profiling.span("detokenize"):
+                    new_words = words.push(tokens)
+                if new_words:
+                    on_words(new_words, _audio_seconds())
+        finally:
+            job.cancel()
+            feeder.join()
+
+        if feed_errors:
+            raise feed_errors[0]
+        if should_stop is not None and should_stop():
+            return False
+        on_words(words.finish(), consumed[0] / mimi.sample_rate)
+        return True
+
+
+class SttWorker:
+    """Loads STT models on demand (or at startup) and keeps them warm.
+
+    Args:
+        batch_size: slots of the batched session of each model, i.e. how many
+            transcriptions run concurrently. Defaults to 8 on GPU and 1 on CPU,
+            where idle slots are not free.
+        cache: optional `TranscriptionCache` consulted by `transcribe`.
+    """
+
+    def __init__(
+        self,
+        device: str | None = None,
+        batch_size: int | None = None,
+        cache: TranscriptionCache | None = None,
+    ):
+        self.device = device or default_device()
+        self.cache = cache
+        if batch_size is None:
+            batch_size = 8 if self.device.startswith("cuda") else 1
+        self.batch_size = batch_size
+        self._models: dict[str, LoadedSttModel] = {}
+        self._status: dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._loading: dict[str, threading.Event] = {}
+
+    def get(self, hf_repo: str) -> LoadedSttModel:
+        """Returns the resident model for `hf_repo`, loading it on first use."""
+        with self._lock:
+            model = self._models.get(hf_repo)
+            if model is not None:
+                return model
+            event = self._loading.get(hf_repo)
+            owner = event is None
+            if owner:
+                event = threading.Event()
+                self._loading[hf_repo] = event
+                self._status[hf_repo] = {"status": "loading", "since": time.time()}
+
+        if not owner:
+            event.wait()
+            with self._lock:
+                if hf_repo in self._models:
+                    return self._models[hf_repo]
+                error = self._status[hf_repo].get("error")
+            raise RuntimeError(f"Failed to load STT model {hf_repo}: {error}")
+
+        start = time.time()
+        logger.info(f"Loading STT model {hf_repo} on {self.device}...")
+        try:
+            model = LoadedSttModel(hf_repo, self.device, batch_size=self.batch_size)
+        except Exception as e:
+            logger.exception(f"Failed to load STT model {hf_repo}")
+            with self._lock:
+                self._status[hf_repo] = {"status": "error", "error": str(e)}
+                del self._loading[hf_repo]
+            event.set()
+            raise
+
+        load_seconds = time.time() - start
+        logger.info(f"✅ STT model {hf_repo} loaded in {load_seconds:.1f} seconds")
+        with self._lock:
+            self._models[hf_repo] = model
+            self._status[hf_repo] = {"status": "ready", "load_seconds": load_seconds}
+            del self._loading[hf_repo]
+        event.set()
+        return model
+
+    def preload(self, hf_repos: list[str]) -> threading.Thread:
+        """Warm up the given models in a background thread."""
+
+        def _preload():
+            for hf_repo in hf_repos:
+                try:
+                    self.get(hf_repo)
+                except Exception:
+                    pass
+
+        thread = threading.Thread(target=_preload, name="stt-preload", daemon=True)
+        thread.start()
+        return thread
+
+    def transcribe_file(self, hf_repo: str, path, offset_seconds: float = 0.0) -> str:
+        audio, sample_rate = sphn.read(str(path))
+        return self.transcribe(
+            hf_repo, torch.from_numpy(audio), sample_rate, offset_seconds=offset_seconds
+        )
+
+    def transcribe(
+        self,
+        hf_repo: str,
+        audio: torch.Tensor,
+        sample_rate: int,
+        offset_seconds: float = 0.0,
+    ) -> str:
+        """Transcribe with the model from `hf_repo`, going through the cache if any."""
+        if self.cache is None:
+            return self.get(hf_repo).transcribe(audio, sample_rate, offset_seconds)
+
+        key = self.cache.make_key(
+            audio, sample_rate, hf_repo, offset_seconds=offset_seconds, prompt=None
+        )
+        words = self.cache.get(key)
+        if words is None:
+            timed_text = self.get(hf_repo).transcribe_words(
+                audio, sample_rate, offset_seconds
+            )
+            words = [
+                {"text": t.text, "start": t.timestamp[0], "end": t.timestamp[1]}
+                for t in timed_text
+            ]
+            self.cache.put(key, words)
+        return " ".join(
+            str(TimestampedText(text=w["text"], timestamp=(w["start"], w["end"])))
+            for w in words
+        )
+
+    def status(self) -> dict:
+        with self._lock:
+            models = {repo: dict(status) for repo, status in self._status.items()}
+            for repo, model in self._models.items():
+                models[repo]["scheduler"] = model.scheduler.status()
+        return {
+            "device": self.device,
+            "cache": self.cache.stats() if self.cache is not None else None,
+            "ready": bool(models)
+            and all(s["status"] == "ready" for s in models.values()),
+            "models": models,
+        }
@@ -0,0 +1,139 @@
+"""Content-addressed cache of transcriptions.
+
+Entries are keyed by the hash of the decoded audio, the model repo and the
+decoding parameters, so re-uploading the same recording (whatever its file
+name or container) skips inference. Each entry stores the word-level
+timestamps as JSON. A small in-memory LRU sits in front of the disk store,
+and both are bounded in bytes with least-recently-used eviction.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+import torch
+
+logger = logging.getLogger(__name__)
+
+
+class TranscriptionCache:
+    """
+    Args:
+        directory: where entries are stored, one JSON file per key.
+        max_disk_bytes: budget of the disk store.
+        max_memory_bytes: budget of the in-memory LRU in front of it.
+    """
+
+    def __init__(
+        self,
+        directory,
+        max_disk_bytes: int = 512 * 1024 * 1024,
+        max_memory_bytes: int = 32 * 1024 * 1024,
+    ):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_disk_bytes = max_disk_bytes
+        self.max_memory_bytes = max_memory_bytes
+
+        self._lock = threading.Lock()
+        self._memory: OrderedDict[str, bytes] = OrderedDict()
+        self._memory_bytes = 0
+        # Disk index in LRU order (oldest first), rebuilt from the file mtimes.
+        self._disk: OrderedDict[str, int] = OrderedDict()
+        self._disk_bytes = 0
+        files = sorted(self.directory.glob("*.json"), key=lambda p: p.stat().st_mtime)
+        for path in files:
+            size = path.stat().st_size
+            self._disk[path.stem] = size
+            self._disk_bytes += size
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(audio: torch.Tensor, sample_rate: int, hf_repo: str, **params) -> str:
+        """Hash of the decoded samples, the model and the decoding parameters
+        (e.g. `offset_seconds`, `prompt`)."""
+        samples = np.ascontiguousarray(audio.detach().cpu().float().numpy())
+        digest = hashlib.sha256()
+        digest.update(samples.tobytes())
+        header = {"sample_rate": int(sample_rate), "shape": list(samples.shape)}
+        header.update(hf_repo=hf_repo, params=params)
+        digest.update(json.dumps(header, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.directory / f"{key}.json"
+
+    def _remember(self, key: str, data: bytes) -> None:
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.max_memory_bytes and len(self._memory) > 1:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def get(self, key: str) -> list[dict] | None:
+        """Returns the cached words (`text`, `start`, `end`) or None."""
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+            elif key in self._disk:
+                try:
+                    data = self._path(key).read_bytes()
+                    os.utime(self._path(key))
+                except FileNotFoundError:
+                    self._disk_bytes -= self._disk.pop(key)
+                else:
+                    self._disk.move_to_end(key)
+                    self._remember(key, data)
+            if data is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(data)
+
+    def put(self, key: str, words: list[dict]) -> None:
+        data = json.dumps(words).encode()
+        path = self._path(key)
+        tmp_path = path.with_suffix(f".tmp{threading.get_ident()}")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+        with self._lock:
+            if key in self._disk:
+                self._disk_bytes -= self._disk.pop(key)
+            self._disk[key] = len(data)
+            self._disk_bytes += len(data)
+            self._remember(key, data)
+            while self._disk_bytes > self.max_disk_bytes and len(self._disk) > 1:
+                evicted, size = self._disk.popitem(last=False)
+                self._disk_bytes -= size
+                self.evictions += 1
+                self._path(evicted).unlink(missing_ok=True)
+                if evicted in self._memory:
+                    self._memory_bytes -= len(self._memory.pop(evicted))
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._disk),
+                "disk_bytes": self._disk_bytes,
+                "max_disk_bytes": self.max_disk_bytes,
+                "memory_entries": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "max_memory_bytes": self.max_memory_bytes,
+            }
@@ -0,0 +1,255 @@
+"""Cache of generated TTS audio.
+
+Results are stored as WAV files keyed by the text, voice and generation
+parameters, so the same request is only synthesized once. Identical requests
+arriving while the first one is still being generated wait for it instead of
+starting their own generation, whether that one is a batched or a streamed
+generation (see `claim`). A background thread evicts entries that were
+not used for `ttl_seconds`, then the least recently used ones until the
+directory fits in `max_bytes`.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import CancelledError, Future
+from pathlib import Path
+
+import numpy as np
+import sphn
+
+logger = logging.getLogger(__name__)
+
+# `TtsCache.filename`, the directory can hold other files, e.g. STT uploads.
+_CACHE_FILENAME = re.compile(r"tts_[0-9a-f]{64}\.wav")
+
+
+class TtsCache:
+    """
+    Args:
+        directory: where the WAV files are written (and served from). Only
+            the files named by `filename` are managed, others are left alone.
+        max_bytes: size quota of the directory.
+        ttl_seconds: entries not used for that long are evicted, None to
+            only evict on size.
+        sweep_interval: seconds between two eviction passes.
+    """
+
+    def __init__(
+        self,
+        directory,
+        max_bytes: int = 1024 * 1024 * 1024,
+        ttl_seconds: float | None = 24 * 3600,
+        sweep_interval: float = 60.0,
+    ):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.sweep_interval = sweep_interval
+
+        self._lock = threading.Lock()
+        # Last access time and size of every file, entries written by earlier
+        # runs of the server are picked up too and evicted first.
+        self._entries: dict[str, tuple[float, int]] = {}
+        for path in self.directory.glob("tts_*.wav"):
+            if not _CACHE_FILENAME.fullmatch(path.name):
+                continue
+            stat = path.stat()
+            self._entries[path.name] = (stat.st_mtime, stat.st_size)
+        self._in_flight: dict[str, Future] = {}
+        self._wakeup = threading.Event()
+
+        self.hits = 0
+        self.misses = 0
+        self.collapsed = 0
+        self.evictions = 0
+
+        self._thread = threading.Thread(
+            target=self._sweep_loop, name="tts-cache-sweeper", daemon=True
+        )
+        self._thread.start()
+
+    @staticmethod
+    def make_key(text: str, voice: str, **params) -> str:
+        """Hash of the request, `params` holds e.g. `temp`, `n_q` and `seed`."""
+        payload = json.dumps(
+            {"text": text, "voice": voice, "params": params}, sort_keys=True
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    @staticmethod
+    def filename(key: str) -> str:
+        return f"tts_{key}.wav"
+
+    def lookup(self, key: str) -> Path | None:
+        """Returns the WAV file of `key` if it is cached."""
+        name = self.filename(key)
+        path = self.directory / name
+        with self._lock:
+            if name in self._entries and path.exists():
+                self._entries[name] = (time.time(), self._entries[name][1])
+                self.hits += 1
+                return path
+            self.misses += 1
+            return None
+
+    def store(self, key: str, pcm: np.ndarray, sample_rate: int) -> Path:
+        """Adds the audio of `key`, e.g. once a streamed generation is over.
+
+        Requests waiting on a `claim` of `key` get the new file.
+        """
+        path = self._write(key, pcm, sample_rate)
+        self._added(path, key)
+        return path
+
+    def claim(self, key: str) -> Future | None:
+        """Returns None if the caller now owns the generation of `key`, and
+        must then `store` or `abandon` it. Otherwise, returns a future of the
+        WAV path: already done on a cache hit, or the pending result of the
+        generation in progress.
+
+        The future is cancelled if its owner abandons the generation without
+        an error (e.g. a streaming client went away), callers then claim again.
+        """
+        name = self.filename(key)
+        path = self.directory / name
+        with self._lock:
+            if name in self._entries and path.exists():
+                self._entries[name] = (time.time(), self._entries[name][1])
+                self.hits += 1
+                future = Future()
+                future.set_result(path)
+                return future
+            future = self._in_flight.get(key)
+            if future is not None:
+                self.collapsed += 1
+                return future
+            self._in_flight[key] = Future()
+            self.misses += 1
+            return None
+
+    def abandon(self, key: str, error: BaseException | None = None) -> None:
+        """Gives up the generation of `key` claimed by the caller, the
+        requests waiting for it get `error`, or claim it again if None."""
+        with self._lock:
+            future = self._in_flight.pop(key, None)
+        if future is None:
+            return
+        if error is None:
+            future.cancel()
+        else:
+            future.set_exception(error)
+
+    def _write(self, key: str, pcm: np.ndarray, sample_rate: int) -> Path:
+        path = self.directory / self.filename(key)
+        tmp_path = path.with_name(f"{path.name}.tmp{threading.get_ident()}.wav")
+        sphn.write_wav(str(tmp_path), pcm, sample_rate)
+        os.replace(tmp_path, path)
+        return path
+
+    def _added(self, path: Path, key: str) -> None:
+        with self._lock:
+            self._entries[path.name] = (time.time(), path.stat().st_size)
+            future = self._in_flight.pop(key, None)
+            over_quota = self._total_bytes() > self.max_bytes
+        if future is not None:
+            future.set_result(path)
+        if over_quota:
+            self._wakeup.set()
+
+    def get_or_generate(
+        self, key: str, generate: Callable[[], tuple[np.ndarray, int]]
+    ) -> tuple[Path, bool]:
+        """Returns the path of the WAV file for `key` and whether it was cached.
+
+        On a miss `generate` is called to produce the PCM and its sample rate,
+        unless the same key is already being generated, in which case this
+        waits for that result.
+        """
+        while True:
+            future = self.claim(key)
+            if future is None:
+                break
+            try:
+                return future.result(), True
+            except CancelledError:
+                # Abandoned by its owner, e.g. a stream whose client went away.
+                continue
+
+        try:
+            pcm, sample_rate = generate()
+            path = self._write(key, pcm, sample_rate)
+        except BaseException as e:
+            self.abandon(key, e)
+            raise
+        self._added(path, key)
+        return path, False
+
+    def clear(self) -> int:
+        """Deletes every entry, returns how many files were removed."""
+        with self._lock:
+            names = list(self._entries)
+            self._entries.clear()
+        for name in names:
+            (self.directory / name).unlink(missing_ok=True)
+        return len(names)
+
+    def _total_bytes(self) -> int:
+        return sum(size for _, size in self._entries.values())
+
+    def _sweep_loop(self) -> None:
+        while True:
+            self._wakeup.wait(timeout=self.sweep_interval)
+            self._wakeup.clear()
+            try:
+                self.sweep()
+            except Exception:
+                logger.exception("TTS cache eviction failed")
+
+    def sweep(self) -> int:
+        """Evicts expired entries, then the oldest ones while over quota."""
+        evicted = []
+        with self._lock:
+            if self.ttl_seconds is not None:
+                deadline = time.time() - self.ttl_seconds
+                evicted += [
+                    n for n, (used, _) in self._entries.items() if used < deadline
+                ]
+                for name in evicted:
+                    del self._entries[name]
+            total = self._total_bytes()
+            by_last_use = sorted(self._entries.items(), key=lambda item: item[1][0])
+            for name, (_, size) in by_last_use:
+                if total <= self.max_bytes:
+                    break
+                del self._entries[name]
+                evicted.append(name)
+                total -= size
+            self.evictions += len(evicted)
+        for name in evicted:
+            (self.directory / name).unlink(missing_ok=True)
+        if evicted:
+            logger.info(f"Evicted {len(evicted)} TTS cache entries")
+        return len(evicted)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses + self.collapsed
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "collapsed": self.collapsed,
+                "hit_rate": (self.hits + self.collapsed) / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "in_flight": len(self._in_flight),
+                "bytes": self._total_bytes(),
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+            }
@@ -0,0 +1,349 @@
+"""Long-lived, batching TTS engine for the UI server.
+
+The model is loaded once in a worker thread. Requests arriving within a short
+batching window are synthesized together in a single `tts_model.generate` call
+instead of one `uv run tts_pytorch.py` process (and model load) per request.
+Streaming requests are generated on their own, and their audio is decoded and
+handed out frame by frame as in `tts_pytorch.py`. They cannot be batched and
+run one at a time on the same worker thread: the batched requests that arrive
+meanwhile are served between two streams, but wait for the stream in progress.
+"""
+
+import logging
+import queue
+import sys
+import threading
+import time
+from collections import deque
+from collections.abc import Iterator
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import numpy as np
+import torch
+from moshi.models.loaders import CheckpointInfo
+from moshi.models.tts import DEFAULT_DSM_TTS_REPO, DEFAULT_DSM_TTS_VOICE_REPO, TTSModel
+
+SCRIPTS_DIR = Path(__file__).resolve().parents[2] / "scripts"
+if str(SCRIPTS_DIR) not in sys.path:
+    sys.path.insert(0, str(SCRIPTS_DIR))
+
+from dsm import profiling  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_VOICE = "expresso/ex03-ex01_happy_001_channel1_334s.wav"
+
+
+@dataclass
+class TtsRequest:
+    text: str
+    voice: str
+    seed: int | None = None
+    future: Future = field(default_factory=Future)
+    # Set for streaming requests, receives PCM chunks then None.
+    chunks: queue.Queue | None = None
+    # Set when the consumer of a stream is gone, the generation then stops.
+    cancelled: threading.Event = field(default_factory=threading.Event)
+
+
+class _StreamCancelled(Exception):
+    pass
+
+
+class TtsEngine:
+    """Collects concurrent requests and runs them as one batched generation.
+
+    Args:
+        batch_size: maximum number of requests per `generate` call, matches
+            `batch_size` of the `modules.tts_py` config.
+        batch_window: how long (in seconds) to wait for more requests once the
+            first one of a batch has arrived.
+        max_stream_frames: frames of a stream buffered ahead of its consumer,
+            past that the generation waits for it.
+    """
+
+    def __init__(
+        self,
+        hf_repo: str = DEFAULT_DSM_TTS_REPO,
+        voice_repo: str = DEFAULT_DSM_TTS_VOICE_REPO,
+        device: str | None = None,
+        batch_size: int = 8,
+        batch_window: float = 0.05,
+        n_q: int = 32,
+        temp: float = 0.6,
+        cfg_coef: float = 2.0,
+        max_stream_frames: int = 250,
+    ):
+        self.hf_repo = hf_repo
+        self.voice_repo = voice_repo
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.n_q = n_q
+        self.temp = temp
+        self.cfg_coef = cfg_coef
+        self.max_stream_frames = max_stream_frames
+
+        self.tts_model: TTSModel | None = None
+        self._voice_paths = {}
+        self._requests: queue.Queue[TtsRequest] = queue.Queue()
+        self._status = {"status": "stopped"}
+        self._thread: threading.Thread | None = None
+        self._start_lock = threading.Lock()
+
+    @property
+    def sample_rate(self) -> int:
+        assert self.tts_model is not None
+        return self.tts_model.mimi.sample_rate
+
+    def start(self) -> None:
+        """Starts the worker thread, the model is loaded there in the background."""
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self._status = {"status": "loading", "since": time.time()}
+            self._thread = threading.Thread(
+                target=self._run, name="tts-engine", daemon=True
+            )
+            self._thread.start()
+
+    def synthesize(
+        self, text: str, voice: str | None = None, seed: int | None = None
+    ) -> Future:
+        """Queues `text` for synthesis, the future resolves to a float32 PCM array.
+
+        Requests with a `seed` are only batched with requests with the same seed.
+        """
+        self.start()
+        request = TtsRequest(text=text, voice=voice or DEFAULT_VOICE, seed=seed)
+        self._requests.put(request)
+        return request.future
+
+    def synthesize_stream(
+        self, text: str, voice: str | None = None, seed: int | None = None
+    ) -> Iterator[np.ndarray]:
+        """Yields float32 PCM chunks (one Mimi frame each) as they are decoded.
+
+        Closing the generator early (e.g. the client went away) stops the
+        generation at the next frame.
+        """
+        self.start()
+        request = TtsRequest(
+            text=text,
+            voice=voice or DEFAULT_VOICE,
+            seed=seed,
+            chunks=queue.Queue(maxsize=self.max_stream_frames),
+        )
+        self._requests.put(request)
+        try:
+            while True:
+                chunk = request.chunks.get()
+                if chunk is None:
+                    break
+                yield chunk
+        finally:
+            request.cancelled.set()
+        # Raises if the generation failed.
+        request.future.result()
+
+    def status(self) -> dict:
+        return dict(self._status, queued=self._requests.qsize())
+
+    def _load(self) -> None:
+        start = time.time()
+        logger.info(f"Loading TTS model {self.hf_repo} on {self.device}...")
+        checkpoint_info = CheckpointInfo.from_hf_repo(self.hf_repo)
+        self.tts_model = TTSModel.from_checkpoint_info(
+            checkpoint_info,
+            voice_repo=self.voice_repo,
+            n_q=self.n_q,
+            temp=self.temp,
+            device=torch.device(self.device),
+        )
+        load_seconds = time.time() - start
+        logger.info(f"✅ TTS model loaded in {load_seconds:.1f} seconds")
+        self._status = {"status": "ready", "load_seconds": load_seconds}
+
+    def _next_batch(self, block: bool = True) -> list[TtsRequest]:
+        try:
+            batch = [self._requests.get(block=block)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.batch_window
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> None:
+        try:
+            self._load()
+        except Exception as e:
+            logger.exception("Failed to load TTS model")
+            self._status = {"status": "error", "error": str(e)}
+            # Fail whatever is queued now and anything submitted later.
+            while True:
+                request = self._requests.get()
+                request.future.set_exception(
+                    RuntimeError(f"Failed to load TTS model: {e}")
+                )
+                if request.chunks is not None:
+                    request.chunks.put(None)
+
+        streams: deque[TtsRequest] = deque()
+        while True:
+            batch = self._next_batch(block=not streams)
+            batch = [r for r in batch if r.future.set_running_or_notify_cancel()]
+            streams.extend(r for r in batch if r.chunks is not None)
+            batch = [r for r in batch if r.chunks is None]
+            by_seed: dict[int | None, list[TtsRequest]] = {}
+            for request in batch:
+                by_seed.setdefault(request.seed, []).append(request)
+            for seed, requests in by_seed.items():
+                self._serve(requests, seed)
+            # One stream at a time, so that the requests queued during a
+            # stream do not also wait for the streams queued behind it.
+            if streams:
+                self._serve_stream(streams.popleft())
+
+    def _serve(self, batch: list[TtsRequest], seed: int | None) -> None:
+        start = time.time()
+        try:
+            pcms = self._generate(batch, seed)
+        except Exception as e:
+            logger.exception("TTS generation failed")
+            for request in batch:
+                request.future.set_exception(e)
+            return
+        logger.info(
+            f"Generated {len(batch)} TTS request(s) in one batch "
+            f"in {time.time() - start:.1f} seconds"
+        )
+        for request, pcm in zip(batch, pcms):
+            request.future.set_result(pcm)
+
+    def _serve_stream(self, request: TtsRequest) -> None:
+        start = time.time()
+        try:
+            if request.cancelled.is_set():
+                raise _StreamCancelled()
+            self._generate_stream(request)
+        except _StreamCancelled:
+            logger.info(f"TTS stream cancelled after {time.time() - start:.1f} seconds")
+            request.future.set_result(None)
+        except Exception as e:
+            logger.exception("TTS streaming generation failed")
+            request.future.set_exception(e)
+        else:
+            logger.info(f"Streamed TTS request in {time.time() - start:.1f} seconds")
+            request.future.set_result(None)
+        finally:
+            try:
+                self._put_chunk(request, None)
+            except _StreamCancelled:
+                pass
+
+    @staticmethod
+    def _put_chunk(request: TtsRequest, chunk: np.ndarray | None) -> None:
+        """Waits for room in the stream buffer, raises `_StreamCancelled` if
+        the consumer is gone."""
+        while not request.cancelled.is_set():
+            try:
+                request.chunks.put(chunk, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+        raise _StreamCancelled()
+
+    def _voice_path(self, voice: str):
+        if voice not in self._voice_paths:
+            self._voice_paths[voice] = self.tts_model.get_voice_path(voice)
+        return self._voice_paths[voice]
+
+    @torch.no_grad()
+    def _generate(
+        self, batch: list[TtsRequest], seed: int | None = None
+    ) -> list[np.ndarray]:
+        tts_model = self.tts_model
+        assert tts_model is not None
+        if seed is not None:
+            torch.manual_seed(seed)
+
+        all_entries = [
+            tts_model.prepare_script([request.text], padding_between=1)
+            for request in batch
+        ]
+        # CFG coef goes here because the model was trained with CFG distillation.
+        all_attributes = [
+            tts_model.make_condition_attributes(
+                [self._voice_path(request.voice)], cfg_coef=self.cfg_coef
+            )
+            for request in batch
+        ]
+        with profiling.span("tts.generate"):
+            result = tts_model.generate(all_entries, all_attributes)
+
+        with tts_model.mimi.streaming(len(batch)):
+            pcms = []
+            for frame in result.frames[tts_model.delay_steps :]:
+                with profiling.span("mimi.decode"):
+                    pcm = tts_model.mimi.decode(frame[:, 1:, :])
+                with profiling.span("to_host"):
+                    pcm = pcm.cpu().numpy()
+                pcms.append(np.clip(pcm[:, 0], -1, 1))
+            pcm = np.concatenate(pcms, axis=-1)
+
+        # All items are generated until the slowest one is done, drop the frames
+        # generated past the end of the shorter ones.
+        frame_size = tts_model.mimi.frame_size
+        end_steps = result.end_steps
+        last_end_step = None
+        if all(end_step is not None for end_step in end_steps):
+            last_end_step = max(end_steps)
+        outputs = []
+        for index, end_step in enumerate(end_steps):
+            length = pcm.shape[-1]
+            if last_end_step is not None:
+                length -= (last_end_step - end_step) * frame_size
+            outputs.append(pcm[index, :length])
+        return outputs
+
+    @torch.no_grad()
+    def _generate_stream(self, request: TtsRequest) -> None:
+        tts_model = self.tts_model
+        assert tts_model is not None
+        if request.seed is not None:
+            torch.manual_seed(request.seed)
+
+        entries = tts_model.prepare_script([request.text], padding_between=1)
+        attributes = tts_model.make_condition_attributes(
+            [self._voice_path(request.voice)], cfg_coef=self.cfg_coef
+        )
+
+        last_frame_ns = time.perf_counter_ns()
+
+        def _on_frame(frame):
+            nonlocal last_frame_ns
+            if request.cancelled.is_set():
+                # Unwinds `generate`, nobody reads the audio any more.
+                raise _StreamCancelled()
+            # Time spent in the LM and depformer since the previous frame.
+            profiling.record("lm_gen.step", last_frame_ns, time.perf_counter_ns())
+            # Frames are -1 until the audio delay is filled.
+            if (frame != -1).all():
+                with profiling.span("mimi.decode"):
+                    pcm = tts_model.mimi.decode(frame[:, 1:, :])
+                with profiling.span("to_host"):
+                    pcm = pcm.cpu().numpy()
+                self._put_chunk(request, np.clip(pcm[0, 0], -1, 1))
+            last_frame_ns = time.perf_counter_ns()
+
+        with tts_model.mimi.streaming(1):
+            tts_model.generate([entries], [attributes], on_frame=_on_frame)
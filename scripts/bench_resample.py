@@ -0,0 +1,81 @@
+# /// script
+# requires-python = ">=3.12"
+# dependencies = [
+#     "julius",
+#     "moshi",
+# ]
+# ///
+
+"""Micro-benchmark of `dsm.resample_group` against one `julius.resample_frac`
+call per clip, on random clips of mixed lengths and sample rates.
+"""
+
+import argparse
+import random
+import time
+
+import julius
+import torch
+
+from dsm import get_resampler, resample_group
+
+
+def make_clips(n_clips: int, sample_rates: list[int], min_s: float, max_s: float):
+    rng = random.Random(0)
+    clips = []
+    for _ in range(n_clips):
+        sr = rng.choice(sample_rates)
+        length = int(sr * rng.uniform(min_s, max_s))
+        clips.append((torch.randn(length), sr))
+    return clips
+
+
+def timed(fn, repeats: int) -> float:
+    fn()  # Warm-up, also builds the cached kernels.
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats
+
+
+def main(args):
+    torch.set_num_threads(args.threads)
+    clips = make_clips(
+        args.clips, args.sample_rates, args.min_seconds, args.max_seconds
+    )
+
+    def per_clip():
+        return [julius.resample_frac(clip, sr, args.target_sr) for clip, sr in clips]
+
+    def grouped():
+        return resample_group(clips, args.target_sr)
+
+    reference = per_clip()
+    max_error = max(
+        (ref - out).abs().max().item() for ref, out in zip(reference, grouped())
+    )
+
+    per_clip_s = timed(per_clip, args.repeats)
+    get_resampler.cache_clear()
+    grouped_s = timed(grouped, args.repeats)
+    audio_s = sum(clip.shape[-1] / sr for clip, sr in clips)
+    print(f"{len(clips)} clips, {audio_s:.1f}s of audio -> {args.target_sr} Hz")
+    print(f"per-clip julius.resample_frac: {1000 * per_clip_s:.1f} ms")
+    print(f"dsm.resample_group:            {1000 * grouped_s:.1f} ms")
+    print(
+        f"speedup: {per_clip_s / grouped_s:.2f}x, max abs difference: {max_error:.2e}"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark grouped resampling.")
+    parser.add_argument("--clips", type=int, default=64)
+    parser.add_argument(
+        "--sample-rates", type=int, nargs="+", default=[16000, 44100, 48000]
+    )
+    parser.add_argument("--target-sr", type=int, default=24000)
+    parser.add_argument("--min-seconds", type=float, default=1.0)
+    parser.add_argument("--max-seconds", type=float, default=15.0)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--threads", type=int, default=4)
+    main(parser.parse_args())
@@ -0,0 +1,367 @@
+# /// script
+# requires-python = ">=3.12"
+# dependencies = [
+#     "moshi",
+# ]
+# ///
+
+"""CPU benchmark of the streaming STT and TTS step loops.
+
+The models are randomly initialized, scaled-down versions of the ones in
+`configs/config-stt-*.toml` and `configs/config-tts.toml` (same codebooks,
+vocabulary and delays, smaller `d_model` and `num_layers`), so this runs on
+a CPU-only machine without downloading anything. The numbers are only
+meaningful relative to other runs of the same preset on the same machine.
+
+    uv run scripts/bench_streaming.py run --output before.json
+    uv run scripts/bench_streaming.py run --output after.json
+    uv run scripts/bench_streaming.py compare before.json after.json
+"""
+
+import argparse
+import concurrent.futures
+import json
+import multiprocessing
+import platform
+import resource
+import statistics
+import sys
+import time
+
+import moshi
+import torch
+from moshi.models import LMGen, LMModel, MimiModel, loaders
+from moshi.modules import SEANetDecoder, SEANetEncoder, transformer
+from moshi.quantization import SplitResidualVectorQuantizer
+
+PRESETS = {
+    "tiny": dict(
+        mimi_dim=128,
+        mimi_filters=16,
+        mimi_layers=2,
+        lm_dim=256,
+        lm_layers=4,
+        lm_heads=4,
+        depformer_dim=128,
+        depformer_layers=2,
+    ),
+    "small": dict(
+        mimi_dim=256,
+        mimi_filters=32,
+        mimi_layers=4,
+        lm_dim=512,
+        lm_layers=8,
+        lm_heads=8,
+        depformer_dim=256,
+        depformer_layers=4,
+    ),
+}
+# Shapes of the released checkpoints, see the config files.
+N_Q = 32
+CARD = 2048
+TEXT_CARD = 4000
+
+
+def build_mimi(preset: dict, device) -> MimiModel:
+    """Same layout as `loaders.get_mimi`, with a smaller SEANet and transformers."""
+    dim = preset["mimi_dim"]
+    seanet_kwargs = loaders._seanet_kwargs | {
+        "dimension": dim,
+        "n_filters": preset["mimi_filters"],
+    }
+    transformer_kwargs = loaders._transformer_kwargs | {
+        "d_model": dim,
+        "num_heads": 4,
+        "num_layers": preset["mimi_layers"],
+        "dim_feedforward": 4 * dim,
+        "input_dimension": dim,
+        "output_dimensions": [dim],
+    }
+    quantizer_kwargs = loaders._quantizer_kwargs | {
+        "dimension": dim // 2,
+        "n_q": N_Q,
+        "bins": CARD,
+        "input_dimension": dim,
+        "output_dimension": dim,
+    }
+    encoder = SEANetEncoder(**seanet_kwargs)
+    model = MimiModel(
+        encoder,
+        SEANetDecoder(**seanet_kwargs),
+        SplitResidualVectorQuantizer(**quantizer_kwargs),
+        channels=1,
+        sample_rate=loaders.SAMPLE_RATE,
+        frame_rate=loaders.FRAME_RATE,
+        encoder_frame_rate=loaders.SAMPLE_RATE / encoder.hop_length,
+        causal=True,
+        resample_method="conv",
+        encoder_transformer=transformer.ProjectedTransformer(
+            device=device, **transformer_kwargs
+        ),
+        decoder_transformer=transformer.ProjectedTransformer(
+            device=device, **transformer_kwargs
+        ),
+    ).to(device=device)
+    model.eval()
+    model.set_num_codebooks(N_Q)
+    return model
+
+
+def build_lm(preset: dict, tts: bool, device, dtype) -> LMModel:
+    """An STT-shaped LM (audio in, text out, no depformer), or a TTS-shaped
+    one (the depformer generates all the audio codebooks)."""
+    lm_kwargs = dict(
+        dim=preset["lm_dim"],
+        num_heads=preset["lm_heads"],
+        num_layers=preset["lm_layers"],
+        hidden_scale=4,
+        n_q=N_Q,
+        card=CARD,
+        text_card=TEXT_CARD,
+        existing_text_padding_id=3,
+        causal=True,
+        context=375,
+        max_period=100000,
+        gating="silu",
+        norm="rms_norm_f32",
+        positional_embedding="rope",
+    )
+    if tts:
+        lm_kwargs |= dict(
+            dep_q=N_Q,
+            delays=[0] + [2] * N_Q,
+            depformer_dim=preset["depformer_dim"],
+            depformer_num_heads=4,
+            depformer_num_layers=preset["depformer_layers"],
+            depformer_multi_linear=True,
+            depformer_weights_per_step=True,
+            depformer_pos_emb="none",
+        )
+    else:
+        lm_kwargs |= dict(dep_q=0, delays=[0] * (N_Q + 1))
+    return loaders.get_moshi_lm(None, lm_kwargs=lm_kwargs, device=device, dtype=dtype)
+
+
+def sync(device) -> None:
+    if str(device).startswith("cuda"):
+        torch.cuda.synchronize()
+
+
+def peak_memory_mb(device) -> float:
+    if str(device).startswith("cuda"):
+        return torch.cuda.max_memory_allocated() / 2**20
+    # Peak RSS of the process so far, in KiB on Linux. Every benchmark runs in
+    # its own process (see `run`), so this is the peak of that benchmark,
+    # models included.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def summarize(seconds: list[float]) -> dict:
+    ms = sorted(1000 * s for s in seconds)
+    return {
+        "mean_ms": statistics.fmean(ms),
+        "p50_ms": ms[len(ms) // 2],
+        "p90_ms": ms[min(len(ms) - 1, int(0.9 * len(ms)))],
+    }
+
+
+@torch.no_grad()
+def bench_stt(mimi, lm, batch_size: int, steps: int, warmup: int, device) -> dict:
+    """Per-step latency of `mimi.encode` and `lm_gen.step` on noise."""
+    lm_gen = LMGen(lm, temp=0, temp_text=0.0)
+    encode_s, step_s = [], []
+    with mimi.streaming(batch_size), lm_gen.streaming(batch_size):
+        for step in range(warmup + steps):
+            frame = 0.1 * torch.randn(batch_size, 1, mimi.frame_size, device=device)
+            sync(device)
+            start = time.perf_counter()
+            audio_tokens = mimi.encode(frame)
+            sync(device)
+            encoded = time.perf_counter()
+            lm_gen.step(audio_tokens)
+            sync(device)
+            if step >= warmup:
+                encode_s.append(encoded - start)
+                step_s.append(time.perf_counter() - encoded)
+    audio_seconds = steps * batch_size / mimi.frame_rate
+    return {
+        "mimi_encode": summarize(encode_s),
+        "lm_step": summarize(step_s),
+        "rtf": audio_seconds / (sum(encode_s) + sum(step_s)),
+        "peak_memory_mb": peak_memory_mb(device),
+    }
+
+
+@torch.no_grad()
+def bench_tts(mimi, lm, batch_size: int, steps: int, warmup: int, device) -> dict:
+    """Generation of audio tokens by the LM and depformer, decoded by Mimi
+    frame by frame as in the `on_frame` path of the TTS scripts."""
+    lm_gen = LMGen(lm, temp=0.6, temp_text=0.6)
+    step_s, decode_s = [], []
+    no_input = torch.zeros((batch_size, 0, 1), dtype=torch.long, device=device)
+    with mimi.streaming(batch_size), lm_gen.streaming(batch_size):
+        for step in range(warmup + steps):
+            sync(device)
+            start = time.perf_counter()
+            frame = lm_gen.step(no_input)
+            sync(device)
+            stepped = time.perf_counter()
+            if frame is not None:
+                mimi.decode(frame[:, 1:])
+                sync(device)
+            if step >= warmup:
+                step_s.append(stepped - start)
+                decode_s.append(time.perf_counter() - stepped)
+    total = sum(step_s) + sum(decode_s)
+    return {
+        "lm_step": summarize(step_s),
+        "mimi_decode": summarize(decode_s),
+        "frames_per_second": steps * batch_size / total,
+        "rtf": steps * batch_size / mimi.frame_rate / total,
+        "peak_memory_mb": peak_memory_mb(device),
+    }
+
+
+def run_bench(name: str, batch_size: int, args) -> dict:
+    torch.manual_seed(0)
+    torch.set_num_threads(args.threads)
+    preset = PRESETS[args.preset]
+    device, dtype = args.device, getattr(torch, args.dtype)
+    mimi = build_mimi(preset, device)
+    lm = build_lm(preset, name == "tts", device, dtype)
+    bench = bench_tts if name == "tts" else bench_stt
+    return bench(mimi, lm, batch_size, args.steps, args.warmup, device)
+
+
+def run(args):
+    device = args.device
+    context = multiprocessing.get_context("spawn")
+    results = {}
+    for name in ("stt", "tts"):
+        if name not in args.only:
+            continue
+        for batch_size in args.batch_sizes:
+            key = f"{name}/b{batch_size}"
+            # A fresh process per benchmark, the peak memory of a process only
+            # ever grows and would carry over from the previous ones.
+            with concurrent.futures.ProcessPoolExecutor(1, mp_context=context) as pool:
+                results[key] = pool.submit(run_bench, name, batch_size, args).result()
+            print(f"{key:10s} {format_result(results[key])}")
+
+    report = {
+        "meta": {
+            "preset": args.preset,
+            "device": device,
+            "dtype": args.dtype,
+            "threads": args.threads,
+            "steps": args.steps,
+            "torch": torch.__version__,
+            "moshi": moshi.__version__,
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+def format_result(result: dict) -> str:
+    parts = [
+        f"{stage} p50 {value['p50_ms']:.2f}ms"
+        for stage, value in result.items()
+        if isinstance(value, dict)
+    ]
+    parts.append(f"RTF {result['rtf']:.2f}")
+    if "frames_per_second" in result:
+        parts.append(f"{result['frames_per_second']:.1f} frames/s")
+    parts.append(f"peak {result['peak_memory_mb']:.0f}MB")
+    return ", ".join(parts)
+
+
+def flatten(result: dict, prefix: str = "") -> dict[str, float]:
+    flat = {}
+    for key, value in result.items():
+        if isinstance(value, dict):
+            flat |= flatten(value, f"{prefix}{key}.")
+        else:
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def compare(args) -> int:
+    """Prints the relative change of every metric between two runs, and flags
+    the ones that got worse by more than `--tolerance`."""
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.candidate) as f:
+        candidate = json.load(f)
+    for key in ("preset", "device", "dtype", "threads"):
+        if baseline["meta"].get(key) != candidate["meta"].get(key):
+            print(
+                f"Warning: {key} differs, {baseline['meta'].get(key)} vs "
+                f"{candidate['meta'].get(key)}."
+            )
+
+    regressions = []
+    for bench in sorted(baseline["results"].keys() & candidate["results"].keys()):
+        before = flatten(baseline["results"][bench])
+        after = flatten(candidate["results"][bench])
+        for metric in sorted(before.keys() & after.keys()):
+            if not before[metric]:
+                continue
+            change = after[metric] / before[metric] - 1
+            # Throughput is better when higher, latencies and memory when lower.
+            higher_is_better = metric in ("rtf", "frames_per_second")
+            worse = -change if higher_is_better else change
+            flag = ""
+            if worse > args.tolerance:
+                flag = "  REGRESSION"
+                regressions.append(f"{bench} {metric}")
+            print(
+                f"{bench:10s} {metric:20s} {before[metric]:10.2f} -> "
+                f"{after[metric]:10.2f} {100 * change:+7.1f}%{flag}"
+            )
+    if regressions:
+        print(f"{len(regressions)} regression(s) above {100 * args.tolerance:.0f}%.")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the streaming step loops.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Run the benchmarks.")
+    run_parser.add_argument("--preset", choices=PRESETS.keys(), default="tiny")
+    run_parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 16])
+    run_parser.add_argument(
+        "--only", nargs="+", choices=["stt", "tts"], default=["stt", "tts"]
+    )
+    run_parser.add_argument("--steps", type=int, default=50, help="Measured steps.")
+    run_parser.add_argument("--warmup", type=int, default=10)
+    run_parser.add_argument("--threads", type=int, default=4)
+    run_parser.add_argument("--device", type=str, default="cpu")
+    run_parser.add_argument(
+        "--dtype", choices=["float32", "bfloat16"], default="float32"
+    )
+    run_parser.add_argument("--output", type=str, help="JSON file for the results.")
+
+    compare_parser = subparsers.add_parser("compare", help="Compare two JSON results.")
+    compare_parser.add_argument("baseline", type=str)
+    compare_parser.add_argument("candidate", type=str)
+    compare_parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="Relative change above which a metric is flagged, defaults to 10%%.",
+    )
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args)
+    else:
+        sys.exit(compare(args))
@@ -0,0 +1,171 @@
+# /// script
+# requires-python = ">=3.12"
+# dependencies = [
+#     "jiwer==3.1.0",
+#     "julius",
+#     "moshi",
+# ]
+# ///
+
+"""Compares the WER and RTF of the int8 CPU path with the unquantized model.
+
+Every clip is transcribed once per variant. If a clip has a `.txt` file next
+to it (`clip.mp3` -> `clip.txt`), its content is the reference for the WER.
+Otherwise only the word difference between the int8 and the baseline
+hypotheses is reported.
+
+    uv run scripts/compare_quantization.py audio/ --hf-repo kyutai/stt-1b-en_fr
+"""
+
+import argparse
+import gc
+import json
+import time
+from pathlib import Path
+
+import jiwer
+import torch
+
+from dsm import Transcriber
+
+AUDIO_SUFFIXES = {".wav", ".mp3", ".flac", ".ogg", ".opus", ".m4a"}
+TRANSFORM = jiwer.Compose(
+    [
+        jiwer.ToLowerCase(),
+        jiwer.RemovePunctuation(),
+        jiwer.RemoveMultipleSpaces(),
+        jiwer.Strip(),
+        jiwer.ReduceToListOfListOfWords(),
+    ]
+)
+
+
+def list_clips(paths: list[str]) -> list[Path]:
+    clips = []
+    for path in map(Path, paths):
+        if path.is_dir():
+            clips += sorted(
+                p for p in path.iterdir() if p.suffix.lower() in AUDIO_SUFFIXES
+            )
+        else:
+            clips.append(path)
+    return clips
+
+
+def word_errors(refs: list[str], hyps: list[str]) -> dict:
+    """Corpus WER, from the summed error and word counts."""
+    output = jiwer.process_words(
+        refs, hyps, reference_transform=TRANSFORM, hypothesis_transform=TRANSFORM
+    )
+    errors = output.substitutions + output.deletions + output.insertions
+    words = output.substitutions + output.deletions + output.hits
+    return {"wer": errors / max(1, words), "errors": errors, "words": words}
+
+
+def run_variant(args, clips: list[Path], quantize: str | None) -> dict:
+    dtype = getattr(torch, args.baseline_dtype)
+    start = time.perf_counter()
+    transcriber = Transcriber.from_hf_repo(
+        args.hf_repo, device="cpu", dtype=dtype, quantize=quantize
+    )
+    load_seconds = time.perf_counter() - start
+
+    audios = [transcriber.load_audio(clip) for clip in clips]
+    # Warm-up, the first steps allocate the streaming state.
+    transcriber.transcribe_tokens(
+        audios[0][:, : transcriber.sample_rate], transcriber.sample_rate
+    )
+
+    hyps, seconds = [], 0.0
+    for clip, audio in zip(clips, audios):
+        start = time.perf_counter()
+        tokens = transcriber.transcribe_tokens(audio, transcriber.sample_rate)
+        seconds += time.perf_counter() - start
+        hyps.append(transcriber.text(tokens))
+        print(f"[{quantize or args.baseline_dtype}] {clip.name}: {hyps[-1]}")
+    audio_seconds = sum(audio.shape[-1] for audio in audios) / transcriber.sample_rate
+
+    del transcriber
+    gc.collect()
+    return {
+        "hyps": hyps,
+        "load_seconds": load_seconds,
+        "audio_seconds": audio_seconds,
+        "rtf": audio_seconds / seconds,
+    }
+
+
+def main(args):
+    torch.set_num_threads(args.threads)
+    clips = list_clips(args.clips)
+    if not clips:
+        raise RuntimeError(f"No audio files in {', '.join(args.clips)}.")
+    refs = {}
+    for clip in clips:
+        if clip.with_suffix(".txt").exists():
+            refs[clip] = clip.with_suffix(".txt").read_text().strip()
+
+    results = {
+        args.baseline_dtype: run_variant(args, clips, None),
+        "int8": run_variant(args, clips, "int8"),
+    }
+    report = {
+        "hf_repo": args.hf_repo,
+        "clips": [str(clip) for clip in clips],
+        "variants": {},
+    }
+    for name, result in results.items():
+        summary = {key: result[key] for key in ("load_seconds", "audio_seconds", "rtf")}
+        if refs:
+            with_ref = [index for index, clip in enumerate(clips) if clip in refs]
+            summary |= word_errors(
+                [refs[clips[index]] for index in with_ref],
+                [result["hyps"][index] for index in with_ref],
+            )
+        report["variants"][name] = summary
+    agreement = word_errors(
+        results[args.baseline_dtype]["hyps"], results["int8"]["hyps"]
+    )
+    report["int8_vs_baseline_wer"] = agreement["wer"]
+
+    print(f"{len(clips)} clips, {len(refs)} with a reference")
+    for name, summary in report["variants"].items():
+        wer = f"WER {100 * summary['wer']:.2f}%" if "wer" in summary else "WER n/a"
+        print(
+            f"{name:10s} {wer}  RTF = {summary['rtf']:.2f}  "
+            f"load {summary['load_seconds']:.1f}s"
+        )
+    print(
+        f"int8 vs {args.baseline_dtype} word difference: {100 * agreement['wer']:.2f}%"
+    )
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare int8 and unquantized STT on CPU."
+    )
+    parser.add_argument(
+        "clips", nargs="+", help="Audio files or directories of audio files."
+    )
+    parser.add_argument(
+        "--hf-repo",
+        type=str,
+        default="kyutai/stt-1b-en_fr",
+        help="HF repo to load the STT model from.",
+    )
+    parser.add_argument(
+        "--baseline-dtype",
+        choices=["float32", "bfloat16"],
+        default="float32",
+        help="Dtype of the unquantized model.",
+    )
+    parser.add_argument("--threads", type=int, default=torch.get_num_threads())
+    parser.add_argument(
+        "--output", type=str, help="Write the results to this JSON file."
+    )
+    args = parser.parse_args()
+
+    main(args)
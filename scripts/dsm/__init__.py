@@ -0,0 +1,52 @@
+"""Python inference library for the delayed streams modeling STT models.
+
+`Transcriber` loads a checkpoint once and can then be used for any number of
+transcriptions in the same process, instead of running a script per file.
+"""
+
+from . import profiling
+from .audio import (
+    AudioCollator,
+    get_padded_batch,
+    get_resampler,
+    load_audio,
+    pad_to_frame,
+    resample,
+    resample_group,
+)
+from .continuous import ContinuousBatcher
+from .prompt import PromptHook
+from .quantize import QUANTIZE_CHOICES, quantize_int8
+from .snapshot import StreamingSnapshot
+from .text import (
+    IncrementalWords,
+    PieceTable,
+    TimestampedText,
+    get_piece_table,
+    tokens_to_timestamped_text,
+    tokens_to_timestamped_text_batch,
+)
+from .transcriber import Transcriber
+
+__all__ = [
+    "QUANTIZE_CHOICES",
+    "AudioCollator",
+    "ContinuousBatcher",
+    "IncrementalWords",
+    "PieceTable",
+    "PromptHook",
+    "StreamingSnapshot",
+    "TimestampedText",
+    "Transcriber",
+    "get_padded_batch",
+    "get_piece_table",
+    "get_resampler",
+    "load_audio",
+    "pad_to_frame",
+    "profiling",
+    "quantize_int8",
+    "resample",
+    "resample_group",
+    "tokens_to_timestamped_text",
+    "tokens_to_timestamped_text_batch",
+]
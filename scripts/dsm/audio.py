@@ -0,0 +1,156 @@
+"""Loading, resampling and batching audio for the streaming models."""
+
+import functools
+
+import julius
+import sphn
+import torch
+
+
+@functools.lru_cache(maxsize=32)
+def get_resampler(old_sr: int, new_sr: int, device: str = "cpu") -> julius.ResampleFrac:
+    """`julius.ResampleFrac` for a rate pair, its sinc kernels are only built
+    on the first call (`julius.resample_frac` rebuilds them every time)."""
+    return julius.ResampleFrac(int(old_sr), int(new_sr)).to(device)
+
+
+def resample(audio: torch.Tensor, old_sr: int, new_sr: int) -> torch.Tensor:
+    """Same as `julius.resample_frac`, with the kernels cached per rate pair."""
+    if int(old_sr) == int(new_sr):
+        return audio
+    return get_resampler(old_sr, new_sr, str(audio.device))(audio)
+
+
+def resample_group(
+    audios: list[tuple[torch.Tensor, int]], new_sr: int
+) -> list[torch.Tensor]:
+    """Resamples `(audio, sample_rate)` clips, with one batched call per source
+    rate instead of one per clip.
+
+    Clips of the same rate are right-padded to the same length by repeating
+    their last sample, which is also how `julius` pads each clip, so the
+    outputs match per-clip calls. Returns the clips in the input order.
+    """
+    outputs: list[torch.Tensor | None] = [None] * len(audios)
+    groups: dict[int, list[int]] = {}
+    for index, (_, sr) in enumerate(audios):
+        groups.setdefault(int(sr), []).append(index)
+    for sr, indices in groups.items():
+        clips = [audios[index][0] for index in indices]
+        if sr == int(new_sr):
+            for index, clip in zip(indices, clips):
+                outputs[index] = clip
+            continue
+        max_len = max(clip.shape[-1] for clip in clips)
+        batch = torch.stack(
+            [
+                torch.nn.functional.pad(
+                    clip.reshape(-1, 1, clip.shape[-1]),
+                    (0, max_len - clip.shape[-1]),
+                    mode="replicate",
+                ).view(-1, max_len)
+                for clip in clips
+            ]
+        )
+        resampled = resample(batch, sr, new_sr)
+        for index, clip, out in zip(indices, clips, resampled):
+            length = int(new_sr * clip.shape[-1] / sr)
+            outputs[index] = out[:, :length].view(*clip.shape[:-1], length)
+    return outputs
+
+
+def pad_to_frame(audio: torch.Tensor, frame_size: int) -> torch.Tensor:
+    """Right-pads the last dimension to a multiple of `frame_size`."""
+    if audio.shape[-1] % frame_size != 0:
+        to_pad = frame_size - audio.shape[-1] % frame_size
+        audio = torch.nn.functional.pad(audio, (0, to_pad))
+    return audio
+
+
+def load_audio(path, sample_rate: int, device="cpu") -> torch.Tensor:
+    """Reads a file as a mono `[1, T]` float tensor at `sample_rate`."""
+    audio, input_sample_rate = sphn.read(str(path))
+    audio = torch.from_numpy(audio).to(device).mean(axis=0, keepdim=True)
+    return resample(audio, input_sample_rate, sample_rate)
+
+
+@torch.no_grad
+def get_padded_batch(
+    audios: list[tuple[torch.Tensor, int]],
+    before_padding: float,
+    after_padding: float,
+    audio_encoder,
+):
+    sample_rate = audio_encoder.sample_rate
+
+    max_len = 0
+    batch = []
+    resampled = resample_group(audios, int(sample_rate))
+    for audio in resampled:
+        audio = torch.nn.functional.pad(
+            audio, (int(before_padding * sample_rate), int(after_padding * sample_rate))
+        )
+        max_len = max(max_len, audio.shape[-1])
+        batch.append(audio)
+
+    target = max_len
+    if target % audio_encoder.frame_size != 0:
+        target = target + (
+            audio_encoder.frame_size - max_len % audio_encoder.frame_size
+        )
+    padded_batch = torch.stack(
+        [
+            torch.nn.functional.pad(audio, (0, target - audio.shape[-1]))
+            for audio in batch
+        ]
+    )
+    return padded_batch
+
+
+class AudioCollator:
+    """Turns dataset samples into model-ready audio, meant to run in the
+    worker processes of a `torch.utils.data.DataLoader`.
+
+    Each sample must have an `audio` dict with `array` and `sampling_rate` (as
+    in Hugging Face datasets). The audio is made mono and resampled to
+    `sample_rate`. With `pad=True`, the batch is padded with silence like
+    `get_padded_batch` into a `[B, 1, samples]` tensor, otherwise `audio` is
+    a list of `[1, T]` tensors. The other columns are passed through as lists.
+    Only the sample rate and frame size of the model are needed, not the model.
+    """
+
+    def __init__(
+        self,
+        sample_rate: int,
+        frame_size: int,
+        before_padding: float = 0.0,
+        after_padding: float = 0.0,
+        pad: bool = True,
+    ):
+        self.sample_rate = sample_rate
+        self.frame_size = frame_size
+        self.before_padding = before_padding
+        self.after_padding = after_padding
+        self.pad = pad
+
+    def __call__(self, samples: list[dict]) -> dict:
+        audios = []
+        for sample in samples:
+            audio = torch.as_tensor(sample["audio"]["array"]).float()
+            audio = audio.view(-1, audio.shape[-1]).mean(dim=0)
+            audios.append((audio, sample["audio"]["sampling_rate"]))
+        batch = {
+            key: [sample[key] for sample in samples]
+            for key in samples[0]
+            if key != "audio"
+        }
+        batch["durations"] = [audio.shape[-1] / sr for audio, sr in audios]
+        if self.pad:
+            batch["audio"] = get_padded_batch(
+                audios, self.before_padding, self.after_padding, audio_encoder=self
+            )[:, None, :]
+        else:
+            batch["audio"] = [
+                audio[None] for audio in resample_group(audios, self.sample_rate)
+            ]
+        return batch
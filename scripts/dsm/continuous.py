@@ -0,0 +1,158 @@
+"""Continuous batching of many utterances over a fixed number of slots."""
+
+import time
+from collections.abc import Iterable, Iterator
+
+import torch
+
+from . import profiling
+from .audio import resample
+from .transcriber import Transcriber
+
+
+class _Slot:
+    def __init__(self, key, frames: Iterator[torch.Tensor], tokens: list[int]):
+        self.key = key
+        self.frames = frames
+        self.tokens = tokens
+
+
+class ContinuousBatcher:
+    """Transcribes a queue of utterances with one batched streaming session.
+
+    With `Transcriber.batch_tokens`, a batch runs until its longest item is
+    done and the slots of the shorter ones step over silence. Here, once an
+    utterance has gone through its silence suffix (so that all its delayed
+    text tokens are out), its slot is reset with a `reset_mask` and the next
+    utterance starts there while the other slots keep going. With
+    `transcriber.cache_prefix`, the slot is restored from the silence snapshot
+    instead, which skips the silence prefix.
+
+    The transcriber must be built with `support_out_of_sync=True`: the tokens
+    of a slot are `ungenerated_token_id` until the LM delay is filled again
+    after a reset, those are dropped.
+
+    Args:
+        batch_size: number of slots.
+        flush_every: text tokens are moved to the CPU every that many steps
+            (or when a slot is done), to avoid a device sync per step.
+    """
+
+    def __init__(
+        self, transcriber: Transcriber, batch_size: int, flush_every: int = 25
+    ):
+        self.transcriber = transcriber
+        self.batch_size = batch_size
+        self.flush_every = flush_every
+        self.steps = 0
+        self.active_slot_steps = 0
+        self.model_seconds = 0.0
+
+    @property
+    def slot_efficiency(self) -> float:
+        """Fraction of the slot steps that processed an utterance."""
+        return self.active_slot_steps / max(1, self.steps * self.batch_size)
+
+    def _flush(self, buffered: list) -> None:
+        if not buffered:
+            return
+        ungenerated = self.transcriber.lm_gen.lm_model.ungenerated_token_id
+        # Waits for the device, so this counts as model time.
+        start = time.perf_counter()
+        with profiling.span("to_host"):
+            all_tokens = torch.stack([tokens for tokens, _ in buffered]).cpu().tolist()
+        self.model_seconds += time.perf_counter() - start
+        for step_tokens, (_, slots) in zip(all_tokens, buffered):
+            for index, slot in enumerate(slots):
+                if slot is not None and step_tokens[index] != ungenerated:
+                    slot.tokens.append(step_tokens[index])
+        buffered.clear()
+
+    @torch.no_grad()
+    def run(
+        self, utterances: Iterable[tuple[object, torch.Tensor, int]]
+    ) -> Iterator[tuple[object, torch.Tensor]]:
+        """Takes `(key, audio, sample_rate)` utterances with `[C, T]` audio,
+        yields `(key, text_tokens)` as each one is done, in completion order."""
+        transcriber = self.transcriber
+        mimi, lm_gen = transcriber.mimi, transcriber.lm_gen
+        device, batch_size = transcriber.device, self.batch_size
+        utterances = iter(utterances)
+        # Taken before the batched session starts, the models can only be in one.
+        snapshot = transcriber.silence_snapshot() if transcriber.cache_prefix else None
+        n_prefix = 0 if snapshot is not None else None
+        prefix_tokens = []
+        if snapshot is not None:
+            ungenerated = lm_gen.lm_model.ungenerated_token_id
+            prefix_tokens = [
+                t for t in snapshot.tokens.view(-1).tolist() if t != ungenerated
+            ]
+        slots: list[_Slot | None] = [None] * batch_size
+        buffered = []
+        exhausted = False
+
+        def _next_slot() -> _Slot | None:
+            nonlocal exhausted
+            if exhausted:
+                return None
+            try:
+                key, audio, sample_rate = next(utterances)
+            except StopIteration:
+                exhausted = True
+                return None
+            with profiling.span("resample"):
+                audio = audio.float().to(device).view(-1, audio.shape[-1])
+                audio = resample(
+                    audio.mean(dim=0, keepdim=True), sample_rate, mimi.sample_rate
+                )
+            frames = transcriber.frames([audio], n_prefix=n_prefix)
+            return _Slot(key, frames, list(prefix_tokens))
+
+        with mimi.streaming(batch_size), lm_gen.streaming(batch_size):
+            while True:
+                batch = torch.zeros((batch_size, 1, mimi.frame_size), device=device)
+                exec_mask = torch.zeros(batch_size, dtype=torch.bool)
+                reset_mask = torch.zeros(batch_size, dtype=torch.bool)
+                for index in range(batch_size):
+                    while True:
+                        if slots[index] is None:
+                            slots[index] = _next_slot()
+                            if slots[index] is None:
+                                break
+                            reset_mask[index] = True
+                        frame = next(slots[index].frames, None)
+                        if frame is not None:
+                            break
+                        # Suffix done, all the tokens of this utterance are out.
+                        self._flush(buffered)
+                        done = slots[index]
+                        slots[index] = None
+                        yield done.key, torch.tensor(done.tokens, dtype=torch.long)
+                    if slots[index] is not None:
+                        batch[index] = frame.view(1, -1)
+                        exec_mask[index] = True
+
+                if not exec_mask.any():
+                    break
+
+                start = time.perf_counter()
+                if reset_mask.any() and snapshot is not None:
+                    transcriber.restore(
+                        snapshot, slots=reset_mask.nonzero()[:, 0].tolist()
+                    )
+                elif reset_mask.any():
+                    mimi.reset_streaming(reset_mask.to(device))
+                    lm_gen.reset_streaming(reset_mask.to(device))
+                mimi.set_exec_mask(exec_mask.to(device))
+                lm_gen.set_exec_mask(exec_mask.to(device))
+                with profiling.span("mimi.encode"):
+                    audio_tokens = mimi.encode(batch)
+                with profiling.span("lm_gen.step"):
+                    text_tokens = lm_gen.step(audio_tokens)
+                self.model_seconds += time.perf_counter() - start
+
+                self.steps += 1
+                self.active_slot_steps += int(exec_mask.sum())
+                buffered.append((text_tokens[:, 0, 0], list(slots)))
+                if len(buffered) >= self.flush_every:
+                    self._flush(buffered)
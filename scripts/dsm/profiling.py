@@ -0,0 +1,198 @@
+"""Named spans around the stages of the inference loops.
+
+Profiling is off by default and then `span` costs a function call. It is
+turned on with `enable()` (the `--profile` flag of the scripts) or by setting
+`DSM_PROFILE=1` in the environment. `DSM_PROFILE_TRACE=path.json` also turns
+it on and writes a Chrome trace when the process exits, which can be opened in
+https://ui.perfetto.dev or chrome://tracing.
+
+    from dsm import profiling
+
+    with profiling.span("mimi.encode"):
+        audio_tokens = mimi.encode(frame)
+
+    profiling.print_summary()
+
+Spans measure host time. On CUDA, kernels run asynchronously and the time
+shows up in whichever span waits for the device first, `enable(sync=True)`
+(or `DSM_PROFILE_SYNC=1`) synchronizes at the end of every span instead, at
+the cost of stalling the pipeline.
+"""
+
+import atexit
+import contextlib
+import json
+import os
+import threading
+import time
+from collections import deque
+
+
+class _Stats:
+    def __init__(self, max_samples: int):
+        self.count = 0
+        self.total_ns = 0
+        # Recent durations only, for the percentiles of long-running servers.
+        self.samples: deque[int] = deque(maxlen=max_samples)
+
+    def add(self, duration_ns: int) -> None:
+        self.count += 1
+        self.total_ns += duration_ns
+        self.samples.append(duration_ns)
+
+
+class Profiler:
+    """Collects spans from any thread.
+
+    Args:
+        max_samples: durations kept per span name to compute percentiles.
+        max_events: spans kept for the trace, later ones are only aggregated.
+    """
+
+    def __init__(self, max_samples: int = 100_000, max_events: int = 1_000_000):
+        self.enabled = False
+        self.sync = None
+        self.max_samples = max_samples
+        self.max_events = max_events
+        self._lock = threading.Lock()
+        self._stats: dict[str, _Stats] = {}
+        self._events: list[tuple[str, int, int, int]] = []
+        self.dropped_events = 0
+        self._origin_ns = time.perf_counter_ns()
+
+    def enable(self, sync: bool = False) -> None:
+        self.enabled = True
+        if sync:
+            import torch
+
+            if torch.cuda.is_available():
+                self.sync = torch.cuda.synchronize
+
+    def disable(self) -> None:
+        self.enabled = False
+        self.sync = None
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats.clear()
+            self._events.clear()
+            self.dropped_events = 0
+
+    @contextlib.contextmanager
+    def _span(self, name: str):
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            if self.sync is not None:
+                self.sync()
+            self.record(name, start, time.perf_counter_ns())
+
+    def span(self, name: str):
+        """Context manager timing its block under `name`."""
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return self._span(name)
+
+    def record(self, name: str, start_ns: int, end_ns: int) -> None:
+        """Adds a span measured elsewhere, from `time.perf_counter_ns` values."""
+        if not self.enabled:
+            return
+        with self._lock:
+            stats = self._stats.get(name)
+            if stats is None:
+                stats = self._stats[name] = _Stats(self.max_samples)
+            stats.add(end_ns - start_ns)
+            if len(self._events) < self.max_events:
+                self._events.append((name, threading.get_ident(), start_ns, end_ns))
+            else:
+                self.dropped_events += 1
+
+    def summary(self) -> dict[str, dict]:
+        """Count, total and p50/p95/p99 in milliseconds of every span name."""
+        with self._lock:
+            result = {}
+            for name, stats in self._stats.items():
+                samples = sorted(stats.samples)
+
+                def _percentile(q: float) -> float:
+                    return samples[min(len(samples) - 1, int(q * len(samples)))] / 1e6
+
+                result[name] = {
+                    "count": stats.count,
+                    "total_ms": stats.total_ns / 1e6,
+                    "mean_ms": stats.total_ns / stats.count / 1e6,
+                    "p50_ms": _percentile(0.5),
+                    "p95_ms": _percentile(0.95),
+                    "p99_ms": _percentile(0.99),
+                }
+            return result
+
+    def format_summary(self) -> str:
+        lines = [
+            f"{'span':24s} {'count':>8s} {'total ms':>10s} {'p50 ms':>8s} "
+            f"{'p95 ms':>8s} {'p99 ms':>8s}"
+        ]
+        summary = self.summary()
+        for name, stats in sorted(
+            summary.items(), key=lambda item: -item[1]["total_ms"]
+        ):
+            lines.append(
+                f"{name:24s} {stats['count']:8d} {stats['total_ms']:10.1f} "
+                f"{stats['p50_ms']:8.3f} {stats['p95_ms']:8.3f} {stats['p99_ms']:8.3f}"
+            )
+        return "\n".join(lines)
+
+    def export_chrome_trace(self, path) -> None:
+        """Writes the spans in the Chrome trace event format, one track per thread."""
+        pid = os.getpid()
+        with self._lock:
+            events = list(self._events)
+        trace = [
+            {
+                "name": name,
+                "ph": "X",
+                "ts": (start - self._origin_ns) / 1e3,
+                "dur": (end - start) / 1e3,
+                "pid": pid,
+                "tid": tid,
+            }
+            for name, tid, start, end in events
+        ]
+        for thread in threading.enumerate():
+            trace.append(
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": pid,
+                    "tid": thread.ident,
+                    "args": {"name": thread.name},
+                }
+            )
+        with open(path, "w") as f:
+            json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, f)
+
+
+PROFILER = Profiler()
+
+enable = PROFILER.enable
+span = PROFILER.span
+record = PROFILER.record
+summary = PROFILER.summary
+export_chrome_trace = PROFILER.export_chrome_trace
+
+
+def print_summary() -> None:
+    if PROFILER.enabled:
+        print(PROFILER.format_summary())
+
+
+def _from_env() -> None:
+    trace_path = os.environ.get("DSM_PROFILE_TRACE")
+    if os.environ.get("DSM_PROFILE", "0") not in ("", "0") or trace_path:
+        enable(sync=os.environ.get("DSM_PROFILE_SYNC", "0") not in ("", "0"))
+    if trace_path:
+        atexit.register(export_chrome_trace, trace_path)
+
+
+_from_env()
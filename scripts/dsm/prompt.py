@@ -0,0 +1,41 @@
+"""Constraining the text stream to start with a given prompt."""
+
+from collections import deque
+
+import torch
+
+
+class PromptHook:
+    def __init__(self, tokenizer, prefix, padding_tokens=(0, 3)):
+        self.tokenizer = tokenizer
+        self.prefix = list(self.tokenizer.encode(prefix))
+        self.prefix_enforce = deque(self.prefix)
+        self.padding_tokens = padding_tokens
+
+    def reset(self):
+        """Enforces the whole prefix again, for a new streaming session."""
+        self.prefix_enforce = deque(self.prefix)
+
+    def on_token(self, token):
+        if not self.prefix_enforce:
+            return
+
+        token = token.item()
+
+        if token in self.padding_tokens:
+            pass
+        elif token == self.prefix_enforce[0]:
+            self.prefix_enforce.popleft()
+        else:
+            assert False
+
+    def on_logits(self, logits):
+        if not self.prefix_enforce:
+            return
+
+        mask = torch.zeros_like(logits, dtype=torch.bool)
+        for t in self.padding_tokens:
+            mask[..., t] = True
+        mask[..., self.prefix_enforce[0]] = True
+
+        logits[:] = torch.where(mask, logits, float("-inf"))
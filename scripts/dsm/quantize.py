@@ -0,0 +1,38 @@
+"""Int8 dynamic quantization of the LM for CPU inference.
+
+The PyTorch counterpart of the `nn.quantize` calls of the MLX scripts: the
+weights of the linear layers are stored in int8 and the activations are
+quantized on the fly, which runs much faster than bfloat16 on most x86 CPUs.
+Mimi is left in float32, it is small next to the LM.
+"""
+
+import torch
+
+QUANTIZE_CHOICES = ["int8"]
+
+
+def quantizable_linears(model: torch.nn.Module) -> set[str]:
+    """Names of the `nn.Linear` modules that can be swapped for quantized ones.
+
+    The attention input projections are left out: moshi reads their
+    `weight` to set up the streaming KV cache, which a quantized linear does
+    not have.
+    """
+    return {
+        name
+        for name, module in model.named_modules()
+        if isinstance(module, torch.nn.Linear) and ".in_projs." not in name
+    }
+
+
+def quantize_int8(model: torch.nn.Module) -> torch.nn.Module:
+    """Quantizes the linear layers of a float32 CPU model in place."""
+    parameter = next(model.parameters())
+    if parameter.device.type != "cpu" or parameter.dtype != torch.float32:
+        raise ValueError(
+            "Int8 quantization needs a float32 model on the CPU, "
+            f"got {parameter.dtype} on {parameter.device}."
+        )
+    return torch.ao.quantization.quantize_dynamic(
+        model, quantizable_linears(model), dtype=torch.qint8, inplace=True
+    )
@@ -0,0 +1,180 @@
+"""Snapshots of the streaming state of Mimi and the LM.
+
+Every transcription starts by stepping the models over the same frames: the
+silence prefix, and with `stt_from_file_with_prompt_pytorch.py` an audio and
+text prompt. A `StreamingSnapshot` is taken once at the end of such a prefix
+(conv buffers, KV caches, LM delay cache and offsets, progress of the
+`PromptHook`) and copied into later sessions, which then go on from there.
+
+    snapshot = transcriber.prefix_snapshot()
+    for audio in audios:
+        tokens = list(transcriber.stream(transcriber.frames([audio], n_prefix=0), snapshot))
+
+A snapshot taken with a batch size of 1 can also be restored into some slots
+of a larger session, e.g. when a slot of a continuous batch is (re)started.
+"""
+
+import dataclasses
+from collections import deque
+
+import torch
+
+# Set by the caller at every step, or specific to a session.
+_SKIPPED_FIELDS = {"batch_size", "device", "exec_mask"}
+# Tensors whose batch dimension is not the first one.
+_BATCH_DIMS = {("RingKVCache", "cache"): 1}
+
+
+def _is_nested(value) -> bool:
+    # Objects holding a part of the state, e.g. the `RingKVCache` of the
+    # attention, as opposed to the CUDA graphs and callbacks also stored there.
+    return (
+        type(value).__module__.startswith("moshi.")
+        and hasattr(value, "__dict__")
+        and not callable(value)
+    )
+
+
+def _capture(obj) -> dict:
+    fields = {}
+    for name, value in vars(obj).items():
+        if name in _SKIPPED_FIELDS or name.startswith("_"):
+            continue
+        if isinstance(value, torch.Tensor):
+            fields[name] = value.detach().clone()
+        elif isinstance(value, (bool, int, float)):
+            fields[name] = value
+        elif _is_nested(value):
+            fields[name] = _capture(value)
+    return fields
+
+
+def _restore(
+    obj, fields: dict, batch_size: int, rows: tuple | None, shared: bool
+) -> None:
+    """Copies `fields` into the live state `obj`, in place so that the CUDA
+    graphs keep pointing at the same memory.
+
+    `rows` is None to copy the batch items as they are, or `(live_rows,
+    snapshot_rows)` index tensors to copy only some of them. The scalars and
+    the tensors shared by all the batch items (e.g. the write position of a KV
+    cache that ignores the exec mask) are only restored if `shared` is True.
+    """
+    for name, value in fields.items():
+        current = getattr(obj, name)
+        if isinstance(value, dict):
+            _restore(current, value, batch_size, rows, shared)
+        elif not isinstance(value, torch.Tensor):
+            if shared:
+                setattr(obj, name, value)
+        else:
+            dim = _BATCH_DIMS.get((type(obj).__name__, name), 0)
+            per_item = current.dim() > dim and current.shape[dim] == batch_size
+            if per_item and rows is not None:
+                live_rows, snapshot_rows = rows
+                source = value.index_select(dim, snapshot_rows.to(value.device))
+                current.index_copy_(dim, live_rows.to(current.device), source)
+            elif per_item or shared:
+                if current.shape != value.shape:
+                    raise ValueError(
+                        f"Cannot restore {name} of shape {tuple(value.shape)} "
+                        f"into {tuple(current.shape)}."
+                    )
+                current.copy_(value)
+
+
+def _streaming_states(modules: dict) -> dict:
+    return {
+        (key, name): state
+        for key, module in modules.items()
+        for name, state in module.get_streaming_state().items()
+    }
+
+
+def _modules(mimi, lm_gen) -> dict:
+    # `LMGen` runs the LM in its own detached streaming context.
+    return {"mimi": mimi, "lm_gen": lm_gen, "lm": lm_gen.lm_model}
+
+
+@dataclasses.dataclass
+class StreamingSnapshot:
+    """The streaming state of Mimi and `LMGen` after `frames` frames.
+
+    Attributes:
+        states: captured fields of every streaming state, with the batch size
+            of that state.
+        tokens: `[1, 1, T]` text tokens produced over the prefix, on the
+            device of the model.
+        frames: number of frames stepped to reach this state.
+        prompt_tokens: tokens the `PromptHook` still had to enforce.
+    """
+
+    states: dict[tuple[str, str], tuple[int, dict]]
+    tokens: torch.Tensor
+    frames: int
+    prompt_tokens: list[int] | None = None
+
+    @property
+    def batch_size(self) -> int:
+        return self.states[("lm_gen", "")][0]
+
+    @classmethod
+    def capture(
+        cls, mimi, lm_gen, tokens: torch.Tensor, frames: int, prompt_hook=None
+    ) -> "StreamingSnapshot":
+        """Copies the state of the running streaming session of `mimi` and `lm_gen`."""
+        states = {
+            key: (state.batch_size, _capture(state))
+            for key, state in _streaming_states(_modules(mimi, lm_gen)).items()
+        }
+        prompt_tokens = None
+        if prompt_hook is not None:
+            prompt_tokens = list(prompt_hook.prefix_enforce)
+        return cls(states, tokens, frames, prompt_tokens)
+
+    def restore(self, mimi, lm_gen, slots=None, prompt_hook=None) -> None:
+        """Copies the snapshot into the running session of `mimi` and `lm_gen`.
+
+        With `slots=None` the whole session is restored: it must have the
+        batch size of the snapshot, or the snapshot must have a batch size of 1
+        and is then copied into every batch item. Otherwise only the batch
+        items in `slots` are restored, from a snapshot with a batch size of 1,
+        the others keep going (this needs `support_out_of_sync=True`, as for
+        `reset_streaming` with a mask).
+        """
+        live_states = _streaming_states(_modules(mimi, lm_gen))
+        if live_states.keys() != self.states.keys():
+            raise ValueError("The snapshot was taken with different models.")
+        live_batch_size = live_states[("lm_gen", "")].batch_size
+        if slots is not None and self.batch_size != 1:
+            raise ValueError(
+                "Only a snapshot of batch size 1 can be restored into slots."
+            )
+        if slots is None and self.batch_size not in (1, live_batch_size):
+            raise ValueError(
+                f"Cannot restore a snapshot of batch size {self.batch_size} "
+                f"into a session of batch size {live_batch_size}."
+            )
+        restore_all = slots is None
+        if restore_all and self.batch_size != live_batch_size:
+            slots = range(live_batch_size)
+
+        for key, (batch_size, fields) in self.states.items():
+            state = live_states[key]
+            rows = None
+            if slots is not None:
+                # With CFG, the LM runs the conditioned and unconditioned items
+                # of slot `s` as rows `s` and `s + B` of a `2 * B` batch.
+                repeats = batch_size
+                n_slots = state.batch_size // repeats
+                live_rows = [
+                    slot + r * n_slots for r in range(repeats) for slot in slots
+                ]
+                snapshot_rows = [r for r in range(repeats) for _ in slots]
+                rows = (torch.tensor(live_rows), torch.tensor(snapshot_rows))
+            # The scalars are shared by the batch items, so they can only be
+            # restored when all the items start from the snapshot.
+            _restore(state, fields, state.batch_size, rows, shared=restore_all)
+
+        if prompt_hook is not None and self.prompt_tokens is not None:
+            prompt_hook.prefix_enforce = deque(self.prompt_tokens)
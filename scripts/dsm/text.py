@@ -0,0 +1,307 @@
+"""Text tokens to words with timestamps."""
+
+import dataclasses
+from collections.abc import Iterable
+
+import numpy as np
+import torch
+
+
+@dataclasses.dataclass
+class TimestampedText:
+    text: str
+    timestamp: tuple[float, float]
+
+    def __str__(self):
+        return f"{self.text} ({self.timestamp[0]:.2f}:{self.timestamp[1]:.2f})"
+
+
+class PieceTable:
+    """Id -> piece lookup of a SentencePiece tokenizer.
+
+    Turns token ids into text with array indexing instead of a `decode` call
+    per word, and tells where words start (pieces beginning with `▁`) without
+    re-encoding them. Byte-fallback, control and unknown pieces are flagged,
+    segments containing them go through `tokenizer.decode`.
+    """
+
+    def __init__(self, tokenizer):
+        size = tokenizer.get_piece_size()
+        pieces = [tokenizer.id_to_piece(i) for i in range(size)]
+        self.size = size
+        self.text = np.array([p.replace("\u2581", " ") for p in pieces], dtype=object)
+        # A bare `▁` too, SentencePiece emits it before pieces it has not
+        # merged with `▁`, e.g. digits: " 2024 x" is "▁2 0 2 4 ▁ x".
+        self.starts_word = np.array([p.startswith("\u2581") for p in pieces])
+        self.needs_decode = np.array(
+            [
+                tokenizer.is_byte(i)
+                or tokenizer.is_control(i)
+                or tokenizer.is_unknown(i)
+                for i in range(size)
+            ]
+        )
+
+
+_PIECE_TABLES: dict[int, PieceTable] = {}
+
+
+def get_piece_table(tokenizer) -> PieceTable:
+    table = _PIECE_TABLES.get(id(tokenizer))
+    if table is None:
+        table = _PIECE_TABLES[id(tokenizer)] = PieceTable(tokenizer)
+    return table
+
+
+def _decode_segment(tokens, start, end, tokenizer, tstmp) -> list[TimestampedText]:
+    """Reference decoding of one segment, through the tokenizer.
+
+    Several words without a boundary in between get as many frames as they
+    have tokens each, the last one takes the rest. Also used by
+    `IncrementalWords`, so that streaming and batch decoding agree.
+    """
+    text = tokenizer.decode([int(t) for t in tokens])
+    words_inside_segment = text.split()
+    if len(words_inside_segment) == 0:
+        return []
+    if len(words_inside_segment) == 1:
+        return [TimestampedText(text=text, timestamp=tstmp(start, end))]
+    words = []
+    current_start = start
+    for adjacent_word in words_inside_segment[:-1]:
+        n_tokens = len(tokenizer.encode(adjacent_word))
+        words.append(
+            TimestampedText(
+                text=adjacent_word,
+                timestamp=tstmp(current_start, current_start + n_tokens),
+            )
+        )
+        current_start += n_tokens
+    words.append(
+        TimestampedText(
+            text=words_inside_segment[-1], timestamp=tstmp(current_start, end)
+        )
+    )
+    return words
+
+
+def tokens_to_timestamped_text_batch(
+    text_tokens,
+    tokenizer,
+    frame_rate,
+    end_of_padding_id,
+    padding_token_id,
+    offset_seconds,
+    piece_table: PieceTable | None = None,
+) -> list[list[TimestampedText]]:
+    """Timestamped words of every stream of a `[B, T]` (or `[B, 1, T]`) batch.
+
+    Normally `end_of_padding` tokens indicate word boundaries. Everything
+    between them should be a single word; the time offset of the those tokens
+    correspond to word start and end timestamps (minus silence prefix and
+    audio delay).
+
+    However, in rare cases some complexities could arise. Firstly, for words
+    that are said quickly but are represented with multiple tokens, the
+    boundary might be omitted: each word is then assigned as many frames as
+    it has tokens, the last one taking everything until the boundary.
+    Secondly, for the very last word the end boundary might not happen: it
+    ends at `eos`, or at most one second after its start.
+
+    All the boundaries and word spans are computed at once with array
+    operations, only building the final strings is done per word.
+    """
+    if isinstance(text_tokens, torch.Tensor):
+        text_tokens = text_tokens.cpu().numpy()
+    tokens = np.asarray(text_tokens)
+    tokens = tokens.reshape(tokens.shape[0], -1)
+    batch_size, length = tokens.shape
+    table = piece_table or get_piece_table(tokenizer)
+    results: list[list[TimestampedText]] = [[] for _ in range(batch_size)]
+
+    def _tstmp(start_position, end_position):
+        return (
+            max(0, start_position / frame_rate - offset_seconds),
+            max(0, end_position / frame_rate - offset_seconds),
+        )
+
+    # Segments start after each boundary, and end at the next boundary of the
+    # same stream, the last one at eos or one second later.
+    is_boundary = tokens == end_of_padding_id
+    rows, cols = np.nonzero(is_boundary)
+    if rows.size == 0:
+        return results
+    seg_starts = cols + 1
+    has_next = np.append(rows[1:] == rows[:-1], False)
+    positions = np.arange(length)
+    eos_positions = np.where(tokens == tokenizer.eos_id(), positions, length)
+    next_eos = np.minimum.accumulate(eos_positions[:, ::-1], axis=1)[:, ::-1]
+    next_eos = np.concatenate([next_eos, np.full((batch_size, 1), length)], axis=1)
+    eos_end = next_eos[rows, seg_starts]
+    one_second_end = np.minimum(length, np.floor(seg_starts + frame_rate)).astype(int)
+    last_end = np.where(eos_end < length, eos_end, one_second_end)
+    seg_ends = np.where(has_next, np.append(cols[1:], 0), last_end)
+
+    # Segment of every position, -1 before the first boundary of a stream.
+    first_segment = np.searchsorted(rows, np.arange(batch_size))
+    local_segment = np.cumsum(is_boundary, axis=1) - 1
+    segment = np.where(local_segment >= 0, first_segment[:, None] + local_segment, -1)
+    in_segment = (segment >= 0) & ~is_boundary
+    in_segment &= positions[None] < seg_ends[np.maximum(segment, 0)]
+    keep = in_segment & (tokens > padding_token_id)
+    kept_rows, kept_cols = np.nonzero(keep)
+    kept_segment = segment[kept_rows, kept_cols]
+    kept_tokens = tokens[kept_rows, kept_cols]
+    if kept_tokens.size == 0:
+        return results
+
+    in_table = kept_tokens < table.size
+    lookup = np.where(in_table, kept_tokens, 0)
+    needs_decode = ~in_table | table.needs_decode[lookup]
+    slow_segments = np.unique(kept_segment[needs_decode])
+
+    # Words start at the first token of a segment and at each `▁` piece.
+    new_segment = np.append(True, kept_segment[1:] != kept_segment[:-1])
+    new_word = new_segment | table.starts_word[lookup]
+    word_first_token = np.nonzero(new_word)[0]
+    word_segment = kept_segment[word_first_token]
+    word_n_tokens = np.diff(np.append(word_first_token, len(kept_tokens)))
+    # Each word starts after the tokens of the previous words of its segment.
+    tokens_before = np.cumsum(word_n_tokens) - word_n_tokens
+    segment_first_word = np.append(True, word_segment[1:] != word_segment[:-1])
+    tokens_before -= np.maximum.accumulate(
+        np.where(segment_first_word, tokens_before, 0)
+    )
+    word_starts = seg_starts[word_segment] + tokens_before
+    word_texts = [
+        "".join(pieces).strip()
+        for pieces in np.split(table.text[lookup], word_first_token[1:])
+    ]
+    # A bare `▁` at the end of a segment is an empty word, which is dropped:
+    # the last word with some text takes everything until the boundary.
+    non_empty = np.nonzero([bool(text) for text in word_texts])[0]
+    non_empty_segment = word_segment[non_empty]
+    is_last_word = np.zeros(len(word_texts), dtype=bool)
+    if non_empty.size:
+        is_last_word[non_empty] = np.append(
+            non_empty_segment[1:] != non_empty_segment[:-1], True
+        )
+    word_ends = np.where(
+        is_last_word, seg_ends[word_segment], word_starts + word_n_tokens
+    )
+
+    words_by_segment: dict[int, list[TimestampedText]] = {}
+    for word_index in non_empty.tolist():
+        timestamp = _tstmp(int(word_starts[word_index]), int(word_ends[word_index]))
+        words_by_segment.setdefault(int(word_segment[word_index]), []).append(
+            TimestampedText(text=word_texts[word_index], timestamp=timestamp)
+        )
+
+    # Segments with pieces that are not in the table (e.g. byte fallback) are
+    # rare, they are decoded through the tokenizer instead.
+    slow = set(slow_segments.tolist())
+    for segment_index, row in enumerate(rows.tolist()):
+        if segment_index in slow:
+            words = _decode_segment(
+                kept_tokens[kept_segment == segment_index],
+                int(seg_starts[segment_index]),
+                int(seg_ends[segment_index]),
+                tokenizer,
+                _tstmp,
+            )
+        else:
+            words = words_by_segment.get(segment_index, [])
+        results[row].extend(words)
+
+    return results
+
+
+def tokens_to_timestamped_text(
+    text_tokens,
+    tokenizer,
+    frame_rate,
+    end_of_padding_id,
+    padding_token_id,
+    offset_seconds,
+) -> list[TimestampedText]:
+    """Timestamped words of a single stream, see `tokens_to_timestamped_text_batch`."""
+    if isinstance(text_tokens, torch.Tensor):
+        text_tokens = text_tokens.cpu()
+    return tokens_to_timestamped_text_batch(
+        np.asarray(text_tokens).reshape(1, -1),
+        tokenizer,
+        frame_rate,
+        end_of_padding_id=end_of_padding_id,
+        padding_token_id=padding_token_id,
+        offset_seconds=offset_seconds,
+    )[0]
+
+
+class IncrementalWords:
+    """Turns text tokens into timestamped words as they are produced.
+
+    This follows `tokens_to_timestamped_text`, but only the tokens since the
+    last `end_of_padding` boundary are kept, so memory stays constant however
+    long the stream is.
+    """
+
+    def __init__(
+        self,
+        tokenizer,
+        frame_rate,
+        padding_token_id,
+        offset_seconds,
+        end_of_padding_id=0,
+    ):
+        self.tokenizer = tokenizer
+        self.frame_rate = frame_rate
+        self.padding_token_id = padding_token_id
+        self.offset_seconds = offset_seconds
+        self.end_of_padding_id = end_of_padding_id
+        self.position = 0
+        # Position of the first token after the last boundary, and the tokens since.
+        self.segment_start: int | None = None
+        self.segment_tokens: list[int] = []
+
+    def _tstmp(self, start_position, end_position):
+        return (
+            max(0, start_position / self.frame_rate - self.offset_seconds),
+            max(0, end_position / self.frame_rate - self.offset_seconds),
+        )
+
+    def _segment_words(self, start, tokens) -> list[TimestampedText]:
+        kept = [t for t in tokens if t > self.padding_token_id]
+        return _decode_segment(
+            kept, start, start + len(tokens), self.tokenizer, self._tstmp
+        )
+
+    def push(self, tokens: Iterable[int]) -> list[TimestampedText]:
+        """Consumes new tokens, returns the words whose end boundary was reached."""
+        words = []
+        for token in tokens:
+            if token == self.end_of_padding_id:
+                if self.segment_start is not None:
+                    words += self._segment_words(
+                        self.segment_start, self.segment_tokens
+                    )
+                self.segment_start = self.position + 1
+                self.segment_tokens = []
+            elif self.segment_start is not None:
+                self.segment_tokens.append(token)
+            self.position += 1
+        return words
+
+    def finish(self) -> list[TimestampedText]:
+        """Flushes the last word, which ends at `eos` or at most one second later."""
+        if self.segment_start is None:
+            return []
+        tokens = self.segment_tokens
+        eos_id = self.tokenizer.eos_id()
+        if eos_id in tokens:
+            tokens = tokens[: tokens.index(eos_id)]
+        else:
+            tokens = tokens[: int(self.frame_rate)]
+        words = self._segment_words(self.segment_start, tokens)
+        self.segment_start = None
+        self.segment_tokens = []
+        return words
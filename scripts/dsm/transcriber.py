@@ -0,0 +1,355 @@
+"""Load-once handle on a Kyutai STT checkpoint."""
+
+import itertools
+import math
+from collections.abc import Iterable, Iterator
+
+import moshi.models
+import torch
+
+from . import profiling
+from .audio import AudioCollator, load_audio, pad_to_frame, resample
+from .prompt import PromptHook
+from .quantize import quantize_int8
+from .snapshot import StreamingSnapshot
+from .text import TimestampedText, get_piece_table, tokens_to_timestamped_text_batch
+
+
+class Transcriber:
+    """Mimi, the text tokenizer and the LM of an STT checkpoint, loaded once.
+
+    Audio goes through the same steps as in the example scripts: resampling to
+    the Mimi sample rate, a silence prefix, the `mimi.encode` -> `lm_gen.step`
+    loop frame by frame, and a silence suffix to flush the delayed text.
+
+    Args:
+        info: the checkpoint to load, see `from_hf_repo`.
+        prompt_text: if set, the transcript is forced to start with this text.
+        support_out_of_sync: passed to `LMGen`, needed to reset some batch
+            items while the others keep going.
+        quantize: "int8" to run the linear layers of the LM in int8, on CPU
+            only, the LM is then loaded in float32 whatever `dtype` is.
+        cache_prefix: step the models over the silence prefix once, and start
+            every transcription from a snapshot of that state instead.
+    """
+
+    def __init__(
+        self,
+        info: moshi.models.loaders.CheckpointInfo,
+        device: str = "cuda",
+        dtype: torch.dtype = torch.bfloat16,
+        prompt_text: str | None = None,
+        support_out_of_sync: bool = False,
+        quantize: str | None = None,
+        cache_prefix: bool = True,
+    ):
+        if quantize is not None and quantize != "int8":
+            raise ValueError(f"Unknown quantization {quantize}.")
+        if quantize is not None and str(device) != "cpu":
+            raise ValueError(f"Quantization is only supported on CPU, not {device}.")
+        self.device = device
+        self.mimi = info.get_mimi(device=device)
+        self.tokenizer = info.get_text_tokenizer()
+        if quantize == "int8":
+            self.lm = quantize_int8(info.get_moshi(device=device, dtype=torch.float32))
+        else:
+            self.lm = info.get_moshi(device=device, dtype=dtype)
+
+        hooks = {}
+        self.prompt_hook = None
+        if prompt_text:
+            self.prompt_hook = PromptHook(self.tokenizer, prompt_text)
+            hooks = dict(
+                on_text_hook=self.prompt_hook.on_token,
+                on_text_logits_hook=self.prompt_hook.on_logits,
+            )
+        self.lm_gen = moshi.models.LMGen(
+            self.lm,
+            temp=0,
+            temp_text=0.0,
+            support_out_of_sync=support_out_of_sync,
+            **hooks,
+        )
+
+        self.audio_silence_prefix_seconds = info.stt_config.get(
+            "audio_silence_prefix_seconds", 1.0
+        )
+        self.audio_delay_seconds = info.stt_config.get("audio_delay_seconds", 5.0)
+        self.padding_token_id = info.raw_config.get("text_padding_token_id", 3)
+
+        self.n_prefix_chunks = math.ceil(
+            self.audio_silence_prefix_seconds * self.mimi.frame_rate
+        )
+        self.n_suffix_chunks = math.ceil(
+            self.audio_delay_seconds * self.mimi.frame_rate
+        )
+        # Timestamps are shifted by the silence prefix and the delay of the text.
+        self.timestamp_offset = (
+            int(self.n_prefix_chunks / self.mimi.frame_rate) + self.audio_delay_seconds
+        )
+        self.cache_prefix = cache_prefix
+        self._silence_snapshots: dict[int, StreamingSnapshot] = {}
+
+    @classmethod
+    def from_hf_repo(
+        cls,
+        hf_repo: str | None,
+        moshi_weight: str | None = None,
+        mimi_weight: str | None = None,
+        tokenizer: str | None = None,
+        config_path: str | None = None,
+        **kwargs,
+    ) -> "Transcriber":
+        info = moshi.models.loaders.CheckpointInfo.from_hf_repo(
+            hf_repo,
+            moshi_weights=moshi_weight,
+            mimi_weights=mimi_weight,
+            tokenizer=tokenizer,
+            config_path=config_path,
+        )
+        return cls(info, **kwargs)
+
+    @property
+    def sample_rate(self) -> int:
+        return self.mimi.sample_rate
+
+    def load_audio(self, path) -> torch.Tensor:
+        """Reads a file as a mono `[1, T]` tensor at the Mimi sample rate."""
+        return load_audio(path, self.mimi.sample_rate, device=self.device)
+
+    def frames(
+        self,
+        pcm_chunks: Iterable[torch.Tensor],
+        device=None,
+        consumed: list[int] | None = None,
+        n_prefix: int | None = None,
+        suffix: bool = True,
+    ) -> Iterator[torch.Tensor]:
+        """Cuts `[1, T]` chunks of any length into `[1, 1, frame_size]` frames,
+        surrounded with the silence prefix and suffix.
+
+        The chunks must be at the Mimi sample rate. If given, `consumed[0]`
+        counts the samples of actual audio handed out so far. `n_prefix`
+        overrides the number of silence frames in front, e.g. 0 when the
+        session starts from a `silence_snapshot`.
+        """
+        device = device or self.device
+        consumed = consumed if consumed is not None else [0]
+        frame_size = self.mimi.frame_size
+        silence_chunk = torch.zeros(
+            (1, 1, frame_size), dtype=torch.float32, device=device
+        )
+        n_prefix = self.n_prefix_chunks if n_prefix is None else n_prefix
+        yield from itertools.repeat(silence_chunk, n_prefix)
+        remainder = torch.zeros((1, 0), dtype=torch.float32, device=device)
+        for chunk in pcm_chunks:
+            chunk = chunk.float().to(device).view(1, -1)
+            remainder = torch.cat([remainder, chunk], dim=-1)
+            n_frames = remainder.shape[-1] // frame_size
+            if n_frames == 0:
+                continue
+            full = remainder[:, : n_frames * frame_size]
+            remainder = remainder[:, n_frames * frame_size :]
+            for frame in torch.split(full[:, None], frame_size, dim=-1):
+                consumed[0] += frame_size
+                yield frame
+        if remainder.shape[-1] > 0:
+            consumed[0] += remainder.shape[-1]
+            yield pad_to_frame(remainder, frame_size)[:, None]
+        if suffix:
+            yield from itertools.repeat(silence_chunk, self.n_suffix_chunks)
+
+    def _step(self, frame: torch.Tensor) -> torch.Tensor | None:
+        with profiling.span("to_device"):
+            frame = frame.to(self.device)
+        with profiling.span("mimi.encode"):
+            audio_tokens = self.mimi.encode(frame)
+        with profiling.span("lm_gen.step"):
+            return self.lm_gen.step(audio_tokens)
+
+    @torch.no_grad()
+    def stream(
+        self, frames: Iterable[torch.Tensor], snapshot: StreamingSnapshot | None = None
+    ) -> Iterator[torch.Tensor]:
+        """Runs one streaming session over `[1, 1, frame_size]` frames, yields
+        the `[1, 1, 1]` text tokens (left on the device) once the LM has
+        produced some.
+
+        With a `snapshot`, the session starts from its state and the tokens
+        it holds are yielded first, `frames` should then leave out the prefix.
+        """
+        with self.mimi.streaming(1), self.lm_gen.streaming(1):
+            if snapshot is not None:
+                self.restore(snapshot)
+                yield from snapshot.tokens.split(1, dim=-1)
+            elif self.prompt_hook is not None:
+                self.prompt_hook.reset()
+            for frame in frames:
+                text_tokens = self._step(frame)
+                if text_tokens is not None:
+                    yield text_tokens
+
+    @torch.no_grad()
+    def prefix_snapshot(
+        self, pcm_chunks: Iterable[torch.Tensor] = (), n_prefix: int | None = None
+    ) -> StreamingSnapshot:
+        """Steps a new session over the silence prefix (`n_prefix` frames, by
+        default `n_prefix_chunks`) then the `[1, T]` `pcm_chunks`, e.g. an
+        audio prompt, and snapshots its state for `stream`."""
+        text_tokens = []
+        n_frames = 0
+        with self.mimi.streaming(1), self.lm_gen.streaming(1):
+            if self.prompt_hook is not None:
+                self.prompt_hook.reset()
+            for frame in self.frames(pcm_chunks, n_prefix=n_prefix, suffix=False):
+                n_frames += 1
+                tokens = self._step(frame)
+                if tokens is not None:
+                    text_tokens.append(tokens)
+            if text_tokens:
+                tokens = torch.concat(text_tokens, dim=-1)
+            else:
+                tokens = torch.zeros((1, 1, 0), dtype=torch.long, device=self.device)
+            return StreamingSnapshot.capture(
+                self.mimi, self.lm_gen, tokens, n_frames, prompt_hook=self.prompt_hook
+            )
+
+    def silence_snapshot(self, n_prefix: int | None = None) -> StreamingSnapshot:
+        """`prefix_snapshot` over silence only, computed once per `n_prefix`.
+
+        This must be called outside of a streaming session, e.g. before
+        starting a batched one.
+        """
+        n_prefix = self.n_prefix_chunks if n_prefix is None else n_prefix
+        if n_prefix not in self._silence_snapshots:
+            self._silence_snapshots[n_prefix] = self.prefix_snapshot(n_prefix=n_prefix)
+        return self._silence_snapshots[n_prefix]
+
+    def restore(self, snapshot: StreamingSnapshot, slots=None) -> None:
+        """Copies `snapshot` into the running session, see `StreamingSnapshot.restore`."""
+        with profiling.span("restore"):
+            snapshot.restore(
+                self.mimi, self.lm_gen, slots, prompt_hook=self.prompt_hook
+            )
+
+    def transcribe_tokens(self, audio: torch.Tensor, sample_rate: int) -> torch.Tensor:
+        """Text tokens of a `[C, T]` waveform, one per frame."""
+        with profiling.span("resample"):
+            audio = audio.float().to(self.device).mean(dim=0, keepdim=True)
+            audio = resample(audio, sample_rate, self.mimi.sample_rate)
+        if self.cache_prefix:
+            frames = self.frames([audio], n_prefix=0)
+            text_tokens = list(self.stream(frames, self.silence_snapshot()))
+        else:
+            text_tokens = list(self.stream(self.frames([audio])))
+        with profiling.span("to_host"):
+            return torch.concat(text_tokens, dim=-1).cpu().view(-1)
+
+    def words(
+        self, tokens: torch.Tensor, offset_seconds: float = 0.0
+    ) -> list[TimestampedText]:
+        return self.words_batch(tokens.view(1, -1), offset_seconds)[0]
+
+    def words_batch(
+        self, tokens: torch.Tensor, offset_seconds: float = 0.0
+    ) -> list[list[TimestampedText]]:
+        """Timestamped words of each stream of `[B, T]` (or `[B, 1, T]`) tokens."""
+        with profiling.span("detokenize"):
+            return tokens_to_timestamped_text_batch(
+                tokens,
+                self.tokenizer,
+                self.mimi.frame_rate,
+                end_of_padding_id=0,
+                padding_token_id=self.padding_token_id,
+                offset_seconds=self.timestamp_offset + offset_seconds,
+                piece_table=get_piece_table(self.tokenizer),
+            )
+
+    def text(self, tokens: torch.Tensor) -> str:
+        """Plain transcript, without timestamps."""
+        with profiling.span("detokenize"):
+            tokens = tokens.cpu().view(-1)
+            return self.tokenizer.decode(
+                tokens[tokens > self.padding_token_id].tolist()
+            )
+
+    def transcribe_words(
+        self, audio: torch.Tensor, sample_rate: int, offset_seconds: float = 0.0
+    ) -> list[TimestampedText]:
+        """Transcribe a `[C, T]` waveform into timestamped words."""
+        return self.words(self.transcribe_tokens(audio, sample_rate), offset_seconds)
+
+    def transcribe(
+        self, audio: torch.Tensor, sample_rate: int, offset_seconds: float = 0.0
+    ) -> str:
+        """Transcribe a `[C, T]` waveform, returns words with their timestamps."""
+        timed_text = self.transcribe_words(audio, sample_rate, offset_seconds)
+        return " ".join([str(t) for t in timed_text])
+
+    @torch.no_grad()
+    def batch_tokens(self, padded_batch: torch.Tensor) -> torch.Tensor:
+        """Text tokens `[B, 1, T]` of a `[B, 1, samples]` batch already padded
+        with silence, see `get_padded_batch`."""
+        bsz = padded_batch.shape[0]
+        frame_size = self.mimi.frame_size
+        with profiling.span("to_device"):
+            padded_batch = padded_batch.to(self.device)
+        snapshot = None
+        if self.cache_prefix:
+            # The whole frames of silence in front are the same for all the
+            # items, they are replaced by a snapshot if the batch has them.
+            n_prefix = int(self.audio_silence_prefix_seconds * self.mimi.sample_rate)
+            n_prefix //= frame_size
+            if n_prefix > 0 and not padded_batch[..., : n_prefix * frame_size].any():
+                snapshot = self.silence_snapshot(n_prefix)
+        text_tokens_acc = []
+        with self.mimi.streaming(bsz), self.lm_gen.streaming(bsz):
+            start = 0
+            if snapshot is not None:
+                self.restore(snapshot)
+                text_tokens_acc.append(snapshot.tokens.expand(bsz, -1, -1))
+                start = snapshot.frames * frame_size
+            for offset in range(start, padded_batch.shape[-1], frame_size):
+                audio_chunk = padded_batch[:, :, offset : offset + frame_size]
+                with profiling.span("mimi.encode"):
+                    audio_tokens = self.mimi.encode(audio_chunk)
+                with profiling.span("lm_gen.step"):
+                    text_tokens = self.lm_gen.step(audio_tokens)
+                if text_tokens is not None:
+                    text_tokens_acc.append(text_tokens)
+        return torch.concat(text_tokens_acc, axis=-1)
+
+    def collator(self, pad: bool = True) -> AudioCollator:
+        """Prepares dataset samples for `batch_tokens` (or, with `pad=False`,
+        for `ContinuousBatcher`) without needing the model, e.g. in the worker
+        processes of a `DataLoader`."""
+        return AudioCollator(
+            self.mimi.sample_rate,
+            self.mimi.frame_size,
+            before_padding=self.audio_silence_prefix_seconds,
+            after_padding=self.audio_delay_seconds + 0.5,
+            pad=pad,
+        )
+
+    def pad_batch(self, audios: list[tuple[torch.Tensor, int]]) -> torch.Tensor:
+        """Resamples `(audio, sample_rate)` pairs and pads them with silence
+        into one `[B, 1, samples]` batch."""
+        samples = [
+            {"audio": {"array": audio, "sampling_rate": sr}} for audio, sr in audios
+        ]
+        return self.collator()(samples)["audio"]
+
+    def batch_words(self, text_tokens: torch.Tensor) -> list[list[TimestampedText]]:
+        """Timestamped words of the `[B, 1, T]` output of `batch_tokens` on a
+        batch from `pad_batch`, relative to the start of each audio."""
+        # `pad_batch` puts exactly `audio_silence_prefix_seconds` of silence in
+        # front, where `frames` uses a whole number of frames.
+        prefix_difference = self.audio_silence_prefix_seconds - int(
+            self.n_prefix_chunks / self.mimi.frame_rate
+        )
+        return self.words_batch(text_tokens, offset_seconds=prefix_difference)
+
+    def transcribe_batch(self, audios: list[tuple[torch.Tensor, int]]) -> list[str]:
+        """Plain transcripts of `(audio, sample_rate)` pairs, run as one batch."""
+        text_tokens = self.batch_tokens(self.pad_batch(audios))
+        return [self.text(tokens) for tokens in text_tokens]
@@ -34,17 +34,24 @@ and then feed these batches into the streaming STT model frame-by-frame.
 # Earnings21 === cer: 5.73% wer: 9.84% corpus_wer: 10.38% RTF = 73.15
 
 import argparse
+import concurrent.futures
+import contextlib
 import dataclasses
+import io
+import json
+import multiprocessing
 import time
+from pathlib import Path
 
 import jiwer
-import julius
-import moshi.models
+import soundfile
 import torch
 import tqdm
-from datasets import Dataset, load_dataset
+from datasets import Audio, Dataset, load_dataset
 from whisper.normalizers import EnglishTextNormalizer
 
+from dsm import QUANTIZE_CHOICES, ContinuousBatcher, Transcriber, profiling
+
 _NORMALIZER = EnglishTextNormalizer()
 
 
@@ -84,33 +91,62 @@ def is_target_text_in_range(ref):
 # End of the adapted part
 
 
+def score(hyp: str, norm_ref: str) -> tuple[float, float, int, int]:
+    """WER, CER, word errors and reference words of one utterance, from a
+    single word alignment and a single character alignment. The reference is
+    the `norm_text` column, already normalized by `normalize`."""
+    norm_hyp = _NORMALIZER(hyp)
+    words = jiwer.process_words(norm_ref, norm_hyp)
+    chars = jiwer.process_characters(norm_ref, norm_hyp)
+    errors = words.substitutions + words.deletions + words.insertions
+    ref_words = words.substitutions + words.deletions + words.hits
+    return words.wer, chars.cer, errors, ref_words
+
+
+def score_batch(hyps: list[str], norm_refs: list[str]) -> list[tuple]:
+    return [score(hyp, ref) for hyp, ref in zip(hyps, norm_refs)]
+
+
 class AsrMetrics:
-    def __init__(self):
+    """Accumulates the WER/CER of the utterances.
+
+    With an `executor` (a process pool), the scoring of each `update` runs in
+    the background while the model goes on with the next batch, the results
+    are gathered as they complete and by `compute`.
+    """
+
+    def __init__(self, executor=None):
+        self.executor = executor
+        self._pending = []
         self.cer_sum = 0.0
         self.wer_sum = 0.0
         self.errors_sum = 0.0
         self.total_words_sum = 0.0
         self.num_sequences = 0.0
 
-    def update(self, hyp: str, ref: str) -> None:
-        normalized_ref = _NORMALIZER(ref)
-        normalized_hyp = _NORMALIZER(hyp)
-
-        this_wer = jiwer.wer(normalized_ref, normalized_hyp)
-        this_cer = jiwer.cer(normalized_ref, normalized_hyp)
-        measures = jiwer.compute_measures(normalized_ref, normalized_hyp)
-
-        self.wer_sum += this_wer
-        self.cer_sum += this_cer
-        self.errors_sum += (
-            measures["substitutions"] + measures["deletions"] + measures["insertions"]
-        )
-        self.total_words_sum += (
-            measures["substitutions"] + measures["deletions"] + measures["hits"]
-        )
-        self.num_sequences += 1
+    def update(self, hyps: list[str], norm_refs: list[str]) -> None:
+        """Scores hypotheses against references normalized by `normalize`."""
+        if self.executor is None:
+            self._add(score_batch(hyps, norm_refs))
+            return
+        self._pending.append(self.executor.submit(score_batch, hyps, norm_refs))
+        done = [future for future in self._pending if future.done()]
+        for future in done:
+            self._pending.remove(future)
+            self._add(future.result())
+
+    def _add(self, scores: list[tuple]) -> None:
+        for this_wer, this_cer, errors, ref_words in scores:
+            self.wer_sum += this_wer
+            self.cer_sum += this_cer
+            self.errors_sum += errors
+            self.total_words_sum += ref_words
+            self.num_sequences += 1
 
     def compute(self) -> dict:
+        for future in self._pending:
+            self._add(future.result())
+        self._pending.clear()
         assert self.num_sequences > 0, (
             "Unable to compute with total number of comparisons <= 0"
         )  # type: ignore
@@ -196,164 +232,446 @@ def get_dataset(args) -> Dataset:
     )
     dataset = dataset.map(normalize)
     dataset = dataset.filter(is_target_text_in_range, input_columns=["norm_text"])
+    # Position in the filtered dataset, kept when batches are reordered.
+    dataset = dataset.add_column("index", list(range(len(dataset))))
 
     return dataset
 
 
-@torch.no_grad
-def get_padded_batch(
-    audios: list[tuple[torch.Tensor, int]],
-    before_padding: float,
-    after_padding: float,
-    audio_encoder,
-):
-    sample_rate = audio_encoder.sample_rate
-
-    max_len = 0
-    batch = []
-    durations = []
-    for audio, sr in audios:
-        durations.append(audio.shape[-1] / sr)
-        audio = julius.resample_frac(audio, int(sr), int(sample_rate))
-        audio = torch.nn.functional.pad(
-            audio, (int(before_padding * sample_rate), int(after_padding * sample_rate))
+def get_duration(audio):
+    """Duration of an undecoded `audio` entry, from the header of the file."""
+    source = io.BytesIO(audio["bytes"]) if audio.get("bytes") else audio["path"]
+    return {"duration": soundfile.info(source).duration}
+
+
+def sort_by_duration(dataset: Dataset) -> Dataset:
+    """Orders utterances by duration, so that each batch groups utterances of
+    similar lengths and little compute goes to stepping the model over the
+    padding of the shorter ones."""
+    if "duration" not in dataset.column_names:
+        # Only the headers are read here, the audio is decoded once, by the
+        # loader workers.
+        durations = dataset.cast_column("audio", Audio(decode=False)).map(
+            get_duration,
+            input_columns=["audio"],
+            remove_columns=dataset.column_names,
+            num_proc=args.num_workers or None,
         )
-        max_len = max(max_len, audio.shape[-1])
-        batch.append(audio)
+        dataset = dataset.add_column("duration", durations["duration"])
+    return dataset.sort("duration")
 
-    target = max_len
-    if target % audio_encoder.frame_size != 0:
-        target = target + (
-            audio_encoder.frame_size - max_len % audio_encoder.frame_size
-        )
-    padded_batch = torch.stack(
-        [
-            torch.nn.functional.pad(audio, (0, target - audio.shape[-1]))
-            for audio in batch
-        ]
+
+def make_loader(dataset, transcriber: Transcriber, batch_size: int, pad: bool = True):
+    """Decodes and resamples the audio in `args.num_workers` worker processes,
+    keeping `args.prefetch` batches ready per worker in pinned memory, so that
+    the model does not wait for the next batch."""
+    return torch.utils.data.DataLoader(
+        dataset,
+        batch_size=batch_size,
+        shuffle=False,
+        collate_fn=transcriber.collator(pad=pad),
+        num_workers=args.num_workers,
+        prefetch_factor=args.prefetch if args.num_workers > 0 else None,
+        pin_memory=str(transcriber.device).startswith("cuda"),
     )
-    return padded_batch
 
 
-@torch.no_grad
-def streaming_transcribe(
-    padded_batch: torch.Tensor,
-    mimi,
-    lm_gen,
+def run_inference(
+    dataset, transcriber: Transcriber, metrics: AsrMetrics, outputs, run_dir=None
 ):
-    bsz = padded_batch.shape[0]
+    """Runs the batched streaming model over `dataset`. The hypothesis and word
+    timestamps of every utterance are written to each file of `outputs` as one
+    JSON object per line, with `index` their position in the dataset as
+    batches may be reordered. `run_dir` gets a checkpoint after every batch."""
+    audio_time = 0.0
+    # Audio the model actually steps over, including the padding.
+    processed_time = 0.0
+    inference_timer = Timer()
+    wall_timer = Timer()
 
-    text_tokens_acc = []
+    with wall_timer:
+        for batch in tqdm.tqdm(make_loader(dataset, transcriber, args.batch_size)):
+            audio_time += sum(batch["durations"])
 
-    with mimi.streaming(bsz), lm_gen.streaming(bsz):
-        for offset in range(0, padded_batch.shape[-1], mimi.frame_size):
-            audio_chunk = padded_batch[:, offset : offset + mimi.frame_size]
-            audio_chunk = audio_chunk[:, None, :]
+            padded_batch = batch["audio"].to(transcriber.device, non_blocking=True)
+            processed_time += (
+                padded_batch.shape[0] * padded_batch.shape[-1] / transcriber.sample_rate
+            )
 
-            audio_tokens = mimi.encode(audio_chunk)
-            text_tokens = lm_gen.step(audio_tokens)
-            if text_tokens is not None:
-                text_tokens_acc.append(text_tokens)
+            with inference_timer:
+                text_tokens = transcriber.batch_tokens(padded_batch)
 
-    return torch.concat(text_tokens_acc, axis=-1)
+            texts = [transcriber.text(tokens) for tokens in text_tokens]
+            metrics.update(texts, batch["norm_text"])
+            if outputs:
+                batch_words = transcriber.batch_words(text_tokens)
+                for batch_index, text in enumerate(texts):
+                    sample = {
+                        key: batch[key][batch_index] for key in batch if key != "audio"
+                    }
+                    write_record(outputs, sample, text, batch_words[batch_index])
+            if run_dir is not None:
+                run_dir.checkpoint(
+                    len(texts), audio_time, processed_time, inference_timer.total
+                )
 
+    return inference_timer.total, wall_timer.total, audio_time, processed_time
 
-def run_inference(
-    dataset,
-    mimi,
-    lm_gen,
-    tokenizer,
-    padding_token_id,
-    before_padding_sec,
-    after_padding_sec,
+
+def run_inference_continuous(
+    dataset, transcriber: Transcriber, metrics: AsrMetrics, outputs, run_dir=None
 ):
-    metrics = AsrMetrics()
+    """Same as `run_inference`, but each slot of the batch is refilled with the
+    next utterance as soon as its current one is done, see `ContinuousBatcher`.
+    `run_dir` gets a checkpoint every `batch_size` utterances."""
     audio_time = 0.0
-    inference_timer = Timer()
+    batcher = ContinuousBatcher(transcriber, batch_size=args.batch_size)
+    samples = {}
+    wall_timer = Timer()
+
+    def _audio():
+        nonlocal audio_time
+        position = 0
+        # Utterances come already resampled from the loader workers.
+        for batch in make_loader(dataset, transcriber, 1, pad=False):
+            audio_time += batch["durations"][0]
+            # Everything but the audio is kept until the utterance is done.
+            samples[position] = {key: batch[key][0] for key in batch if key != "audio"}
+            yield position, batch["audio"][0], transcriber.sample_rate
+            position += 1
+
+    def _processed_time():
+        processed = batcher.steps * args.batch_size * transcriber.mimi.frame_size
+        return processed / transcriber.sample_rate
+
+    # Only the audio of finished utterances goes into the checkpoints.
+    done_audio_time = 0.0
+    pending = 0
+    with wall_timer:
+        for position, text_tokens in tqdm.tqdm(
+            batcher.run(_audio()), total=len(dataset)
+        ):
+            sample = samples.pop(position)
+            text = transcriber.text(text_tokens)
+            metrics.update([text], [sample["norm_text"]])
+            if outputs:
+                write_record(outputs, sample, text, transcriber.words(text_tokens))
+            done_audio_time += sample["durations"]
+            pending += 1
+            if run_dir is not None and pending >= args.batch_size:
+                run_dir.checkpoint(
+                    pending, done_audio_time, _processed_time(), batcher.model_seconds
+                )
+                pending = 0
+        if run_dir is not None and pending:
+            run_dir.checkpoint(
+                pending, done_audio_time, _processed_time(), batcher.model_seconds
+            )
 
-    for batch in tqdm.tqdm(dataset.iter(args.batch_size)):
-        audio_data = list(
-            zip(
-                [torch.tensor(x["array"]).float() for x in batch["audio"]],
-                [x["sampling_rate"] for x in batch["audio"]],
+    return batcher.model_seconds, wall_timer.total, audio_time, _processed_time()
+
+
+def write_record(outputs, sample, hyp, words) -> None:
+    record = {
+        "index": sample.get("index"),
+        "id": sample.get("id"),
+        "duration": sample["durations"],
+        "ref": sample["original_text"],
+        "norm_ref": sample["norm_text"],
+        "hyp": hyp,
+        "words": [
+            {"text": w.text, "start": w.timestamp[0], "end": w.timestamp[1]}
+            for w in words
+        ],
+    }
+    line = json.dumps(record) + "\n"
+    for output in outputs:
+        output.write(line)
+
+
+def read_jsonl(path: Path) -> list[dict]:
+    """Records of a JSONL file, without the last line if a crash cut it short."""
+    if not path.exists():
+        return []
+    records = []
+    with path.open() as f:
+        for line in f:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                break
+    return records
+
+
+class RunDir:
+    """Output directory of an evaluation run, filled as the run goes so that a
+    crashed run can be resumed and its metrics recomputed without inference.
+
+    `hyps.jsonl` has one record per utterance (see `write_record`),
+    `timings.jsonl` one line per checkpoint with the audio, processed audio,
+    model and wall-clock seconds since the previous one, and `run.json` the
+    settings the run was started with.
+    """
+
+    def __init__(self, path, config: dict | None = None, resume: bool = False):
+        self.path = Path(path)
+        self.hyps_path = self.path / "hyps.jsonl"
+        self.timings_path = self.path / "timings.jsonl"
+        self.config_path = self.path / "run.json"
+        self.records = read_jsonl(self.hyps_path)
+        self.timings = read_jsonl(self.timings_path)
+        self.config = (
+            json.loads(self.config_path.read_text())
+            if self.config_path.exists()
+            else {}
+        )
+        self._files = []
+        if config is None:
+            # Read-only, for rescoring.
+            return
+
+        if self.records and not resume:
+            raise RuntimeError(
+                f"{self.hyps_path} already has results, pass --resume to continue "
+                "this run or use another --output-dir."
+            )
+        if resume and self.config:
+            for key in ("dataset", "num_shards", "shard_index"):
+                if self.config.get(key) != config.get(key):
+                    raise RuntimeError(
+                        f"Cannot resume: {self.path} has {key}={self.config.get(key)}."
+                    )
+        if not resume:
+            self.records, self.timings = [], []
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.config_path.write_text(json.dumps(config, indent=2))
+        # Rewritten with the complete lines only, new results are appended.
+        self.hyps_file = self._rewrite(self.hyps_path, self.records)
+        self.timings_file = self._rewrite(self.timings_path, self.timings)
+        self.start()
+
+    def _rewrite(self, path: Path, records: list[dict]):
+        with path.open("w") as f:
+            f.writelines(json.dumps(record) + "\n" for record in records)
+        f = path.open("a")
+        self._files.append(f)
+        return f
+
+    def start(self) -> None:
+        """Starts the clock of the first checkpoint, right before inference."""
+        self._last = (0.0, 0.0, 0.0)
+        self._clock = time.perf_counter()
+
+    @property
+    def done(self) -> set[int]:
+        """Dataset indices of the utterances already transcribed."""
+        return {record["index"] for record in self.records}
+
+    def checkpoint(
+        self,
+        utterances: int,
+        audio_time: float,
+        processed_time: float,
+        model_time: float,
+    ) -> None:
+        """Logs the timings since the last checkpoint (from running totals)
+        and flushes the hypotheses written so far."""
+        now = time.perf_counter()
+        last_audio, last_processed, last_model = self._last
+        timing = {
+            "utterances": utterances,
+            "audio_seconds": audio_time - last_audio,
+            "processed_seconds": processed_time - last_processed,
+            "model_seconds": model_time - last_model,
+            "wall_seconds": now - self._clock,
+        }
+        self._last = (audio_time, processed_time, model_time)
+        self._clock = now
+        self.hyps_file.flush()
+        self.timings_file.write(json.dumps(timing) + "\n")
+        self.timings_file.flush()
+
+    def previous_times(self) -> tuple[float, float, float, float]:
+        """Model, wall, audio and processed seconds of the stored checkpoints."""
+        return tuple(
+            sum(timing[key] for timing in self.timings)
+            for key in (
+                "model_seconds",
+                "wall_seconds",
+                "audio_seconds",
+                "processed_seconds",
             )
         )
 
-        audio_time += sum(audio.shape[-1] / sr for (audio, sr) in audio_data)
+    def close(self) -> None:
+        for f in self._files:
+            f.close()
+
+
+def report(metrics: AsrMetrics, inference_time, wall_time, audio_time, processed_time):
+    # RTF counts the model only, wall RTF everything including data loading.
+    # Padding efficiency: real audio over what the model processed, padding
+    # and silence prefix/suffix included.
+    if processed_time == 0:
+        # E.g. an empty shard, nothing ran.
+        print(metrics, "no audio processed")
+        return
+    print(
+        metrics,
+        f"RTF = {audio_time / inference_time:.2f}",
+        f"wall RTF = {audio_time / wall_time:.2f}",
+        f"padding efficiency = {100 * audio_time / processed_time:.1f}%",
+    )
 
-        gt_transcripts = batch["original_text"]
 
-        padded_batch = get_padded_batch(
-            audio_data,
-            before_padding=before_padding_sec,
-            after_padding=after_padding_sec,
-            audio_encoder=mimi,
+def score_records(
+    metrics: AsrMetrics, records: list[dict], chunk_size: int = 256
+) -> None:
+    for offset in range(0, len(records), chunk_size):
+        chunk = records[offset : offset + chunk_size]
+        metrics.update(
+            [record["hyp"] for record in chunk],
+            [record["norm_ref"] for record in chunk],
         )
-        padded_batch = padded_batch.cuda()
 
-        with inference_timer:
-            text_tokens = streaming_transcribe(
-                padded_batch,
-                mimi=mimi,
-                lm_gen=lm_gen,
-            )
 
-        for batch_index in range(text_tokens.shape[0]):
-            utterance_tokens = text_tokens[batch_index, ...]
-            utterance_tokens = utterance_tokens[utterance_tokens > padding_token_id]
-            text = tokenizer.decode(utterance_tokens.cpu().numpy().tolist())
-            metrics.update(hyp=text, ref=gt_transcripts[batch_index])
+def rescore(paths: list[str], executor=None) -> None:
+    """Recomputes the report from the hypotheses stored in one or more output
+    directories, e.g. the shards of a `--num-shards` run.
+
+    Utterances are scored again and summed over all the shards, so the
+    corpus WER comes from the total error and word counts rather than from an
+    average of the shard results. Times are summed over the shards too, the
+    RTF is per process.
+    """
+    run_dirs = [RunDir(path) for path in paths]
+    datasets = {run_dir.config.get("dataset") for run_dir in run_dirs}
+    if len(datasets) > 1:
+        raise RuntimeError(
+            f"Cannot merge runs on different datasets: {sorted(datasets)}."
+        )
+    num_shards = max(run_dir.config.get("num_shards", 1) for run_dir in run_dirs)
+    shards = {run_dir.config.get("shard_index", 0) for run_dir in run_dirs}
+    missing = sorted(set(range(num_shards)) - shards)
+    if missing:
+        print(
+            f"Warning: shards {missing} of {num_shards} are missing, the report is partial."
+        )
 
-    return metrics, inference_timer.total, audio_time
+    # An utterance found in several directories is only counted once.
+    records = {}
+    for run_dir in run_dirs:
+        records.update((record["index"], record) for record in run_dir.records)
+    if not records:
+        raise RuntimeError(f"No results in {', '.join(paths)}.")
+    metrics = AsrMetrics(executor)
+    score_records(metrics, list(records.values()))
+    times = [run_dir.previous_times() for run_dir in run_dirs]
+    report(metrics, *(sum(column) for column in zip(*times)))
+
+
+def make_executor(stack: contextlib.ExitStack):
+    if args.metric_workers <= 0:
+        return None
+    # Not forked, the main process holds CUDA and loader threads.
+    return stack.enter_context(
+        concurrent.futures.ProcessPoolExecutor(
+            args.metric_workers, mp_context=multiprocessing.get_context("spawn")
+        )
+    )
 
 
 def main(args):
+    if args.rescore or args.merge:
+        with contextlib.ExitStack() as stack:
+            rescore(args.merge or [args.output_dir], make_executor(stack))
+        return
+
     torch.set_float32_matmul_precision("high")
+    if args.profile or args.trace:
+        profiling.enable()
 
-    info = moshi.models.loaders.CheckpointInfo.from_hf_repo(
+    transcriber = Transcriber.from_hf_repo(
         args.hf_repo,
-        moshi_weights=args.moshi_weight,
-        mimi_weights=args.mimi_weight,
+        moshi_weight=args.moshi_weight,
+        mimi_weight=args.mimi_weight,
         tokenizer=args.tokenizer,
         config_path=args.config_path,
-    )
-
-    mimi = info.get_mimi(device=args.device)
-    tokenizer = info.get_text_tokenizer()
-    lm = info.get_moshi(
         device=args.device,
         dtype=torch.bfloat16,
+        support_out_of_sync=args.continuous,
+        quantize=args.quantize,
     )
-    lm_gen = moshi.models.LMGen(lm, temp=0, temp_text=0.0)
     dataset = get_dataset(args)
-
-    padding_token_id = info.raw_config.get("text_padding_token_id", 3)
-    # Putting in some conservative defaults
-    audio_silence_prefix_seconds = info.stt_config.get(
-        "audio_silence_prefix_seconds", 1.0
-    )
-    audio_delay_seconds = info.stt_config.get("audio_delay_seconds", 5.0)
-
-    wer_metric, inference_time, audio_time = run_inference(
-        dataset,
-        mimi,
-        lm_gen,
-        tokenizer,
-        padding_token_id,
-        audio_silence_prefix_seconds,
-        audio_delay_seconds + 0.5,
-    )
-
-    print(wer_metric, f"RTF = {audio_time / inference_time:.2f}")
+    if args.num_shards > 1:
+        # Interleaved, so that every shard gets a similar mix of durations.
+        # The `index` column still refers to the whole dataset.
+        dataset = dataset.shard(args.num_shards, args.shard_index, contiguous=False)
+
+    inference = run_inference_continuous if args.continuous else run_inference
+    with contextlib.ExitStack() as stack:
+        outputs = []
+        run_dir = None
+        metrics = AsrMetrics(make_executor(stack))
+        previous_times = (0.0, 0.0, 0.0, 0.0)
+        if args.output_dir:
+            config = {
+                key: getattr(args, key)
+                for key in (
+                    "dataset",
+                    "hf_repo",
+                    "batch_size",
+                    "continuous",
+                    "order",
+                    "num_shards",
+                    "shard_index",
+                )
+            }
+            run_dir = RunDir(args.output_dir, config, resume=args.resume)
+            stack.callback(run_dir.close)
+            outputs.append(run_dir.hyps_file)
+            if run_dir.records:
+                done = run_dir.done
+                print(
+                    f"Resuming {args.output_dir}: {len(done)} utterances already done."
+                )
+                dataset = dataset.filter(
+                    lambda i: i not in done, input_columns=["index"]
+                )
+                score_records(metrics, run_dir.records)
+                previous_times = run_dir.previous_times()
+        if args.output_jsonl:
+            output = stack.enter_context(open(args.output_jsonl, "w"))
+            if run_dir is not None:
+                # With --resume, the utterances of the earlier runs come first,
+                # so that the file covers everything the metrics do.
+                output.writelines(
+                    json.dumps(record) + "\n" for record in run_dir.records
+                )
+            outputs.append(output)
+        if args.order == "duration":
+            dataset = sort_by_duration(dataset)
+
+        times = (0.0, 0.0, 0.0, 0.0)
+        if run_dir is not None:
+            run_dir.start()
+        if len(dataset) > 0:
+            times = inference(dataset, transcriber, metrics, outputs, run_dir)
+        # Waits for the last scores while the pool is still up.
+        metrics.compute()
+
+    report(metrics, *(a + b for a, b in zip(previous_times, times)))
+    profiling.print_summary()
+    if args.trace:
+        profiling.export_chrome_trace(args.trace)
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Example streaming STT inference.")
     parser.add_argument(
         "--dataset",
-        required=True,
         choices=DATASET_MAP.keys(),
-        help="Dataset to run inference on.",
+        help="Dataset to run inference on, not needed with --rescore or --merge.",
     )
 
     parser.add_argument(
@@ -381,7 +699,96 @@ if __name__ == "__main__":
         default="cuda",
         help="Device on which to run, defaults to 'cuda'.",
     )
+    parser.add_argument(
+        "--quantize",
+        choices=QUANTIZE_CHOICES,
+        help="Run the LM linear layers in int8, for CPU inference (--device cpu).",
+    )
     parser.add_argument("--hf-cache-dir", type=str, help="HuggingFace cache folder.")
+    parser.add_argument(
+        "--num-workers",
+        type=int,
+        default=4,
+        help="Worker processes decoding and resampling audio, 0 to load in the main process.",
+    )
+    parser.add_argument(
+        "--prefetch",
+        type=int,
+        default=2,
+        help="Batches prepared ahead by each worker.",
+    )
+    parser.add_argument(
+        "--metric-workers",
+        type=int,
+        default=2,
+        help="Processes computing WER/CER in the background, 0 to score in the main process.",
+    )
+    parser.add_argument(
+        "--continuous",
+        action="store_true",
+        help="Refill each batch slot with the next utterance as soon as its "
+        "current one is done, instead of running whole batches.",
+    )
+    parser.add_argument(
+        "--order",
+        choices=["duration", "dataset"],
+        default="duration",
+        help="Batch utterances sorted by duration (default), or in dataset order.",
+    )
+    parser.add_argument(
+        "--output-dir",
+        type=str,
+        help="Directory where the hypotheses and timings are saved after every batch.",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue the run of --output-dir, skipping the utterances already done.",
+    )
+    parser.add_argument(
+        "--rescore",
+        action="store_true",
+        help="Only recompute the metrics from the hypotheses stored in --output-dir.",
+    )
+    parser.add_argument(
+        "--num-shards",
+        type=int,
+        default=1,
+        help="Split the dataset into this many shards, run each one in its own process.",
+    )
+    parser.add_argument(
+        "--shard-index",
+        type=int,
+        default=0,
+        help="Shard transcribed by this process, from 0 to --num-shards - 1.",
+    )
+    parser.add_argument(
+        "--merge",
+        type=str,
+        nargs="+",
+        help="Output directories of the shards of a run, prints the combined report.",
+    )
+    parser.add_argument(
+        "--output-jsonl",
+        type=str,
+        help="Write the hypothesis and word timestamps of every utterance to this file.",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Print the time spent in each inference stage (also enabled by DSM_PROFILE=1).",
+    )
+    parser.add_argument(
+        "--trace",
+        type=str,
+        help="Write a Chrome/Perfetto trace of the inference stages to this file.",
+    )
     args = parser.parse_args()
+    if not (args.dataset or args.rescore or args.merge):
+        parser.error("--dataset is required, unless --rescore or --merge is given.")
+    if (args.resume or args.rescore) and not args.output_dir:
+        parser.error("--resume and --rescore need --output-dir.")
+    if not 0 <= args.shard_index < args.num_shards:
+        parser.error("--shard-index must be in [0, --num-shards).")
 
     main(args)
@@ -5,229 +5,179 @@
 #     "librosa",
 #     "soundfile",
 #     "moshi",
+#     "sphn",
 # ]
 # ///
 
 """An example script that illustrates how one can get per-word timestamps from
 Kyutai STT models.
+
+With several files (or a directory, a glob or a `--manifest`), the files are
+sorted by duration and transcribed in padded batches of `--batch-size`, and
+the words of every file can be written to `--output-jsonl`.
 """
 
 import argparse
-import dataclasses
-import itertools
-import math
+import concurrent.futures
+import contextlib
+import glob
+import json
+import sys
+import time
+from pathlib import Path
 
-import julius
-import moshi.models
 import sphn
 import torch
-import tqdm
-
-
-@dataclasses.dataclass
-class TimestampedText:
-    text: str
-    timestamp: tuple[float, float]
-
-    def __str__(self):
-        return f"{self.text} ({self.timestamp[0]:.2f}:{self.timestamp[1]:.2f})"
 
+from dsm import QUANTIZE_CHOICES, Transcriber, profiling
 
-def tokens_to_timestamped_text(
-    text_tokens,
-    tokenizer,
-    frame_rate,
-    end_of_padding_id,
-    padding_token_id,
-    offset_seconds,
-) -> list[TimestampedText]:
-    text_tokens = text_tokens.cpu().view(-1)
+AUDIO_SUFFIXES = {".wav", ".mp3", ".flac", ".ogg", ".opus", ".m4a"}
 
-    # Normally `end_of_padding` tokens indicate word boundaries.
-    # Everything between them should be a single word;
-    # the time offset of the those tokens correspond to word start and
-    # end timestamps (minus silence prefix and audio delay).
-    #
-    # However, in rare cases some complexities could arise. Firstly,
-    # for words that are said quickly but are represented with
-    # multiple tokens, the boundary might be omitted. Secondly,
-    # for the very last word the end boundary might not happen.
-    # Below is a code snippet that handles those situations a bit
-    # more carefully.
-
-    sequence_timestamps = []
-
-    def _tstmp(start_position, end_position):
-        return (
-            max(0, start_position / frame_rate - offset_seconds),
-            max(0, end_position / frame_rate - offset_seconds),
-        )
 
-    def _decode(t):
-        t = t[t > padding_token_id]
-        return tokenizer.decode(t.numpy().tolist())
-
-    def _decode_segment(start, end):
-        nonlocal text_tokens
-        nonlocal sequence_timestamps
-
-        try:
-            # Ensure start and end are proper integers
-            start_idx = int(start) if hasattr(start, 'item') else int(start)
-            end_idx = int(end) if hasattr(end, 'item') else int(end)
-            
-            # Validate indices
-            if start_idx < 0 or end_idx < 0 or start_idx >= len(text_tokens) or end_idx > len(text_tokens):
-                print(f"Warning: Invalid segment indices {start_idx}:{end_idx} for tensor of length {len(text_tokens)}")
-                return
-                
-            text = _decode(text_tokens[start_idx:end_idx])
-        except (TypeError, ValueError, IndexError) as e:
-            print(f"Warning: Failed to decode segment {start}:{end} - {e}")
-            return
-        words_inside_segment = text.split()
-
-        if len(words_inside_segment) == 0:
-            return
-        if len(words_inside_segment) == 1:
-            # Single word within the boundaries, the general case
-            sequence_timestamps.append(
-                TimestampedText(text=text, timestamp=_tstmp(start_idx, end_idx))
+def list_files(inputs: list[str], manifest: str | None) -> list[str]:
+    """Expands directories and glob patterns, and reads the manifest: one path
+    per line, or JSON lines with an `audio_filepath` or `path` key."""
+    files = []
+    for item in inputs:
+        if Path(item).is_dir():
+            files += sorted(
+                str(p)
+                for p in Path(item).iterdir()
+                if p.suffix.lower() in AUDIO_SUFFIXES
             )
-        else:
-            # We're in a rare situation where multiple words are so close they are not separated by `end_of_padding`.
-            # We tokenize words one-by-one; each word is assigned with as many frames as much tokens it has.
-            current_start = start_idx
-            for adjacent_word in words_inside_segment[:-1]:
-                n_tokens = len(tokenizer.encode(adjacent_word))
-                sequence_timestamps.append(
-                    TimestampedText(
-                        text=adjacent_word, timestamp=_tstmp(current_start, current_start + n_tokens)
-                    )
-                )
-                current_start += n_tokens
-
-            # The last word takes everything until the boundary
-            adjacent_word = words_inside_segment[-1]
-            sequence_timestamps.append(
-                TimestampedText(text=adjacent_word, timestamp=_tstmp(current_start, end_idx))
+        elif glob.has_magic(item):
+            files += sorted(
+                path
+                for path in glob.glob(item, recursive=True)
+                if Path(path).suffix.lower() in AUDIO_SUFFIXES
             )
-
-    (segment_boundaries,) = torch.where(text_tokens == end_of_padding_id)
-
-    if not segment_boundaries.numel():
-        return []
-
-    for i in range(len(segment_boundaries) - 1):
-        try:
-            segment_start = int(segment_boundaries[i].item()) + 1
-            segment_end = int(segment_boundaries[i + 1].item())
-            _decode_segment(segment_start, segment_end)
-        except (TypeError, ValueError, AttributeError) as e:
-            print(f"Warning: Failed to process segment boundary {i} - {e}")
-            continue
-
-    try:
-        last_segment_start = int(segment_boundaries[-1].item()) + 1
-
-        boundary_token = torch.tensor([tokenizer.eos_id()])
-        (end_of_last_segment,) = torch.where(
-            torch.isin(text_tokens[last_segment_start:], boundary_token)
-        )
-
-        if not end_of_last_segment.numel():
-            # upper-bound either end of the audio or 1 second duration, whicher is smaller
-            last_segment_end = min(text_tokens.shape[-1], last_segment_start + frame_rate)
         else:
-            last_segment_end = last_segment_start + int(end_of_last_segment[0].item())
-        _decode_segment(last_segment_start, last_segment_end)
-    except (TypeError, ValueError, AttributeError, IndexError) as e:
-        print(f"Warning: Failed to process last segment - {e}")
-        # Try to decode whatever we can from the remaining tokens
-        try:
-            if len(segment_boundaries) > 0:
-                fallback_start = int(segment_boundaries[-1].item()) + 1
-                fallback_end = min(text_tokens.shape[-1], fallback_start + 100)  # Process at most 100 tokens
-                if fallback_start < fallback_end:
-                    _decode_segment(fallback_start, fallback_end)
-        except Exception:
-            pass  # Give up gracefully
-
-    return sequence_timestamps
+            files.append(item)
+    if manifest:
+        with open(manifest) as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                if line.startswith("{"):
+                    record = json.loads(line)
+                    line = record.get("audio_filepath") or record["path"]
+                files.append(line)
+    return files
+
+
+def load_batch(transcriber: Transcriber, files: list[str]) -> torch.Tensor:
+    audios = []
+    for path in files:
+        audio, sample_rate = sphn.read(path)
+        audios.append((torch.from_numpy(audio), sample_rate))
+    return transcriber.pad_batch(audios)
+
+
+def transcribe_files(transcriber: Transcriber, files: list[str], args) -> None:
+    # Similar durations in a batch keep the padding low.
+    durations = dict(zip(files, sphn.durations(files)))
+    files = sorted(files, key=lambda path: durations[path] or 0.0)
+    batches = [
+        files[i : i + args.batch_size] for i in range(0, len(files), args.batch_size)
+    ]
+
+    start = time.perf_counter()
+    with contextlib.ExitStack() as stack:
+        output = None
+        if args.output_jsonl:
+            output = stack.enter_context(open(args.output_jsonl, "w"))
+        # The next batch is read and resampled while the model runs.
+        loader = stack.enter_context(concurrent.futures.ThreadPoolExecutor(1))
+        next_batch = loader.submit(load_batch, transcriber, batches[0])
+        for index, batch_files in enumerate(batches):
+            padded_batch = next_batch.result()
+            if index + 1 < len(batches):
+                next_batch = loader.submit(load_batch, transcriber, batches[index + 1])
+            text_tokens = transcriber.batch_tokens(padded_batch)
+            batch_words = transcriber.batch_words(text_tokens)
+            for path, tokens, words in zip(batch_files, text_tokens, batch_words):
+                text = transcriber.text(tokens)
+                if output is None:
+                    print(f"{path}: {text}")
+                    continue
+                offset = args.offset_seconds
+                record = {
+                    "path": path,
+                    "duration": durations[path],
+                    "text": text,
+                    "words": [
+                        {
+                            "text": w.text,
+                            "start": w.timestamp[0] + offset,
+                            "end": w.timestamp[1] + offset,
+                        }
+                        for w in words
+                    ],
+                }
+                output.write(json.dumps(record) + "\n")
+    elapsed = time.perf_counter() - start
+
+    audio_seconds = sum(duration or 0.0 for duration in durations.values())
+    print(
+        f"Transcribed {len(files)} files, {audio_seconds:.1f}s of audio in "
+        f"{elapsed:.1f}s, RTF = {audio_seconds / elapsed:.2f}",
+        file=sys.stderr,
+    )
 
 
 def main(args):
-    info = moshi.models.loaders.CheckpointInfo.from_hf_repo(
+    files = list_files(args.in_files, args.manifest)
+    if not files:
+        raise RuntimeError("No audio file to transcribe.")
+    if args.profile or args.trace:
+        profiling.enable()
+    transcriber = Transcriber.from_hf_repo(
         args.hf_repo,
-        moshi_weights=args.moshi_weight,
-        mimi_weights=args.mimi_weight,
+        moshi_weight=args.moshi_weight,
+        mimi_weight=args.mimi_weight,
         tokenizer=args.tokenizer,
         config_path=args.config_path,
-    )
-
-    mimi = info.get_mimi(device=args.device)
-    tokenizer = info.get_text_tokenizer()
-    lm = info.get_moshi(
         device=args.device,
         dtype=torch.bfloat16,
+        quantize=args.quantize,
     )
-    lm_gen = moshi.models.LMGen(lm, temp=0, temp_text=0.0)
-
-    audio_silence_prefix_seconds = info.stt_config.get(
-        "audio_silence_prefix_seconds", 1.0
-    )
-    audio_delay_seconds = info.stt_config.get("audio_delay_seconds", 5.0)
-    padding_token_id = info.raw_config.get("text_padding_token_id", 3)
-
-    audio, input_sample_rate = sphn.read(args.in_file)
-    audio = torch.from_numpy(audio).to(args.device)
-    audio = julius.resample_frac(audio, input_sample_rate, mimi.sample_rate)
-    if audio.shape[-1] % mimi.frame_size != 0:
-        to_pad = mimi.frame_size - audio.shape[-1] % mimi.frame_size
-        audio = torch.nn.functional.pad(audio, (0, to_pad))
+    if len(files) == 1 and not args.output_jsonl:
+        audio = transcriber.load_audio(files[0])
+        decoded = transcriber.transcribe(
+            audio, transcriber.sample_rate, offset_seconds=args.offset_seconds
+        )
+        print(decoded)
+    else:
+        transcribe_files(transcriber, files, args)
+    profiling.print_summary()
+    if args.trace:
+        profiling.export_chrome_trace(args.trace)
 
-    text_tokens_accum = []
 
-    n_prefix_chunks = math.ceil(audio_silence_prefix_seconds * mimi.frame_rate)
-    n_suffix_chunks = math.ceil(audio_delay_seconds * mimi.frame_rate)
-    silence_chunk = torch.zeros(
-        (1, 1, mimi.frame_size), dtype=torch.float32, device=args.device
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Example streaming STT w/ timestamps.")
+    parser.add_argument(
+        "in_files",
+        nargs="*",
+        help="Files to transcribe, directories of audio files or glob patterns.",
     )
-
-    chunks = itertools.chain(
-        itertools.repeat(silence_chunk, n_prefix_chunks),
-        torch.split(audio[:, None], mimi.frame_size, dim=-1),
-        itertools.repeat(silence_chunk, n_suffix_chunks),
+    parser.add_argument(
+        "--manifest",
+        type=str,
+        help="File listing the audio files, one path or JSON object per line.",
     )
-
-    with mimi.streaming(1), lm_gen.streaming(1):
-        for audio_chunk in tqdm.tqdm(chunks):
-            audio_tokens = mimi.encode(audio_chunk)
-            text_tokens = lm_gen.step(audio_tokens)
-            if text_tokens is not None:
-                text_tokens_accum.append(text_tokens)
-
-    utterance_tokens = torch.concat(text_tokens_accum, dim=-1)
-    # Add the segment offset to the calculated offset
-    calculated_offset = int(n_prefix_chunks / mimi.frame_rate) + audio_delay_seconds
-    total_offset = calculated_offset + args.offset_seconds
-    
-    timed_text = tokens_to_timestamped_text(
-        utterance_tokens,
-        tokenizer,
-        mimi.frame_rate,
-        end_of_padding_id=0,
-        padding_token_id=padding_token_id,
-        offset_seconds=total_offset,
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=8,
+        help="Files transcribed together when there are several.",
+    )
+    parser.add_argument(
+        "--output-jsonl",
+        type=str,
+        help="Write the transcript and word timestamps of every file to this file.",
     )
-
-    decoded = " ".join([str(t) for t in timed_text])
-    print(decoded)
-
-
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="Example streaming STT w/ timestamps.")
-    parser.add_argument("in_file", help="The file to transcribe.")
 
     parser.add_argument(
         "--hf-repo", type=str, help="HF repo to load the STT model from. "
@@ -248,12 +198,29 @@ if __name__ == "__main__":
         default="cuda",
         help="Device on which to run, defaults to 'cuda'.",
     )
+    parser.add_argument(
+        "--quantize",
+        choices=QUANTIZE_CHOICES,
+        help="Run the LM linear layers in int8, for CPU inference (--device cpu).",
+    )
     parser.add_argument(
         "--offset-seconds",
         type=float,
         default=0.0,
         help="Time offset in seconds to add to all timestamps (for segmented audio).",
     )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Print the time spent in each inference stage (also enabled by DSM_PROFILE=1).",
+    )
+    parser.add_argument(
+        "--trace",
+        type=str,
+        help="Write a Chrome/Perfetto trace of the inference stages to this file.",
+    )
     args = parser.parse_args()
+    if not args.in_files and not args.manifest:
+        parser.error("Give files to transcribe, or a --manifest.")
 
     main(args)
@@ -1,144 +1,66 @@
 """An example script that illustrates how one can prompt Kyutai STT models."""
 
 import argparse
-import itertools
-import math
-from collections import deque
 
-import julius
-import moshi.models
-import sphn
 import torch
 import tqdm
 
-
-class PromptHook:
-    def __init__(self, tokenizer, prefix, padding_tokens=(0, 3)):
-        self.tokenizer = tokenizer
-        self.prefix_enforce = deque(self.tokenizer.encode(prefix))
-        self.padding_tokens = padding_tokens
-
-    def on_token(self, token):
-        if not self.prefix_enforce:
-            return
-
-        token = token.item()
-
-        if token in self.padding_tokens:
-            pass
-        elif token == self.prefix_enforce[0]:
-            self.prefix_enforce.popleft()
-        else:
-            assert False
-
-    def on_logits(self, logits):
-        if not self.prefix_enforce:
-            return
-
-        mask = torch.zeros_like(logits, dtype=torch.bool)
-        for t in self.padding_tokens:
-            mask[..., t] = True
-        mask[..., self.prefix_enforce[0]] = True
-
-        logits[:] = torch.where(mask, logits, float("-inf"))
+from dsm import QUANTIZE_CHOICES, Transcriber, pad_to_frame
 
 
 def main(args):
-    info = moshi.models.loaders.CheckpointInfo.from_hf_repo(
+    transcriber = Transcriber.from_hf_repo(
         args.hf_repo,
-        moshi_weights=args.moshi_weight,
-        mimi_weights=args.mimi_weight,
+        moshi_weight=args.moshi_weight,
+        mimi_weight=args.mimi_weight,
         tokenizer=args.tokenizer,
         config_path=args.config_path,
-    )
-
-    mimi = info.get_mimi(device=args.device)
-    tokenizer = info.get_text_tokenizer()
-    lm = info.get_moshi(
         device=args.device,
         dtype=torch.bfloat16,
+        prompt_text=args.prompt_text,
+        quantize=args.quantize,
     )
+    mimi = transcriber.mimi
 
-    if args.prompt_text:
-        prompt_hook = PromptHook(tokenizer, args.prompt_text)
-        lm_gen = moshi.models.LMGen(
-            lm,
-            temp=0,
-            temp_text=0.0,
-            on_text_hook=prompt_hook.on_token,
-            on_text_logits_hook=prompt_hook.on_logits,
-        )
-    else:
-        lm_gen = moshi.models.LMGen(lm, temp=0, temp_text=0.0)
-
-    audio_silence_prefix_seconds = info.stt_config.get(
-        "audio_silence_prefix_seconds", 1.0
-    )
-    audio_delay_seconds = info.stt_config.get("audio_delay_seconds", 5.0)
-    padding_token_id = info.raw_config.get("text_padding_token_id", 3)
-
-    def _load_and_process(path):
-        audio, input_sample_rate = sphn.read(path)
-        audio = torch.from_numpy(audio).to(args.device).mean(axis=0, keepdim=True)
-        audio = julius.resample_frac(audio, input_sample_rate, mimi.sample_rate)
-        if audio.shape[-1] % mimi.frame_size != 0:
-            to_pad = mimi.frame_size - audio.shape[-1] % mimi.frame_size
-            audio = torch.nn.functional.pad(audio, (0, to_pad))
-        return audio
-
-    n_prefix_chunks = math.ceil(audio_silence_prefix_seconds * mimi.frame_rate)
-    n_suffix_chunks = math.ceil(audio_delay_seconds * mimi.frame_rate)
-    silence_chunk = torch.zeros(
-        (1, 1, mimi.frame_size), dtype=torch.float32, device=args.device
-    )
-
-    audio = _load_and_process(args.file)
     if args.prompt_file:
-        audio_prompt = _load_and_process(args.prompt_file)
+        audio_prompt = transcriber.load_audio(args.prompt_file)
     else:
         audio_prompt = None
 
-    chain = [itertools.repeat(silence_chunk, n_prefix_chunks)]
-
+    # The silence prefix and the prompt are the same for every file, the
+    # models go through them once and each file starts from a snapshot.
     if audio_prompt is not None:
-        chain.append(torch.split(audio_prompt[:, None, :], mimi.frame_size, dim=-1))
         # adding a bit (0.8s) of silence to separate prompt and the actual audio
-        chain.append(itertools.repeat(silence_chunk, 10))
-
-    chain += [
-        torch.split(audio[:, None, :], mimi.frame_size, dim=-1),
-        itertools.repeat(silence_chunk, n_suffix_chunks),
-    ]
-
-    chunks = itertools.chain(*chain)
-
-    text_tokens_accum = []
-    with mimi.streaming(1), lm_gen.streaming(1):
-        for audio_chunk in tqdm.tqdm(chunks):
-            audio_tokens = mimi.encode(audio_chunk)
-            text_tokens = lm_gen.step(audio_tokens)
-            if text_tokens is not None:
-                text_tokens_accum.append(text_tokens)
-
-    utterance_tokens = torch.concat(text_tokens_accum, dim=-1)
-    text_tokens = utterance_tokens.cpu().view(-1)
+        silence = torch.zeros((1, 10 * mimi.frame_size), device=args.device)
+        audio_prompt = pad_to_frame(audio_prompt, mimi.frame_size)
+        prompt_frames = audio_prompt.shape[-1] // mimi.frame_size
+        snapshot = transcriber.prefix_snapshot([audio_prompt, silence])
+    else:
+        snapshot = transcriber.silence_snapshot()
 
-    # if we have an audio prompt and we don't want to have it in the transcript,
-    # we should cut the corresponding number of frames from the output tokens.
-    # However, there is also some amount of padding that happens before it
-    # due to silence_prefix and audio_delay. Normally it is ignored in detokenization,
-    # but now we should account for it to find the position of the prompt transcript.
-    if args.cut_prompt_transcript and audio_prompt is not None:
-        prompt_frames = audio_prompt.shape[1] // mimi.frame_size
-        no_prompt_offset_seconds = audio_delay_seconds + audio_silence_prefix_seconds
-        no_prompt_offset = int(no_prompt_offset_seconds * mimi.frame_rate)
-        text_tokens = text_tokens[prompt_frames + no_prompt_offset :]
+    for path in args.file:
+        audio = transcriber.load_audio(path)
+        frames = transcriber.frames([audio], n_prefix=0)
+        text_tokens = torch.concat(
+            list(transcriber.stream(tqdm.tqdm(frames), snapshot)), dim=-1
+        )
+        text_tokens = text_tokens.cpu().view(-1)
 
-    text = tokenizer.decode(
-        text_tokens[text_tokens > padding_token_id].numpy().tolist()
-    )
+        # if we have an audio prompt and we don't want to have it in the transcript,
+        # we should cut the corresponding number of frames from the output tokens.
+        # However, there is also some amount of padding that happens before it
+        # due to silence_prefix and audio_delay. Normally it is ignored in detokenization,
+        # but now we should account for it to find the position of the prompt transcript.
+        if args.cut_prompt_transcript and audio_prompt is not None:
+            no_prompt_offset_seconds = (
+                transcriber.audio_delay_seconds
+                + transcriber.audio_silence_prefix_seconds
+            )
+            no_prompt_offset = int(no_prompt_offset_seconds * mimi.frame_rate)
+            text_tokens = text_tokens[prompt_frames + no_prompt_offset :]
 
-    print(text)
+        text = transcriber.text(text_tokens)
+        print(f"{path}: {text}" if len(args.file) > 1 else text)
 
 
 if __name__ == "__main__":
@@ -146,7 +68,8 @@ if __name__ == "__main__":
     parser.add_argument(
         "--file",
         required=True,
-        help="File to transcribe.",
+        nargs="+",
+        help="Files to transcribe, the prompt is only processed once for all of them.",
     )
     parser.add_argument(
         "--prompt_file",
@@ -182,6 +105,11 @@ if __name__ == "__main__":
         default="cuda",
         help="Device on which to run, defaults to 'cuda'.",
     )
+    parser.add_argument(
+        "--quantize",
+        choices=QUANTIZE_CHOICES,
+        help="Run the LM linear layers in int8, for CPU inference (--device cpu).",
+    )
     args = parser.parse_args()
 
     main(args)
@@ -0,0 +1,170 @@
+"""The array decoding of `tokens_to_timestamped_text_batch` against the
+reference `_decode_segment`, on a small SentencePiece-like vocabulary.
+
+    uv run --with pytest --with numpy --with torch pytest scripts/tests
+"""
+
+import random
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from dsm.text import (  # noqa: E402
+    IncrementalWords,
+    _decode_segment,
+    tokens_to_timestamped_text_batch,
+)
+
+END_OF_PADDING = 0
+EOS = 2
+PADDING = 3
+FRAME_RATE = 12.5
+# The control pieces first, as in the STT tokenizers. Digits and some letters
+# have no `▁`-merged piece, so they come after a bare `▁`.
+PIECES = [
+    "<epad>", "<s>", "</s>", "<pad>",
+    "▁", "▁our", "▁the", "▁there", "re", "M", "x",
+    "▁2", "0", "2", "4", "▁caf",
+] + [f"<0x{byte:02X}>" for byte in range(256)]  # fmt: skip
+WORDS = ["our", "the", "there", "re", "M", "x", "2024", "40", "café", "A", "Ax"]
+
+
+class FakeTokenizer:
+    """The subset of the SentencePiece API used by `dsm.text`, with greedy
+    longest-match encoding and byte fallback."""
+
+    def __init__(self):
+        self.pieces = PIECES
+        self.ids = {piece: index for index, piece in enumerate(PIECES)}
+
+    def get_piece_size(self):
+        return len(self.pieces)
+
+    def id_to_piece(self, index):
+        return self.pieces[index]
+
+    def is_byte(self, index):
+        return self.pieces[index].startswith("<0x")
+
+    def is_control(self, index):
+        return index <= PADDING
+
+    def is_unknown(self, index):
+        return False
+
+    def eos_id(self):
+        return EOS
+
+    def decode(self, ids):
+        data = b""
+        for index in ids:
+            if self.is_control(index):
+                continue
+            piece = self.pieces[index]
+            if self.is_byte(index):
+                data += bytes([int(piece[3:5], 16)])
+            else:
+                data += piece.replace("▁", " ").encode()
+        return data.decode(errors="replace").lstrip(" ")
+
+    def encode(self, text):
+        text = "▁" + text.replace(" ", "▁")
+        ids = []
+        position = 0
+        while position < len(text):
+            for end in range(len(text), position, -1):
+                index = self.ids.get(text[position:end])
+                if index is not None and not self.is_byte(index):
+                    ids.append(index)
+                    position = end
+                    break
+            else:
+                for byte in text[position].encode():
+                    ids.append(self.ids[f"<0x{byte:02X}>"])
+                position += 1
+        return ids
+
+
+TOKENIZER = FakeTokenizer()
+
+
+def _tstmp(start, end):
+    return (max(0, start / FRAME_RATE), max(0, end / FRAME_RATE))
+
+
+def reference_words(tokens: list[int]) -> list[tuple[str, tuple[float, float]]]:
+    """Segment by segment, as `tokens_to_timestamped_text` did before the
+    array implementation."""
+    boundaries = [i for i, token in enumerate(tokens) if token == END_OF_PADDING]
+    words = []
+    for index, boundary in enumerate(boundaries):
+        start = boundary + 1
+        if index + 1 < len(boundaries):
+            end = boundaries[index + 1]
+        elif EOS in tokens[start:]:
+            end = tokens.index(EOS, start)
+        else:
+            end = min(len(tokens), int(start + FRAME_RATE))
+        kept = [t for t in tokens[start:end] if t > PADDING]
+        words += _decode_segment(kept, start, end, TOKENIZER, _tstmp)
+    return [(word.text, word.timestamp) for word in words]
+
+
+def fast_words(tokens: list[int]) -> list[tuple[str, tuple[float, float]]]:
+    words = tokens_to_timestamped_text_batch(
+        np.array([tokens]),
+        TOKENIZER,
+        FRAME_RATE,
+        end_of_padding_id=END_OF_PADDING,
+        padding_token_id=PADDING,
+        offset_seconds=0.0,
+    )[0]
+    return [(word.text, word.timestamp) for word in words]
+
+
+def random_stream(rng: random.Random) -> list[int]:
+    tokens = [PADDING] * rng.randint(0, 3)
+    for _ in range(rng.randint(1, 6)):
+        tokens.append(END_OF_PADDING)
+        # Several words in a segment when the boundaries were omitted.
+        for word in rng.choices(WORDS, k=rng.randint(1, 3)):
+            for token in TOKENIZER.encode(word):
+                tokens.append(token)
+                tokens += [PADDING] * rng.randint(0, 1)
+        tokens += [PADDING] * rng.randint(0, 20)
+    if rng.random() < 0.5:
+        tokens.append(EOS)
+    return tokens
+
+
+def test_bare_word_start():
+    # " 2024 x" is "▁2 0 2 4 ▁ x", the bare `▁` starts the second word.
+    tokens = [END_OF_PADDING] + TOKENIZER.encode("2024 x") + [PADDING] * 5
+    assert TOKENIZER.encode("x") == [TOKENIZER.ids["▁"], TOKENIZER.ids["x"]]
+    assert [text for text, _ in fast_words(tokens)] == ["2024", "x"]
+    assert fast_words(tokens) == reference_words(tokens)
+
+
+def test_trailing_bare_word_start():
+    # Cut after the `▁` of "x", the empty word is dropped and "2024" ends at
+    # the boundary.
+    tokens = [END_OF_PADDING] + TOKENIZER.encode("2024 x")[:-1] + [END_OF_PADDING]
+    assert fast_words(tokens) == reference_words(tokens) == [("2024", (0.08, 0.48))]
+
+
+@pytest.mark.parametrize("seed", range(300))
+def test_matches_reference(seed):
+    tokens = random_stream(random.Random(seed))
+    assert fast_words(tokens) == reference_words(tokens)
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_incremental_matches_batch(seed):
+    tokens = random_stream(random.Random(seed))
+    words = IncrementalWords(TOKENIZER, FRAME_RATE, PADDING, offset_seconds=0.0)
+    incremental = words.push(tokens) + words.finish()
+    assert [(w.text, w.timestamp) for w in incremental] == reference_words(tokens)